@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for markdown rendering of layout cells
+
+Compares the per-page cost of rendering both markdown variants (with and
+without page header/footer) the old way, with two layoutjson2md calls, against
+a single render_markdown_variants pass. Runs on a formula-heavy page and a
+picture-heavy page built in memory, so no model or API is needed.
+
+Usage:
+    python benchmarks/bench_markdown.py [--repeat 20]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dots_ocr.utils.format_transformer import layoutjson2md, render_markdown_variants
+
+
+FORMULAS = [
+    r"$$E = mc^2$$",
+    r"\[ \int_0^1 x^2 \, dx = \frac{1}{3} \]",
+    r"\sum_{i=1}^{n} i = \frac{n(n+1)}{2}",
+    r"G = 4\pi r^2",
+    r"\begin{aligned} a &= b + c \\ d &= e \end{aligned}",
+]
+TEXTS = [
+    r"The rate is ( 2.2 \times 10^{-5} ) per second, see \(k_{B}T\).",
+    "Plain paragraph text without any math in it, repeated to a realistic length. " * 3,
+    r"Water ($H_2O$) and glucose ($C_6H_{12}O_6$) are \textbf{common}.",
+]
+
+
+def make_page(width=1654, height=2339):
+    """Creates a page image with some noise so PNG crops are not trivially compressible"""
+    image = Image.new("RGB", (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    rng = random.Random(0)
+    for _ in range(4000):
+        x, y = rng.randrange(width), rng.randrange(height)
+        draw.rectangle((x, y, x + 6, y + 6), fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    return image
+
+
+def make_cells(kind, width=1654, height=2339):
+    rng = random.Random(1)
+    cells = [
+        {"bbox": [100, 40, width - 100, 90], "category": "Page-header", "text": "Journal of Benchmarks"},
+        {"bbox": [100, height - 90, width - 100, height - 40], "category": "Page-footer", "text": "Page 1"},
+    ]
+    y = 120
+    while y < height - 200:
+        if kind == "formula":
+            category = "Formula" if rng.random() < 0.6 else "Text"
+            text = rng.choice(FORMULAS) if category == "Formula" else rng.choice(TEXTS)
+            box_height = 60
+        else:
+            category = "Picture" if rng.random() < 0.6 else "Caption"
+            text = "" if category == "Picture" else "Figure caption text."
+            box_height = 220 if category == "Picture" else 40
+        cells.append({"bbox": [100, y, width - 100, y + box_height], "category": category, "text": text})
+        y += box_height + 10
+    return cells
+
+
+def bench(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark markdown rendering of layout cells")
+    parser.add_argument("--repeat", type=int, default=20, help="Number of timed runs per case")
+    args = parser.parse_args()
+
+    image = make_page()
+    for kind in ["formula", "picture"]:
+        cells = make_cells(kind)
+
+        def two_calls():
+            layoutjson2md(image, cells, text_key="text")
+            layoutjson2md(image, cells, text_key="text", no_page_hf=True)
+
+        def single_pass():
+            render_markdown_variants(image, cells, text_key="text")
+
+        legacy = bench(two_calls, args.repeat)
+        single = bench(single_pass, args.repeat)
+        print(f"{kind}-heavy page ({len(cells)} cells):")
+        print(f"  2 x layoutjson2md:         {legacy * 1000:8.2f} ms")
+        print(f"  render_markdown_variants:  {single * 1000:8.2f} ms  ({legacy / single:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
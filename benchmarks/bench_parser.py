@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of DotsOCRParser against the mock backend
+
+Generates synthetic documents (see synthetic_docs.py), starts the mock
+OpenAI-compatible server (see mock_server.py) and runs DotsOCRParser.parse_file
+over each scenario. Every scenario runs in a fresh process, so its peak RSS is
+its own. Reported per scenario: pages/sec, p50/p95 per pipeline stage, peak
+RSS, and the number and size of the files written.
+
+Results are written as JSON together with the git commit, so runs can be
+compared across commits:
+
+Usage:
+    python benchmarks/bench_parser.py
+    python benchmarks/bench_parser.py --pages 32 --num_thread 16 --latency lognormal:-1,0.5 --output_sink jsonl
+    python benchmarks/bench_parser.py --compare benchmarks/results/<earlier run>.json
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from mock_server import MockChatServer
+from synthetic_docs import make_corpus
+
+
+# name -> what is generated; parse_file is called once per generated file
+SCENARIOS = {
+    "text_pdf": {"pdfs": 1, "images": 0, "text_density": 1.0},
+    "mixed_pdf": {"pdfs": 1, "images": 0, "text_density": 0.6, "tables": 1, "formulas": 2, "pictures": 1},
+    "images": {"pdfs": 0, "text_density": 0.8, "tables": 1, "formulas": 1, "pictures": 1},
+}
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT_DIR, capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def output_size(output_dir):
+    files = size = 0
+    for root, _, names in os.walk(output_dir):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return files, size
+
+
+def run_scenario(paths, base_url, output_dir, config, result_queue):
+    """Runs in a child process: parses paths and reports the measurements"""
+    if not config["verbose"]:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+    os.environ["BASE_URL"] = base_url
+
+    from dots_ocr.parser import DotsOCRParser
+    from dots_ocr.utils.timing import summarize_timings
+
+    parser = DotsOCRParser(
+        num_thread=config["num_thread"],
+        dpi=config["dpi"],
+        output_dir=output_dir,
+        request_delay=0,
+        max_completion_tokens=config["max_completion_tokens"],
+        output_sink=config["output_sink"],
+    )
+    rss_before = peak_rss_mb()
+    results = []
+    start = time.perf_counter()
+    try:
+        for path in paths:
+            results.extend(parser.parse_file(path, prompt_mode=config["prompt"]))
+    finally:
+        parser.close()
+    elapsed = time.perf_counter() - start
+
+    summary = summarize_timings(results)
+    files, size = output_size(output_dir)
+    result_queue.put({
+        "documents": len(paths),
+        "pages": len(results),
+        "filtered_pages": sum(1 for r in results if r.get("filtered")),
+        "seconds": round(elapsed, 3),
+        "pages_per_sec": round(len(results) / elapsed, 3) if elapsed else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "peak_rss_mb_at_start": round(rss_before, 1),
+        "files_written": files,
+        "bytes_written": size,
+        "payload_bytes": summary["payload_bytes"],
+        "tokens": summary["tokens"],
+        "retries": summary["retries"],
+        "stages": {
+            stage: {"p50": stats["p50"], "p95": stats["p95"], "total_ms": stats["total_ms"]}
+            for stage, stats in summary["stages"].items()
+        },
+    })
+
+
+def print_scenario(name, result):
+    print(f"{name}: {result['pages']} pages in {result['seconds']:.2f}s = {result['pages_per_sec']:.2f} pages/s, "
+          f"peak RSS {result['peak_rss_mb']:.0f} MB, {result['files_written']} files / {result['bytes_written'] / 1024 / 1024:.1f} MB written, "
+          f"{result['mock']['rate_limited']} x 429")
+    for stage, stats in result["stages"].items():
+        print(f"  {stage:<13} p50 {stats['p50']:9.1f} ms   p95 {stats['p95']:9.1f} ms")
+
+
+def print_comparison(previous, current):
+    print(f"\nCompared with {previous.get('git_commit')} ({previous.get('created')}):")
+    for name, result in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        print(f"  {name}: pages/s {before['pages_per_sec']:.2f} -> {result['pages_per_sec']:.2f} "
+              f"({result['pages_per_sec'] / before['pages_per_sec']:.2f}x), "
+              f"peak RSS {before['peak_rss_mb']:.0f} -> {result['peak_rss_mb']:.0f} MB, "
+              f"bytes written {before['bytes_written'] / 1024 / 1024:.1f} -> {result['bytes_written'] / 1024 / 1024:.1f} MB")
+        for stage, stats in result["stages"].items():
+            old = before["stages"].get(stage)
+            if old:
+                print(f"    {stage:<13} p50 {old['p50']:9.1f} -> {stats['p50']:9.1f} ms   p95 {old['p95']:9.1f} -> {stats['p95']:9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end parser benchmark against the mock backend")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--pages", type=int, default=16, help="Pages per PDF")
+    parser.add_argument("--images", type=int, default=8, help="Images of the images scenario")
+    parser.add_argument("--num_thread", type=int, default=8)
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--prompt", type=str, default="prompt_layout_all_en")
+    parser.add_argument("--output_sink", type=str, choices=["files", "jsonl", "sqlite", "null"], default="files")
+    parser.add_argument("--max_completion_tokens", type=int, default=16384)
+    # Mock backend
+    parser.add_argument("--latency", type=str, default="fixed:0.2", help="Latency spec of the mock server")
+    parser.add_argument("--tokens_per_sec", type=float, default=0.0)
+    parser.add_argument("--rate_429", type=float, default=0.0)
+    parser.add_argument("--retry_after", type=float, default=None)
+    parser.add_argument("--rate_5xx", type=float, default=0.0)
+    parser.add_argument("--malformed_rate", type=float, default=0.0)
+    parser.add_argument("--looping_rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    # Results
+    parser.add_argument("--output", type=str, default=None, help="Result JSON (default: benchmarks/results/<time>_<commit>.json)")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier result JSON to compare with")
+    parser.add_argument("--keep_outputs", action="store_true", help="Keep the generated documents and parser outputs")
+    parser.add_argument("--verbose", action="store_true", help="Show the parser's own output")
+    args = parser.parse_args()
+
+    commit, dirty = git_commit()
+    work_dir = tempfile.mkdtemp(prefix="dots_ocr_bench_")
+    server = MockChatServer(
+        latency=args.latency, tokens_per_sec=args.tokens_per_sec, rate_429=args.rate_429, retry_after=args.retry_after,
+        rate_5xx=args.rate_5xx, malformed_rate=args.malformed_rate, looping_rate=args.looping_rate, seed=args.seed,
+    ).start()
+    context = multiprocessing.get_context("spawn")
+    report = {
+        "benchmark": "bench_parser",
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "git_dirty": dirty,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "scenarios": {},
+    }
+
+    try:
+        for name in args.scenarios:
+            spec = dict(SCENARIOS[name])
+            if name == "images":
+                spec["images"] = args.images
+            paths = make_corpus(os.path.join(work_dir, name, "input"), pages=args.pages, seed=args.seed, **spec)
+
+            server.reset_peak()
+            mock_before = server.stats()
+            result_queue = context.Queue()
+            process = context.Process(
+                target=run_scenario,
+                args=(paths, server.base_url, os.path.join(work_dir, name, "output"), vars(args), result_queue),
+            )
+            process.start()
+            while True:
+                try:
+                    result = result_queue.get(timeout=1)
+                    break
+                except queue.Empty:
+                    if not process.is_alive():
+                        raise RuntimeError(f"scenario {name} failed (exit code {process.exitcode}), rerun with --verbose")
+            process.join()
+            mock_after = server.stats()
+            result["input_bytes"] = sum(os.path.getsize(p) for p in paths)
+            result["mock"] = {k: mock_after[k] - mock_before[k] for k in ("requests", "ok", "rate_limited", "server_error", "malformed", "looping")}
+            result["mock"]["peak_in_flight"] = mock_after["peak_in_flight"]
+            report["scenarios"][name] = result
+            print_scenario(name, result)
+    finally:
+        server.stop()
+        if not args.keep_outputs:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        else:
+            print(f"Documents and outputs kept in {work_dir}")
+
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"{datetime.datetime.now():%Y%m%d-%H%M%S}_{commit or 'nogit'}{'-dirty' if dirty else ''}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
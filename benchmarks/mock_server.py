@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Mock OpenAI-compatible backend for load tests and benchmarks
+
+Serves POST /v1/chat/completions like the providers inference_with_api talks
+to, without a model: responses are synthetic layout JSON (or markdown for the
+markdown prompts), or responses recorded earlier, sent back after a simulated
+latency. Failures seen in production can be injected: 429s (random or from an
+RPM limit, with Retry-After), 5xx errors, malformed (truncated) JSON and
+looping outputs that run into the token limit.
+
+GET /stats returns the request counters as JSON, GET /v1/models lists the model.
+
+Usage:
+    python benchmarks/mock_server.py --port 8000 --latency lognormal:0.7,0.4 --tokens_per_sec 80 --rate_429 0.05
+    python -m dots_ocr.parser doc.pdf --ip 127.0.0.1 --port 8000 --request_delay 0
+
+In-process (used by the benchmarks):
+    server = MockChatServer(latency="fixed:0.05").start()
+    os.environ["BASE_URL"] = server.base_url
+    ...
+    server.stop()
+
+Latency specs: fixed:S, uniform:LO,HI, normal:MEAN,STD, lognormal:MU,SIGMA
+(seconds; lognormal takes the mean and sigma of the underlying normal of ln(S)).
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+IMAGE_FACTOR = 28
+CHARS_PER_TOKEN = 4
+
+WORDS = (
+    "the of and to in is for that with on as by this are from at be which results data model "
+    "analysis method table figure value system process between under against performance document"
+).split()
+FORMULAS = [r"E = mc^2", r"\int_0^1 x^2 \, dx = \frac{1}{3}", r"\sum_{i=1}^{n} i = \frac{n(n+1)}{2}"]
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # benchmarks open many connections at once
+
+
+class LatencyModel:
+    """Samples a response latency in seconds from a spec like "lognormal:0.7,0.4\""""
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal")
+
+    def __init__(self, spec: str = "fixed:0"):
+        kind, _, params = spec.partition(":")
+        if kind not in self.KINDS:
+            raise ValueError(f"latency kind should be one of {self.KINDS}, got {kind}")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",")] if params else [0.0]
+        self.spec = spec
+
+    def sample(self, rng: random.Random) -> float:
+        p = self.params
+        if self.kind == "fixed":
+            value = p[0]
+        elif self.kind == "uniform":
+            value = rng.uniform(p[0], p[1])
+        elif self.kind == "normal":
+            value = rng.gauss(p[0], p[1])
+        else:
+            value = rng.lognormvariate(p[0], p[1])
+        return max(0.0, value)
+
+
+def image_size_from_data_url(url: str):
+    """Reads width and height from the header of a base64 PNG data URL without decoding the image"""
+    try:
+        header = base64.b64decode(url.split(",", 1)[1][:32])
+        if header[:8] == b"\x89PNG\r\n\x1a\n":
+            return int.from_bytes(header[16:20], "big"), int.from_bytes(header[20:24], "big")
+    except (IndexError, ValueError):
+        pass
+    return None
+
+
+def load_recorded(path: str):
+    """
+    Loads recorded model outputs to replay in turn, as (content, latency) pairs.
+
+    path is a .jsonl (or .jsonl.gz) file with one {"content": ..., "latency": ...}
+    object per line, e.g. an archive written with the parser's --record, or a
+    directory of .json (layout cells, as written by the parser) and .md files.
+    Latency is None where it was not recorded.
+    """
+    contents = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            file_path = os.path.join(path, name)
+            if name.endswith(".json"):
+                with open(file_path, "r", encoding="utf-8") as f:
+                    contents.append((json.dumps(json.load(f), ensure_ascii=False), None))
+            elif name.endswith(".md"):
+                with open(file_path, "r", encoding="utf-8") as f:
+                    contents.append((f.read(), None))
+    else:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    contents.append((record["content"], record.get("latency")))
+    if not contents:
+        raise ValueError(f"no recorded responses found in {path}")
+    return contents
+
+
+class MockChatServer:
+    """
+    OpenAI-compatible chat completions server with simulated latency and failures.
+
+    Args:
+        host, port: Address to listen on (port 0 picks a free one).
+        latency: Latency spec of the base response time, see LatencyModel.
+        tokens_per_sec: Completion tokens generated per second (0 = instant).
+        prefill_tokens_per_sec: Prompt tokens (image patches + text) processed per second (0 = instant).
+        rate_429: Probability of answering 429.
+        rate_5xx: Probability of answering 500/502/503.
+        retry_after: Retry-After seconds sent with 429s (None sends no header).
+        rpm: Requests per minute accepted before answering 429 (None = unlimited).
+        malformed_rate: Probability of truncating the response JSON.
+        looping_rate: Probability of a looping response that repeats until max_completion_tokens.
+        recorded: Path of recorded responses (see load_recorded); replaces the synthetic ones.
+        recorded_latency: Answer recorded responses after their recorded latency instead of a sampled one.
+        cells_per_page: Number of layout cells of synthetic responses.
+        seed: Seed of the random generator, for reproducible runs.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency="fixed:0",
+        tokens_per_sec=0.0,
+        prefill_tokens_per_sec=0.0,
+        rate_429=0.0,
+        rate_5xx=0.0,
+        retry_after=None,
+        rpm=None,
+        malformed_rate=0.0,
+        looping_rate=0.0,
+        recorded=None,
+        recorded_latency=False,
+        cells_per_page=12,
+        seed=0,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = LatencyModel(latency)
+        self.tokens_per_sec = tokens_per_sec
+        self.prefill_tokens_per_sec = prefill_tokens_per_sec
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.rpm = rpm
+        self.malformed_rate = malformed_rate
+        self.looping_rate = looping_rate
+        self.recorded = load_recorded(recorded) if recorded else None
+        self.recorded_latency = recorded_latency
+        self.cells_per_page = cells_per_page
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._accepted = deque()   # monotonic times of requests counted against the rpm limit
+        self._recorded_index = 0
+        self._server = None
+        self.counters = {
+            "requests": 0, "ok": 0, "rate_limited": 0, "server_error": 0,
+            "malformed": 0, "looping": 0, "in_flight": 0, "peak_in_flight": 0,
+            "prompt_tokens": 0, "completion_tokens": 0, "bytes_received": 0,
+        }
+
+    # ---------- lifecycle ----------
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self) -> "MockChatServer":
+        """Starts serving from a daemon thread; self.port holds the bound port"""
+        self._server = _HTTPServer((self.host, self.port), self._make_handler())
+        self.port = self._server.server_port
+        threading.Thread(target=self._server.serve_forever, name="mock-chat-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters)
+
+    def reset_peak(self):
+        """Restarts peak_in_flight from the current concurrency, e.g. between benchmark runs"""
+        with self._lock:
+            self.counters["peak_in_flight"] = self.counters["in_flight"]
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.counters[key] += value
+
+    # ---------- decisions ----------
+
+    def _draw(self) -> dict:
+        """Picks the fate of a request under the lock, so runs with a seed are reproducible"""
+        with self._lock:
+            self.counters["requests"] += 1
+            now = time.monotonic()
+            if self.rpm:
+                while self._accepted and now - self._accepted[0] >= 60:
+                    self._accepted.popleft()
+                if len(self._accepted) >= self.rpm:
+                    return {"fate": "429", "retry_after": 60 - (now - self._accepted[0])}
+                self._accepted.append(now)
+            roll = self._rng.random()
+            if roll < self.rate_429:
+                return {"fate": "429", "retry_after": self.retry_after}
+            if roll < self.rate_429 + self.rate_5xx:
+                return {"fate": "5xx", "status": self._rng.choice((500, 502, 503))}
+            draw = {
+                "fate": "ok",
+                "latency": self.latency.sample(self._rng),
+                "content_roll": self._rng.random(),
+                "seed": self._rng.getrandbits(32),
+            }
+            if self.recorded is not None:
+                content, latency = self.recorded[self._recorded_index % len(self.recorded)]
+                self._recorded_index += 1
+                draw["recorded"] = content
+                if self.recorded_latency and latency is not None:
+                    draw["latency"] = latency
+            return draw
+
+    def _layout_content(self, width, height, rng):
+        """Synthetic layout JSON in the coordinates of the image that was sent"""
+        margin = max(8, width // 14)
+        cells = [{"bbox": [margin, 10, width - margin, 40], "category": "Page-header", "text": "Synthetic Journal"}]
+        y = 60
+        n = max(1, self.cells_per_page - 2)
+        step = max(30, (height - 140) // n)
+        for i in range(n):
+            y2 = min(height - 60, y + step - 10)
+            if y2 <= y:
+                break
+            bbox = [margin, y, width - margin, y2]
+            if i == 0:
+                cells.append({"bbox": bbox, "category": "Title", "text": "A Synthetic Page"})
+            elif i % 7 == 3:
+                rows = "".join(f"<tr><td>{rng.randint(0, 999)}</td><td>{rng.choice(WORDS)}</td></tr>" for _ in range(4))
+                cells.append({"bbox": bbox, "category": "Table", "text": f"<table><thead><tr><th>Id</th><th>Name</th></tr></thead><tbody>{rows}</tbody></table>"})
+            elif i % 7 == 5:
+                cells.append({"bbox": bbox, "category": "Formula", "text": rng.choice(FORMULAS)})
+            elif i % 7 == 6:
+                cells.append({"bbox": bbox, "category": "Picture", "text": ""})
+            else:
+                words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 80)))
+                cells.append({"bbox": bbox, "category": "Text", "text": words.capitalize() + "."})
+            y = y2 + 10
+        cells.append({"bbox": [margin, height - 40, width - margin, height - 10], "category": "Page-footer", "text": "1"})
+        return json.dumps(cells, ensure_ascii=False)
+
+    def _markdown_content(self, rng):
+        paragraphs = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(30, 90))).capitalize() + "." for _ in range(self.cells_per_page)]
+        return "# A Synthetic Page\n\n" + "\n\n".join(paragraphs)
+
+    def _looping_content(self, layout, max_tokens):
+        """What a model stuck in a loop emits: the same fragment until the token limit cuts it off"""
+        if layout:
+            head, unit = '[{"bbox": [10, 10, 200, 40], "category": "Text", "text": "', "the same line again "
+        else:
+            head, unit = "# A Synthetic Page\n\n", "| the same row | again |\n"
+        budget = max_tokens * CHARS_PER_TOKEN - len(head)
+        return head + unit * max(1, budget // len(unit))
+
+    # ---------- HTTP ----------
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send_json(self, status, payload, headers=None):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/stats":
+                    self._send_json(200, mock.stats())
+                elif self.path.rstrip("/") == "/v1/models":
+                    self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length)
+                mock._count("bytes_received", len(raw))
+                if self.path.rstrip("/") != "/v1/chat/completions":
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                try:
+                    request = json.loads(raw)
+                except ValueError:
+                    self._send_json(400, {"error": {"message": "invalid JSON body", "type": "invalid_request_error"}})
+                    return
+                mock._complete(self, request)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _complete(self, handler, request):
+        draw = self._draw()
+        if draw["fate"] == "429":
+            self._count("rate_limited")
+            retry_after = draw["retry_after"]
+            headers = {"Retry-After": f"{max(1, round(retry_after))}"} if retry_after is not None else None
+            handler._send_json(429, {"error": {"message": "Rate limit reached (429), please retry later", "type": "rate_limit_exceeded", "code": "rate_limit_exceeded"}}, headers)
+            return
+        if draw["fate"] == "5xx":
+            self._count("server_error")
+            handler._send_json(draw["status"], {"error": {"message": "The server had an error while processing your request", "type": "server_error"}})
+            return
+
+        text, size = "", None
+        for message in request.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, str):
+                text += content
+                continue
+            for part in content or []:
+                if part.get("type") == "text":
+                    text += part.get("text", "")
+                elif part.get("type") == "image_url":
+                    size = image_size_from_data_url(part["image_url"]["url"]) or size
+        width, height = size or (1000, 1400)
+        max_tokens = int(request.get("max_completion_tokens") or request.get("max_tokens") or 4096)
+        prompt_tokens = (width // IMAGE_FACTOR) * (height // IMAGE_FACTOR) + len(text) // CHARS_PER_TOKEN
+        layout = '"bbox"' in text
+
+        # A per-request generator keeps the content independent of the order requests are served in
+        rng = random.Random(draw["seed"])
+        roll = draw["content_roll"]
+        kind = "ok"
+        if roll < self.looping_rate:
+            content = self._looping_content(layout, max_tokens)
+            kind = "looping"
+        elif "recorded" in draw:
+            content = draw["recorded"]
+        else:
+            content = self._layout_content(width, height, rng) if layout else self._markdown_content(rng)
+        if kind == "ok" and roll < self.looping_rate + self.malformed_rate:
+            content = content[: max(1, int(len(content) * rng.uniform(0.3, 0.9)))]
+            kind = "malformed"
+
+        completion_tokens = max(1, len(content) // CHARS_PER_TOKEN)
+        finish_reason = "stop"
+        if completion_tokens > max_tokens:
+            content = content[: max_tokens * CHARS_PER_TOKEN]
+            completion_tokens = max_tokens
+            finish_reason = "length"
+        if kind == "looping":
+            finish_reason = "length"
+
+        delay = draw["latency"]
+        if self.prefill_tokens_per_sec:
+            delay += prompt_tokens / self.prefill_tokens_per_sec
+        if self.tokens_per_sec:
+            delay += completion_tokens / self.tokens_per_sec
+
+        with self._lock:
+            self.counters["in_flight"] += 1
+            self.counters["peak_in_flight"] = max(self.counters["peak_in_flight"], self.counters["in_flight"])
+        try:
+            time.sleep(delay)
+        finally:
+            with self._lock:
+                self.counters["in_flight"] -= 1
+                self.counters[kind] += 1
+                self.counters["prompt_tokens"] += prompt_tokens
+                self.counters["completion_tokens"] += completion_tokens
+
+        handler._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason,
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible /v1/chat/completions server")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=str, default="fixed:0.5", help="fixed:S, uniform:LO,HI, normal:MEAN,STD or lognormal:MU,SIGMA")
+    parser.add_argument("--tokens_per_sec", type=float, default=0.0, help="Completion tokens per second (0 = instant)")
+    parser.add_argument("--prefill_tokens_per_sec", type=float, default=0.0, help="Prompt tokens per second (0 = instant)")
+    parser.add_argument("--rate_429", type=float, default=0.0, help="Probability of a 429 response")
+    parser.add_argument("--rate_5xx", type=float, default=0.0, help="Probability of a 500/502/503 response")
+    parser.add_argument("--retry_after", type=float, default=None, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--rpm", type=int, default=None, help="Requests per minute before answering 429")
+    parser.add_argument("--malformed_rate", type=float, default=0.0, help="Probability of a truncated response")
+    parser.add_argument("--looping_rate", type=float, default=0.0, help="Probability of a looping response up to the token limit")
+    parser.add_argument("--recorded", type=str, default=None, help="Archive written with the parser's --record (.jsonl/.jsonl.gz) or a directory of .json/.md outputs to replay")
+    parser.add_argument("--recorded_latency", action="store_true", help="Use the latency stored with recorded responses")
+    parser.add_argument("--cells_per_page", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockChatServer(
+        host=args.host, port=args.port, latency=args.latency,
+        tokens_per_sec=args.tokens_per_sec, prefill_tokens_per_sec=args.prefill_tokens_per_sec,
+        rate_429=args.rate_429, rate_5xx=args.rate_5xx, retry_after=args.retry_after, rpm=args.rpm,
+        malformed_rate=args.malformed_rate, looping_rate=args.looping_rate,
+        recorded=args.recorded, recorded_latency=args.recorded_latency, cells_per_page=args.cells_per_page, seed=args.seed,
+    ).start()
+    print(f"Mock chat completions at {server.base_url} (latency {args.latency}), stats at http://{args.host}:{server.port}/stats")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(server.stats()))
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Synthetic documents for benchmarks
+
+Generates PDFs with real (vector) text and images of the same pages, with
+control over the page count and the content of each page: text density,
+tables, formulas and pictures. Content is drawn from a seeded generator, so
+the same arguments always produce the same files.
+
+Usage:
+    python benchmarks/synthetic_docs.py ./bench_docs --pdfs 2 --pages 10 --images 5 --tables 1 --formulas 2 --pictures 1
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+
+import fitz
+import numpy as np
+from PIL import Image
+
+WORDS = (
+    "the of and to in is for that with on as by this are from at be which results data model analysis "
+    "method table figure value system process between under against performance document layout page "
+    "measurement throughput latency request response concurrency parser markdown benchmark synthetic"
+).split()
+FORMULAS = [
+    "E = m c^2",
+    "f(x) = a_0 + a_1 x + a_2 x^2 + ... + a_n x^n",
+    "sum_{i=1}^{n} i = n (n + 1) / 2",
+    "int_0^1 x^2 dx = 1 / 3",
+    "sigma = sqrt( (1 / N) sum (x_i - mu)^2 )",
+]
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842   # A4 in points
+MARGIN = 56
+LINE_HEIGHT = 13
+FONT_SIZE = 10
+
+
+def _sentence(rng, n_words):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + "."
+
+
+def _picture_png(rng, width, height):
+    """A noisy image, so pictures do not compress to nothing"""
+    noise = np.random.default_rng(rng.randrange(1 << 30)).integers(0, 256, (height // 4, width // 4, 3), dtype=np.uint8)
+    image = Image.fromarray(noise).resize((width, height), Image.Resampling.NEAREST)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _draw_table(page, rng, y, rows=6, cols=4):
+    width = PAGE_WIDTH - 2 * MARGIN
+    row_height = 18
+    col_width = width / cols
+    for r in range(rows + 1):
+        page.draw_line((MARGIN, y + r * row_height), (MARGIN + width, y + r * row_height), width=0.6)
+    for c in range(cols + 1):
+        page.draw_line((MARGIN + c * col_width, y), (MARGIN + c * col_width, y + rows * row_height), width=0.6)
+    for r in range(rows):
+        for c in range(cols):
+            text = f"Header {c + 1}" if r == 0 else (f"{rng.uniform(0, 1000):.2f}" if c else rng.choice(WORDS))
+            page.insert_text((MARGIN + c * col_width + 4, y + r * row_height + 13), text, fontsize=FONT_SIZE - 1)
+    return y + rows * row_height + 16
+
+
+def draw_page(page, rng, page_no, text_density=1.0, tables=0, formulas=0, pictures=0):
+    """
+    Fills a PDF page with a header, title, paragraphs and the requested blocks.
+
+    Args:
+        page: fitz.Page to draw on.
+        rng: random.Random the content is drawn from.
+        page_no: Page number printed in the footer.
+        text_density: Fraction of the remaining page height filled with paragraphs (0..1).
+        tables, formulas, pictures: Number of blocks of each kind on the page.
+    """
+    page.insert_text((MARGIN, 36), "Synthetic Journal of Benchmarks", fontsize=8)
+    page.insert_text((MARGIN, 76), _sentence(rng, 5).rstrip("."), fontsize=16)
+    y = 100
+
+    blocks = ["table"] * tables + ["formula"] * formulas + ["picture"] * pictures
+    rng.shuffle(blocks)
+    bottom = PAGE_HEIGHT - 60
+    block_height = {"table": 6 * 18 + 16, "formula": 30, "picture": 180}
+    reserved = sum(block_height[b] for b in blocks)
+    text_budget = max(0, (bottom - y - reserved) * text_density)
+    # Paragraphs are spread between the blocks
+    paragraphs = max(1, len(blocks) + 1)
+    per_paragraph = text_budget / paragraphs
+    chars_per_line = int((PAGE_WIDTH - 2 * MARGIN) / (FONT_SIZE * 0.55))
+
+    for i in range(paragraphs):
+        for _ in range(int(per_paragraph // LINE_HEIGHT)):
+            words, length = [], 0
+            while length < chars_per_line - 12:
+                word = rng.choice(WORDS)
+                words.append(word)
+                length += len(word) + 1
+            page.insert_text((MARGIN, y + FONT_SIZE), " ".join(words), fontsize=FONT_SIZE)
+            y += LINE_HEIGHT
+        y += 8
+        if i < len(blocks):
+            kind = blocks[i]
+            if kind == "table":
+                y = _draw_table(page, rng, y)
+            elif kind == "formula":
+                page.insert_text((MARGIN + 60, y + 18), rng.choice(FORMULAS), fontsize=12, fontname="Times-Italic")
+                y += block_height["formula"]
+            else:
+                width, height = PAGE_WIDTH - 2 * MARGIN - 120, block_height["picture"] - 20
+                rect = fitz.Rect(MARGIN + 60, y, MARGIN + 60 + width, y + height)
+                page.insert_image(rect, stream=_picture_png(rng, int(width * 2), int(height * 2)))
+                page.insert_text((MARGIN + 60, y + height + 12), f"Figure {page_no}.{i + 1}: " + _sentence(rng, 6), fontsize=8)
+                y += block_height["picture"]
+
+    page.insert_text((PAGE_WIDTH / 2, PAGE_HEIGHT - 30), str(page_no), fontsize=8)
+
+
+def make_pdf(path, pages=10, seed=0, **page_kwargs):
+    """Writes a PDF of synthetic pages; page_kwargs go to draw_page"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_no in range(1, pages + 1):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        draw_page(page, rng, page_no, **page_kwargs)
+    doc.save(path, deflate=True)
+    doc.close()
+    return path
+
+
+def make_image(path, dpi=200, seed=0, **page_kwargs):
+    """Writes one synthetic page as an image (the format follows the extension)"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    draw_page(page, rng, 1, **page_kwargs)
+    pixmap = page.get_pixmap(dpi=dpi)
+    image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+    doc.close()
+    image.save(path)
+    return path
+
+
+def make_corpus(out_dir, pdfs=1, pages=10, images=0, image_format="png", seed=0, **page_kwargs):
+    """
+    Generates a set of documents.
+
+    Returns:
+        list: Paths of the generated files, PDFs first.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i in range(pdfs):
+        paths.append(make_pdf(os.path.join(out_dir, f"synthetic_{i}.pdf"), pages=pages, seed=seed + i, **page_kwargs))
+    for i in range(images):
+        paths.append(make_image(os.path.join(out_dir, f"synthetic_image_{i}.{image_format}"), seed=seed + 1000 + i, **page_kwargs))
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic PDFs and images for benchmarks")
+    parser.add_argument("out_dir", type=str)
+    parser.add_argument("--pdfs", type=int, default=1, help="Number of PDFs")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per PDF")
+    parser.add_argument("--images", type=int, default=0, help="Number of single-page images")
+    parser.add_argument("--image_format", type=str, choices=["png", "jpg"], default="png")
+    parser.add_argument("--text_density", type=float, default=1.0, help="Fraction of free page height filled with text (0..1)")
+    parser.add_argument("--tables", type=int, default=0, help="Tables per page")
+    parser.add_argument("--formulas", type=int, default=0, help="Formulas per page")
+    parser.add_argument("--pictures", type=int, default=0, help="Pictures per page")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    paths = make_corpus(
+        args.out_dir, pdfs=args.pdfs, pages=args.pages, images=args.images, image_format=args.image_format,
+        seed=args.seed, text_density=args.text_density, tables=args.tables, formulas=args.formulas, pictures=args.pictures,
+    )
+    for path in paths:
+        print(f"{path}  ({os.path.getsize(path) / 1024:.1f} KB)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
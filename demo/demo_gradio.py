@@ -13,6 +13,9 @@ import tempfile
 import base64
 import zipfile
 import uuid
+import queue
+import threading
+import time
 import re
 from pathlib import Path
 from PIL import Image
@@ -38,12 +41,16 @@ print(f"Added {root_dir} to sys.path to ensure local imports.")
 # Local tool imports
 from dots_ocr.utils import dict_promptmode_to_prompt
 from dots_ocr.utils.consts import MIN_PIXELS, MAX_PIXELS
-from dots_ocr.utils.demo_utils.display import read_image
-from dots_ocr.utils.doc_utils import load_images_from_pdf
-from dots_ocr.utils.merge_utils import create_download_package, count_files_in_zip, get_zip_size_mb
+from dots_ocr.utils.demo_utils.display import read_image, PreviewCache
+from dots_ocr.utils.demo_utils.result_cache import ResultCache
+from dots_ocr.utils.doc_utils import PdfPageRenderer
+from dots_ocr.utils.merge_utils import create_download_package, create_results_archive, count_files_in_zip, get_zip_size_mb
+from dots_ocr.utils.cells import DocumentCells, PageCells
 
 # Add DotsOCRParser import
-from dots_ocr.parser import DotsOCRParser
+from dots_ocr.parser import DotsOCRParser, result_metadata
+from dots_ocr.model.concurrency import ConcurrencyBudget, TokenBudget
+from dots_ocr.utils import metrics
 
 
 # ==================== Configuration ====================
@@ -52,21 +59,48 @@ DEFAULT_CONFIG = {
     'port_vllm': 8000,
     'min_pixels': MIN_PIXELS,
     'max_pixels': MAX_PIXELS,
+    'dpi': 200,
+    'num_thread': 3,
+    # Page previews are rendered lazily at screen resolution and only the most recent ones are kept
+    'preview_size': 1024,
+    'preview_cache_size': 8,
+    # Number of parse requests Gradio runs at the same time, further requests wait in the queue
+    'parse_concurrency': int(os.environ.get("DEMO_PARSE_CONCURRENCY", 4)),
+    'queue_size': int(os.environ.get("DEMO_QUEUE_SIZE", 32)),
+    # Concurrent API calls across all sessions, shared fairly between the sessions parsing
+    'api_concurrency': int(os.environ.get("DEMO_API_CONCURRENCY", 8)),
+    # Tokens per minute across all sessions, unlimited when unset
+    'tpm': int(os.environ["DEMO_TPM"]) if os.environ.get("DEMO_TPM") else None,
+    # Parse results are kept on disk and reused when the same file is parsed again with the same settings
+    'cache_dir': os.environ.get("DEMO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "dots_ocr_demo_cache")),
+    'cache_quota_mb': int(os.environ.get("DEMO_CACHE_QUOTA_MB", 2048)),
+    # Prometheus metrics of all sessions are served on this local port when set
+    'metrics_port': int(os.environ["DEMO_METRICS_PORT"]) if os.environ.get("DEMO_METRICS_PORT") else None,
 }
 
 # ==================== Global Variables ====================
-# Store current configuration
-current_config = DEFAULT_CONFIG.copy()
-
-# Create DotsOCRParser instance
-dots_parser = DotsOCRParser(
-    ip=DEFAULT_CONFIG['ip'],
-    port=DEFAULT_CONFIG['port_vllm'],
-    dpi=200,
-    min_pixels=DEFAULT_CONFIG['min_pixels'],
-    max_pixels=DEFAULT_CONFIG['max_pixels'],
-    model_name=os.environ.get("GEMINI_MODEL", "rednote-hilab/dots.ocr")
-)
+# Server-wide API budgets; the only state shared between sessions
+api_budget = ConcurrencyBudget(DEFAULT_CONFIG['api_concurrency'])
+token_budget = TokenBudget(DEFAULT_CONFIG['tpm']) if DEFAULT_CONFIG['tpm'] else None
+# Server-wide result store; it owns the result directories of all sessions and evicts old ones
+result_cache = ResultCache(DEFAULT_CONFIG['cache_dir'], DEFAULT_CONFIG['cache_quota_mb'] * 1024 * 1024)
+
+
+def create_parser(model_name, server_ip, server_port, min_pixels, max_pixels, request_delay, owner):
+    """Creates a DotsOCRParser for a single request, so concurrent sessions never share settings"""
+    return DotsOCRParser(
+        ip=server_ip,
+        port=server_port,
+        dpi=DEFAULT_CONFIG['dpi'],
+        num_thread=DEFAULT_CONFIG['num_thread'],
+        min_pixels=min_pixels,
+        max_pixels=max_pixels,
+        model_name=model_name,
+        request_delay=request_delay,
+        api_budget=api_budget,
+        budget_owner=owner,
+        token_budget=token_budget,
+    )
 
 def get_initial_session_state():
     return {
@@ -82,7 +116,9 @@ def get_initial_session_state():
             'pdf_results': None
         },
         'pdf_cache': {
-            "images": [],
+            "images": [],           # Only used for image uploads; PDF pages are rendered on demand
+            "renderer": None,
+            "previews": PreviewCache(DEFAULT_CONFIG['preview_cache_size'], DEFAULT_CONFIG['preview_size']),
             "current_page": 0,
             "total_pages": 0,
             "file_type": None,
@@ -109,6 +145,13 @@ def read_image_v2(img):
         raise ValueError(f"Invalid image type: {type(img)}")
     return img
 
+def close_preview(pdf_cache):
+    """Releases the PDF renderer and previews of the previous file (a parse still using the renderer keeps it open)"""
+    if pdf_cache.get("renderer") is not None:
+        pdf_cache["renderer"].close()
+        pdf_cache["renderer"] = None
+    pdf_cache["previews"].clear()
+
 def load_file_for_preview(file_path, session_state):
     """Loads a file for preview, supports PDF and image files"""
     pdf_cache = session_state['pdf_cache']
@@ -118,32 +161,57 @@ def load_file_for_preview(file_path, session_state):
     
     file_ext = os.path.splitext(file_path)[1].lower()
     
+    close_preview(pdf_cache)
     try:
         if file_ext == '.pdf':
-            pages = load_images_from_pdf(file_path)
+            # Only open the PDF here; pages are rendered when they are shown or parsed
+            renderer = PdfPageRenderer(file_path, dpi=DEFAULT_CONFIG['dpi'], cache_size=DEFAULT_CONFIG['num_thread'])
+            pdf_cache["renderer"] = renderer
+            pdf_cache["images"] = []
+            total_pages = renderer.page_count
             pdf_cache["file_type"] = "pdf"
         elif file_ext in ['.jpg', '.jpeg', '.png']:
             image = Image.open(file_path)
-            pages = [image]
+            pdf_cache["images"] = [image]
+            total_pages = 1
             pdf_cache["file_type"] = "image"
         else:
             return None, "<div id='page_info_box'>Unsupported file format</div>", session_state
     except Exception as e:
         return None, f"<div id='page_info_box'>PDF loading failed: {str(e)}</div>", session_state
     
-    pdf_cache["images"] = pages
     pdf_cache["current_page"] = 0
-    pdf_cache["total_pages"] = len(pages)
+    pdf_cache["total_pages"] = total_pages
     pdf_cache["is_parsed"] = False
     pdf_cache["results"] = []
     
-    return pages[0], f"<div id='page_info_box'>1 / {len(pages)}</div>", session_state
+    return get_page_preview(pdf_cache, 0), f"<div id='page_info_box'>1 / {total_pages}</div>", session_state
+
+def get_page_preview(pdf_cache, index):
+    """
+    Returns the preview of page `index`: the parsed layout image once the page
+    is done, the rendered page before that. Previews come from a small LRU cache.
+    """
+    if pdf_cache["images"]:
+        return pdf_cache["images"][index]
+    
+    previews = pdf_cache["previews"]
+    result = pdf_cache["results"][index] if index < len(pdf_cache["results"]) else None
+    layout_image_path = (result or {}).get('result_paths', {}).get('layout_image_path')
+    if layout_image_path and os.path.exists(layout_image_path):
+        # The parser already saved this page; reuse its raster instead of rendering it again
+        return previews.get(('layout', index), lambda: Image.open(layout_image_path))
+    
+    renderer = pdf_cache.get("renderer")
+    if renderer is None:
+        return None
+    return previews.get(('page', index), lambda: renderer.render_preview(index, previews.max_size))
 
 def turn_page(direction, session_state):
     """Page turning function"""
     pdf_cache = session_state['pdf_cache']
     
-    if not pdf_cache["images"]:
+    if not pdf_cache["total_pages"]:
         return None, "<div id='page_info_box'>0 / 0</div>", "", session_state
 
     if direction == "prev":
@@ -152,17 +220,14 @@ def turn_page(direction, session_state):
         pdf_cache["current_page"] = min(pdf_cache["total_pages"] - 1, pdf_cache["current_page"] + 1)
 
     index = pdf_cache["current_page"]
-    current_image = pdf_cache["images"][index]  # Use the original image by default
+    current_image = get_page_preview(pdf_cache, index)
     page_info = f"<div id='page_info_box'>{index + 1} / {pdf_cache['total_pages']}</div>"
     
     current_json = ""
     if pdf_cache["is_parsed"] and index < len(pdf_cache["results"]):
         result = pdf_cache["results"][index]
         if 'cells_data' in result and result['cells_data']:
-            try:
-                current_json = json.dumps(result['cells_data'], ensure_ascii=False, indent=2)
-            except:
-                current_json = str(result.get('cells_data', ''))
+            current_json = format_page_json(result['cells_data'])
         if 'layout_image' in result and result['layout_image']:
             current_image = result['layout_image']
     
@@ -211,6 +276,8 @@ def generate_download_package(session_state, format_choice, scope_choice):
             scope_choice=scope_code,
             filename_base=filename_base
         )
+        # The merged files and the package are written into the cache entry
+        result_cache.update_size(output_dir)
         
         if not zip_path or not os.path.exists(zip_path):
             return None, "❌ Failed to create download package. No matching files found."
@@ -237,250 +304,344 @@ Click the download button above to save the package."""
 
 
 
-def create_temp_session_dir():
-    """Creates a unique temporary directory for each processing request"""
-    session_id = uuid.uuid4().hex[:8]
-    temp_dir = os.path.join(tempfile.gettempdir(), f"dots_ocr_demo_{session_id}")
-    os.makedirs(temp_dir, exist_ok=True)
-    return temp_dir, session_id
+def image_parse_result(result, temp_dir, session_id):
+    """Builds the result of an image parse from the parser's result dict"""
+    page_result = load_page_result(result)
+    return {
+        'layout_image': page_result['layout_image'],
+        'cells_data': page_result['cells_data'],
+        'md_content': page_result['md_content'],
+        'filtered': page_result['filtered'],
+        'error': page_result['error'],
+        'temp_dir': temp_dir,
+        'session_id': session_id,
+        'result_paths': page_result['result_paths'],
+        'input_width': result.get('input_width', 0),
+        'input_height': result.get('input_height', 0),
+    }
 
-def parse_image_with_high_level_api(parser, image, prompt_mode, fitz_preprocess=False):
+def parse_image_with_high_level_api(parser, image, prompt_mode, temp_dir, session_id, fitz_preprocess=False):
     """
     Processes using the high-level API parse_image from DotsOCRParser
     """
-    # Create a temporary session directory
-    temp_dir, session_id = create_temp_session_dir()
+    # Use the high-level API parse_image; the image is passed in memory
+    filename = f"demo_{session_id}"
+    results = parser.parse_image(
+        input_path=image,
+        filename=filename, 
+        prompt_mode=prompt_mode,
+        save_dir=temp_dir,
+        fitz_preprocess=fitz_preprocess
+    )
     
-    try:
-        # Save the PIL Image as a temporary file
-        temp_image_path = os.path.join(temp_dir, f"input_{session_id}.png")
-        image.save(temp_image_path, "PNG")
-        
-        # Use the high-level API parse_image
-        filename = f"demo_{session_id}"
-        results = parser.parse_image(
-            input_path=image,
-            filename=filename, 
-            prompt_mode=prompt_mode,
-            save_dir=temp_dir,
-            fitz_preprocess=fitz_preprocess
-        )
-        
-        # Parse the results
-        if not results:
-            raise ValueError("No results returned from parser")
-        
-        result = results[0]  # parse_image returns a list with a single result
-        
-        layout_image = None
-        if 'layout_image_path' in result and os.path.exists(result['layout_image_path']):
-            layout_image = Image.open(result['layout_image_path'])
-        
-        cells_data = None
-        if 'layout_info_path' in result and os.path.exists(result['layout_info_path']):
-            with open(result['layout_info_path'], 'r', encoding='utf-8') as f:
-                cells_data = json.load(f)
-        
-        md_content = None
-        if 'md_content_path' in result and os.path.exists(result['md_content_path']):
-            with open(result['md_content_path'], 'r', encoding='utf-8') as f:
-                md_content = f.read()
-        
-        return {
-            'layout_image': layout_image,
-            'cells_data': cells_data,
-            'md_content': md_content,
-            'filtered': result.get('filtered', False),
-            'temp_dir': temp_dir,
-            'session_id': session_id,
-            'result_paths': result,
-            'input_width': result.get('input_width', 0),
-            'input_height': result.get('input_height', 0),
-        }
-    except Exception as e:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir, ignore_errors=True)
-        raise e
+    # Parse the results
+    if not results:
+        raise ValueError("No results returned from parser")
+    
+    return image_parse_result(results[0], temp_dir, session_id)  # parse_image returns a list with a single result
 
-def parse_pdf_with_high_level_api(parser, pdf_path, prompt_mode):
+def load_page_result(result, page_no=0, load_image=True):
     """
-    Processes using the high-level API parse_pdf from DotsOCRParser
+    Takes the layout image, cells and markdown of one parsed page from the parser's result.
+    Results restored from the result cache only hold file paths; their content is read from disk.
+    With load_image=False the layout image is left out and shown through get_page_preview.
     """
-    # Create a temporary session directory
-    temp_dir, session_id = create_temp_session_dir()
+    page_result = {
+        'page_no': result.get('page_no', page_no),
+        'layout_image': None,
+        'cells_data': result.get('cells'),
+        'md_content': result.get('md_content'),
+        'filtered': result.get('filtered', False),
+        'error': result.get('error', False),  # the API request failed
+        # The written files only; file_path is the input, which may even be an in-memory image
+        'result_paths': {k: v for k, v in result_metadata(result).items() if k != 'file_path'},
+    }
+    
+    # The layout image
+    if load_image:
+        page_result['layout_image'] = result.get('layout_image')
+        if page_result['layout_image'] is None and 'layout_image_path' in result and os.path.exists(result['layout_image_path']):
+            page_result['layout_image'] = Image.open(result['layout_image_path'])
     
+    # The JSON data
+    if 'cells' not in result and 'layout_info_path' in result and os.path.exists(result['layout_info_path']):
+        with open(result['layout_info_path'], 'r', encoding='utf-8') as f:
+            page_result['cells_data'] = json.load(f)
+    
+    # The Markdown content
+    if 'md_content' not in result and 'md_content_path' in result and os.path.exists(result['md_content_path']):
+        with open(result['md_content_path'], 'r', encoding='utf-8') as f:
+            page_result['md_content'] = f.read()
+    return page_result
+
+def stream_pdf_with_high_level_api(parser, pdf_path, prompt_mode, temp_dir, session_id, renderer=None):
+    """
+    Processes using the high-level API parse_pdf from DotsOCRParser, yielding
+    (page_result, total_pages) for every page as soon as it is done.
+    
+    parse_pdf runs in a worker thread; pages arrive in completion order.
+    Closing the generator early (the client went away) cancels the pages still
+    running and waits for the worker, so nothing writes to temp_dir afterwards.
+    """
+    page_queue = queue.Queue()
+    done = object()
+    cancel_event = threading.Event()
+    if renderer is not None:
+        # The parse holds its own reference, so a new upload closing the preview does not close the PDF under it
+        renderer.retain()
+    
+    def worker():
+        try:
+            parser.parse_pdf(
+                input_path=pdf_path,
+                filename=f"demo_{session_id}",
+                prompt_mode=prompt_mode,
+                save_dir=temp_dir,
+                on_page_done=lambda result, total_pages: page_queue.put((result, total_pages)),
+                renderer=renderer,
+                cancel_event=cancel_event
+            )
+            page_queue.put(done)
+        except Exception as e:
+            page_queue.put(e)
+    
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
     try:
-        # Use the high-level API parse_pdf
-        filename = f"demo_{session_id}"
-        results = parser.parse_pdf(
-            input_path=pdf_path,
-            filename=filename,
-            prompt_mode=prompt_mode,
-            save_dir=temp_dir
+        while True:
+            item = page_queue.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            result, total_pages = item
+            # Cells and markdown come in memory; page images stay on disk and only the previews being looked at are loaded
+            yield load_page_result(result, load_image=False), total_pages
+    finally:
+        cancel_event.set()
+        thread.join()
+        if renderer is not None:
+            renderer.close()
+
+def result_files(page_results, output_dir):
+    """Lists the files written for the given pages plus the shared Picture assets"""
+    files = []
+    output_dir = os.path.abspath(output_dir)
+    for page_result in page_results:
+        files.extend(
+            path for key, path in sorted(page_result['result_paths'].items())
+            if key.endswith('_path') and isinstance(path, str)
+            and os.path.commonpath([os.path.abspath(path), output_dir]) == output_dir  # not the input file
         )
-        
-        # Parse the results
-        if not results:
-            raise ValueError("No results returned from parser")
-        
-        # Handle multi-page results
-        parsed_results = []
-        all_md_content = []
-        all_cells_data = []
-        
-        for i, result in enumerate(results):
-            page_result = {
-                'page_no': result.get('page_no', i),
-                'layout_image': None,
-                'cells_data': None,
-                'md_content': None,
-                'filtered': False
-            }
-            
-            # Read the layout image
-            if 'layout_image_path' in result and os.path.exists(result['layout_image_path']):
-                page_result['layout_image'] = Image.open(result['layout_image_path'])
-            
-            # Read the JSON data
-            if 'layout_info_path' in result and os.path.exists(result['layout_info_path']):
-                with open(result['layout_info_path'], 'r', encoding='utf-8') as f:
-                    page_result['cells_data'] = json.load(f)
-                    if page_result['cells_data'] is not None:
-                        all_cells_data.extend(page_result['cells_data'])
-            
-            # Read the Markdown content
-            if 'md_content_path' in result and os.path.exists(result['md_content_path']):
-                with open(result['md_content_path'], 'r', encoding='utf-8') as f:
-                    page_content = f.read()
-                    page_result['md_content'] = page_content
-                    all_md_content.append(page_content)
-            page_result['filtered'] = result.get('filtered', False)
-            parsed_results.append(page_result)
-        
-        combined_md = "\n\n---\n\n".join(all_md_content) if all_md_content else ""
-        return {
-            'parsed_results': parsed_results,
-            'combined_md_content': combined_md,
-            'combined_cells_data': all_cells_data,
-            'temp_dir': temp_dir,
-            'session_id': session_id,
-            'total_pages': len(results)
-        }
-        
-    except Exception as e:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir, ignore_errors=True)
-        raise e
+    asset_dir = os.path.join(output_dir, "assets")
+    if os.path.isdir(asset_dir):
+        files.extend(os.path.join(asset_dir, name) for name in sorted(os.listdir(asset_dir)))
+    return files
+
+def cache_info_line(hit):
+    """Summarizes the result cache for the info panel"""
+    stats = result_cache.stats()
+    lookups = stats['hits'] + stats['misses']
+    status = "hit, served without calling the API" if hit else "miss"
+    return f"- Result Cache: {status} (hit rate {stats['hit_rate']:.0%} over {lookups} requests)"
+
+def finish_entry(entry_dir, cache_key, results):
+    """Commits a finished parse to the result cache, unless pages failed; returns the number of failed pages"""
+    failed = sum(1 for r in results if r.get('error'))
+    if failed:
+        # Kept for this session but never served again, so the next upload retries
+        result_cache.release(entry_dir)
+    else:
+        result_cache.commit(entry_dir, cache_key, [r['result_paths'] for r in results])
+    return failed
+
+def show_entry(session_state, entry_dir):
+    """Makes entry_dir the result of the session, pinned in the result cache while it is shown"""
+    previous = session_state.get('current_output_dir')
+    if previous != entry_dir:
+        if previous:
+            result_cache.unpin(previous)
+        result_cache.pin(entry_dir)
+    session_state['current_output_dir'] = entry_dir
+
+def format_page_json(cells_data):
+    """Formats the cells of one page for the JSON panel"""
+    if not cells_data:
+        return ""
+    try:
+        if isinstance(cells_data, PageCells):
+            cells_data = cells_data.to_list()
+        return json.dumps(cells_data, ensure_ascii=False, indent=2)
+    except:
+        return str(cells_data)
 
 # ==================== Core Processing Function ====================
 def process_image_inference(session_state, file_input,
                           prompt_mode, server_ip, server_port, min_pixels, max_pixels,
-                          model_selection, fitz_preprocess=False, request_delay=2.0
+                          model_selection, fitz_preprocess=False, request_delay=2.0,
+                          request: gr.Request = None
                           ):
     """Core function to handle image/PDF inference"""
     # Use session_state instead of global variables
     processing_results = session_state['processing_results']
     pdf_cache = session_state['pdf_cache']
     
-    if processing_results.get('temp_dir') and os.path.exists(processing_results['temp_dir']):
-        try:
-            shutil.rmtree(processing_results['temp_dir'], ignore_errors=True)
-        except Exception as e:
-            print(f"Failed to clean up previous temporary directory: {e}")
-    
+    # The previous results stay in the result cache, which evicts them once it runs out of space
     # Reset processing results for the current session
     session_state['processing_results'] = get_initial_session_state()['processing_results']
     processing_results = session_state['processing_results']
     
-    current_config.update({
-        'ip': server_ip,
-        'port_vllm': server_port,
-        'min_pixels': min_pixels,
-        'max_pixels': max_pixels
-    })
-    
-    # Update parser configuration
-    dots_parser.model_name = model_selection
-    dots_parser.ip = server_ip
-    dots_parser.port = server_port
-    dots_parser.min_pixels = min_pixels
-    dots_parser.max_pixels = max_pixels
-    dots_parser.request_delay = request_delay
+    # A fresh parser per request; the session hash keys this session's share of the API budget
+    owner = getattr(request, 'session_hash', None) or uuid.uuid4().hex
+    dots_parser = create_parser(model_selection, server_ip, server_port, min_pixels, max_pixels, request_delay, owner)
     
     input_file_path = file_input
     
     if not input_file_path:
-        return None, "Please upload image/PDF file", "", "", gr.update(value=None), None, "", session_state
+        yield None, "Please upload image/PDF file", "", "", gr.update(value=None), None, "", session_state
+        return
     
     file_ext = os.path.splitext(input_file_path)[1].lower()
     
+    # Everything that changes the result; request_delay only changes how fast it arrives
+    cache_settings = {
+        'prompt_mode': prompt_mode, 'model': model_selection, 'server': f"{server_ip}:{server_port}",
+        'min_pixels': min_pixels, 'max_pixels': max_pixels, 'dpi': DEFAULT_CONFIG['dpi'],
+        'fitz_preprocess': bool(fitz_preprocess) and file_ext != '.pdf',
+    }
+    pending_entry = None  # Entry directory of a parse that has not been committed yet
+    page_source = None
+    failed_pages = 0
+    
     try:
+        cache_key = ResultCache.make_key(input_file_path, cache_settings)
+        cached = result_cache.lookup(cache_key)
+        
         if file_ext == '.pdf':
             # MINIMAL CHANGE: The `process_pdf_file` function is now inlined and uses session_state.
             preview_image, page_info, session_state = load_file_for_preview(input_file_path, session_state)
-            pdf_result = parse_pdf_with_high_level_api(dots_parser, input_file_path, prompt_mode)
-            
-            session_state['pdf_cache']["is_parsed"] = True
-            session_state['pdf_cache']["results"] = pdf_result['parsed_results']
-            
-            processing_results.update({
-                'markdown_content': pdf_result['combined_md_content'],
-                'cells_data': pdf_result['combined_cells_data'],
-                'temp_dir': pdf_result['temp_dir'],
-                'session_id': pdf_result['session_id'],
-                'pdf_results': pdf_result['parsed_results']
-            })
+            if cached:
+                temp_dir, cached_results = cached
+                session_id = os.path.basename(temp_dir)
+            else:
+                temp_dir, session_id = result_cache.create_entry()
+                pending_entry = temp_dir
+            zip_path = os.path.join(temp_dir, f"layout_results_{session_id}.zip")
+            processing_results.update({'temp_dir': temp_dir, 'session_id': session_id})
             
             # NEW: Store output dir and metadata for download
-            session_state['current_output_dir'] = pdf_result['temp_dir']
-            session_state['num_pages'] = pdf_result['total_pages']
+            show_entry(session_state, temp_dir)
             session_state['is_pdf'] = True
             session_state['filename_base'] = os.path.splitext(os.path.basename(input_file_path))[0]
             
-            total_elements = len(pdf_result['combined_cells_data'])
-            info_text = f"**PDF Information:**\n- Total Pages: {pdf_result['total_pages']}\n- Server: {current_config['ip']}:{current_config['port_vllm']}\n- Total Detected Elements: {total_elements}\n- Session ID: {pdf_result['session_id']}"
+            # Pages not parsed yet stay empty dicts so page turning keeps working while streaming
+            total_pages = session_state['pdf_cache']["total_pages"]
+            parsed_results = [{} for _ in range(total_pages)]
+            session_state['pdf_cache']["results"] = parsed_results
+            session_state['pdf_cache']["is_parsed"] = True
             
-            current_page_layout_image = preview_image
-            current_page_json = ""
-            if session_state['pdf_cache']["results"]:
-                first_result = session_state['pdf_cache']["results"][0]
-                if 'layout_image' in first_result and first_result['layout_image']:
-                    current_page_layout_image = first_result['layout_image']
-                if first_result.get('cells_data'):
-                    try:
-                        current_page_json = json.dumps(first_result['cells_data'], ensure_ascii=False, indent=2)
-                    except:
-                        current_page_json = str(first_result['cells_data'])
-
-            download_zip_path = None
-            if pdf_result['temp_dir']:
-                download_zip_path = os.path.join(pdf_result['temp_dir'], f"layout_results_{pdf_result['session_id']}.zip")
-                with zipfile.ZipFile(download_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    for root, _, files in os.walk(pdf_result['temp_dir']):
-                        for file in files:
-                            if not file.endswith('.zip'): zipf.write(os.path.join(root, file), os.path.relpath(os.path.join(root, file), pdf_result['temp_dir']))
-
-            return (
-                current_page_layout_image, info_text, pdf_result['combined_md_content'] or "No markdown content generated",
-                pdf_result['combined_md_content'] or "No markdown content generated",
-                gr.update(value=download_zip_path, visible=bool(download_zip_path)), page_info, current_page_json, session_state
-            )
+            def render_progress(done_pages, total_pages, finished):
+                """Builds the UI outputs from the pages parsed so far"""
+                completed = [r for r in parsed_results if r]
+                combined_md = "\n\n---\n\n".join(r['md_content'] for r in completed if r.get('md_content'))
+                total_elements = sum(len(r['cells_data']) for r in completed if isinstance(r.get('cells_data'), (list, PageCells)))
+                
+                if finished:
+                    info_text = f"**PDF Information:**\n- Total Pages: {total_pages}\n- Server: {server_ip}:{server_port}\n- Total Detected Elements: {total_elements}\n- Session ID: {session_id}\n{cache_info_line(bool(cached))}"
+                    if failed_pages:
+                        info_text += f"\n- ⚠️ {failed_pages} page(s) failed, the result is not cached"
+                else:
+                    info_text = f"**PDF Information:**\n- ⏳ Parsed Pages: {done_pages} / {total_pages}\n- Server: {server_ip}:{server_port}\n- Detected Elements So Far: {total_elements}\n- Session ID: {session_id}"
+                
+                # Show the page the user is looking at, once it has been parsed
+                index = min(session_state['pdf_cache']["current_page"], max(0, total_pages - 1))
+                current_page_layout_image = get_page_preview(session_state['pdf_cache'], index) or preview_image
+                current_page_json = ""
+                if index < len(parsed_results) and parsed_results[index]:
+                    current_page_json = format_page_json(parsed_results[index].get('cells_data'))
+                current_page_info = f"<div id='page_info_box'>{index + 1} / {total_pages}</div>"
+                
+                # Partial download of the finished pages; the archive is appended to, not rebuilt
+                download_zip_path = create_results_archive(temp_dir, zip_path, files=result_files(completed, temp_dir)) if completed else None
+                
+                md_display = combined_md or ("No markdown content generated" if finished else "⏳ Waiting for the first page...")
+                return (
+                    current_page_layout_image, info_text, md_display, md_display,
+                    gr.update(value=download_zip_path, visible=bool(download_zip_path)), current_page_info, current_page_json, session_state
+                )
+            
+            if cached:
+                page_source = ((load_page_result(r, load_image=False), len(cached_results)) for r in cached_results)
+            else:
+                yield render_progress(0, total_pages, False)
+                renderer = session_state['pdf_cache']["renderer"]
+                page_source = stream_pdf_with_high_level_api(dots_parser, input_file_path, prompt_mode, temp_dir, session_id, renderer=renderer)
+            
+            done_pages = 0
+            last_update = 0.0
+            for page_result, total_pages in page_source:
+                if len(parsed_results) < total_pages:
+                    parsed_results.extend({} for _ in range(total_pages - len(parsed_results)))
+                parsed_results[page_result['page_no']] = page_result
+                done_pages += 1
+                # Throttle UI updates on fast backends; the first page is always shown at once
+                if not cached and (done_pages == 1 or time.monotonic() - last_update >= 0.5):
+                    last_update = time.monotonic()
+                    yield render_progress(done_pages, total_pages, False)
+            
+            if not done_pages:
+                raise ValueError("No results returned from parser")
+            if not cached:
+                failed_pages = finish_entry(temp_dir, cache_key, [r for r in parsed_results if r])
+                pending_entry = None
+            
+            # Keep the cells of all pages in one compact container; each page result holds a view of it
+            document_cells = DocumentCells.from_pages([r.get('cells_data') for r in parsed_results])
+            for i, page_result in enumerate(parsed_results):
+                if document_cells.is_cell_page(i):
+                    page_result['cells_data'] = document_cells.page(i)
+            
+            final_outputs = render_progress(done_pages, len(parsed_results), True)
+            result_cache.update_size(temp_dir)  # the results archive is completed after the commit
+            processing_results.update({
+                'markdown_content': "\n\n---\n\n".join(r['md_content'] for r in parsed_results if r.get('md_content')),
+                'cells_data': document_cells,
+                'pdf_results': parsed_results
+            })
+            session_state['num_pages'] = len(parsed_results)
+            yield final_outputs
+            return
         
         else: # Image processing
             image = read_image_v2(input_file_path)
+            close_preview(session_state['pdf_cache'])
             session_state['pdf_cache'] = get_initial_session_state()['pdf_cache']
             
             original_image = image
-            parse_result = parse_image_with_high_level_api(dots_parser, image, prompt_mode, fitz_preprocess)
+            if cached:
+                temp_dir, cached_results = cached
+                parse_result = image_parse_result(cached_results[0], temp_dir, os.path.basename(temp_dir))
+            else:
+                yield (
+                    original_image, f"**Image Information:**\n- Original Size: {original_image.width} x {original_image.height}\n- ⏳ Parsing...\n- Server: {server_ip}:{server_port}",
+                    "⏳ Parsing...", "⏳ Parsing...", gr.update(visible=False), None, "", session_state
+                )
+                temp_dir, session_id = result_cache.create_entry()
+                pending_entry = temp_dir
+                parse_result = parse_image_with_high_level_api(dots_parser, image, prompt_mode, temp_dir, session_id, fitz_preprocess)
+                failed_pages = finish_entry(temp_dir, cache_key, [parse_result])
+                pending_entry = None
+            failed_line = "\n- ⚠️ The API request failed, the result is not cached" if failed_pages else ""
             
             if parse_result['filtered']:
-                 info_text = f"**Image Information:**\n- Original Size: {original_image.width} x {original_image.height}\n- Processing: JSON parsing failed, using cleaned text output\n- Server: {current_config['ip']}:{current_config['port_vllm']}\n- Session ID: {parse_result['session_id']}"
+                 info_text = f"**Image Information:**\n- Original Size: {original_image.width} x {original_image.height}\n- Processing: JSON parsing failed, using cleaned text output\n- Server: {server_ip}:{server_port}\n- Session ID: {parse_result['session_id']}\n{cache_info_line(bool(cached))}{failed_line}"
                  processing_results.update({
                      'original_image': original_image, 'markdown_content': parse_result['md_content'],
                      'temp_dir': parse_result['temp_dir'], 'session_id': parse_result['session_id'],
                      'result_paths': parse_result['result_paths']
                  })
-                 return original_image, info_text, parse_result['md_content'], parse_result['md_content'], gr.update(visible=False), None, "", session_state
+                 yield original_image, info_text, parse_result['md_content'], parse_result['md_content'], gr.update(visible=False), None, "", session_state
+                 return
             
             md_content_raw = parse_result['md_content'] or "No markdown content generated"
             processing_results.update({
@@ -491,25 +652,25 @@ def process_image_inference(session_state, file_input,
             })
             
             # NEW: Store output dir and metadata for download (image case)
-            session_state['current_output_dir'] = parse_result['temp_dir']
+            show_entry(session_state, parse_result['temp_dir'])
             session_state['num_pages'] = 1
             session_state['is_pdf'] = False
             session_state['filename_base'] = os.path.splitext(os.path.basename(input_file_path))[0]
             
             num_elements = len(parse_result['cells_data']) if parse_result['cells_data'] else 0
-            info_text = f"**Image Information:**\n- Original Size: {original_image.width} x {original_image.height}\n- Model Input Size: {parse_result['input_width']} x {parse_result['input_height']}\n- Server: {current_config['ip']}:{current_config['port_vllm']}\n- Detected {num_elements} layout elements\n- Session ID: {parse_result['session_id']}"
+            info_text = f"**Image Information:**\n- Original Size: {original_image.width} x {original_image.height}\n- Model Input Size: {parse_result['input_width']} x {parse_result['input_height']}\n- Server: {server_ip}:{server_port}\n- Detected {num_elements} layout elements\n- Session ID: {parse_result['session_id']}\n{cache_info_line(bool(cached))}{failed_line}"
             
             current_json = json.dumps(parse_result['cells_data'], ensure_ascii=False, indent=2) if parse_result['cells_data'] else ""
             
             download_zip_path = None
             if parse_result['temp_dir']:
-                download_zip_path = os.path.join(parse_result['temp_dir'], f"layout_results_{parse_result['session_id']}.zip")
-                with zipfile.ZipFile(download_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    for root, _, files in os.walk(parse_result['temp_dir']):
-                        for file in files:
-                            if not file.endswith('.zip'): zipf.write(os.path.join(root, file), os.path.relpath(os.path.join(root, file), parse_result['temp_dir']))
+                download_zip_path = create_results_archive(
+                    parse_result['temp_dir'],
+                    os.path.join(parse_result['temp_dir'], f"layout_results_{parse_result['session_id']}.zip")
+                )
+                result_cache.update_size(parse_result['temp_dir'])
             
-            return (
+            yield (
                 parse_result['layout_image'], info_text, parse_result['md_content'] or "No markdown content generated",
                 md_content_raw, gr.update(value=download_zip_path, visible=bool(download_zip_path)),
                 None, current_json, session_state
@@ -517,18 +678,22 @@ def process_image_inference(session_state, file_input,
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return None, f"Error during processing: {e}", "", "", gr.update(value=None), None, "", session_state
+        yield None, f"Error during processing: {e}", "", "", gr.update(value=None), None, "", session_state
+    finally:
+        # Stop a parse still running (the generator was closed early) before its directory goes
+        if page_source is not None:
+            page_source.close()
+        # A failed or cancelled parse leaves no half-written entry behind
+        if pending_entry is not None:
+            result_cache.discard(pending_entry)
 
 # MINIMAL CHANGE: Functions now take `session_state` as an argument.
 def clear_all_data(session_state):
     """Clears all data"""
-    processing_results = session_state['processing_results']
-    
-    if processing_results.get('temp_dir') and os.path.exists(processing_results['temp_dir']):
-        try:
-            shutil.rmtree(processing_results['temp_dir'], ignore_errors=True)
-        except Exception as e:
-            print(f"Failed to clean up temporary directory: {e}")
+    # Result directories are owned by the result cache and evicted by it once no session shows them
+    if session_state.get('current_output_dir'):
+        result_cache.unpin(session_state['current_output_dir'])
+    close_preview(session_state['pdf_cache'])
     
     # Reset the session state by returning a new initial state
     new_session_state = get_initial_session_state()
@@ -779,7 +944,9 @@ def create_gradio_interface():
             outputs=[
                 result_image, info_display, md_output, md_raw_output,
                 download_btn, page_info, current_page_json, session_state
-            ]
+            ],
+            concurrency_limit=DEFAULT_CONFIG['parse_concurrency'],
+            concurrency_id="parse",
         ).then(
             # Show download options after successful parse
             fn=lambda: gr.update(visible=True),
@@ -872,8 +1039,10 @@ GRADIO_CSS = """
 if __name__ == "__main__":
     import sys
     port = int(sys.argv[1]) if len(sys.argv) > 1 else 7860
+    if DEFAULT_CONFIG['metrics_port'] is not None:
+        metrics.enable_metrics().serve(DEFAULT_CONFIG['metrics_port'])
     demo = create_gradio_interface()
-    demo.queue().launch(
+    demo.queue(max_size=DEFAULT_CONFIG['queue_size']).launch(
         server_name="0.0.0.0", 
         server_port=port, 
         debug=True,
@@ -1 +1,10 @@
-from .parser import DotsOCRParser
\ No newline at end of file
+def __getattr__(name):
+    # Imported on first access, so importing a submodule (or the package for its
+    # prompts and utilities) does not pay for the parser and its dependencies
+    if name == "DotsOCRParser":
+        from .parser import DotsOCRParser
+        return DotsOCRParser
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ["DotsOCRParser"]
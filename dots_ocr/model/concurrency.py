@@ -0,0 +1,243 @@
+"""
+Concurrency control for API requests
+
+A ConcurrencyBudget caps the number of in-flight API requests across every
+parser sharing it (e.g. all sessions of the Gradio demo) and splits the cap
+fairly between the owners currently using it, so one large PDF cannot starve
+the other users.
+
+A TokenBudget admits requests against the tokens-per-minute and
+requests-per-minute limits providers actually enforce. It is local to the
+process; dots_ocr.model.shared_limiter keeps the same window in a SQLite file
+for several processes.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Hashable, List, Optional, Sequence
+
+
+class ConcurrencyBudget:
+    """
+    Server-wide budget of concurrent API requests, shared fairly between owners.
+
+    Each active owner (one with requests in flight or waiting) may hold at most
+    `limit // active_owners` slots (at least one), and all owners together at
+    most `limit`. A single owner can therefore use the whole budget while it is
+    alone. Thread-safe; async callers use acquire_async.
+
+    Args:
+        limit: Maximum number of requests in flight across all owners.
+    """
+
+    def __init__(self, limit: int):
+        if limit < 1:
+            raise ValueError(f"limit should be >= 1, got {limit}")
+        self.limit = limit
+        self._cond = threading.Condition()
+        self._in_flight: Dict[Hashable, int] = {}
+        self._waiting: Dict[Hashable, int] = {}
+
+    @property
+    def in_flight(self) -> int:
+        with self._cond:
+            return sum(self._in_flight.values())
+
+    @property
+    def waiting(self) -> int:
+        with self._cond:
+            return sum(self._waiting.values())
+
+    def _fair_share(self) -> int:
+        active = len(set(self._in_flight) | set(self._waiting))
+        return max(1, self.limit // max(1, active))
+
+    def _can_acquire(self, owner: Hashable) -> bool:
+        total = sum(self._in_flight.values())
+        return total < self.limit and self._in_flight.get(owner, 0) < self._fair_share()
+
+    def acquire(self, owner: Hashable, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until `owner` may start a request.
+
+        Args:
+            owner: Key identifying the session or job the request belongs to.
+            timeout: Maximum seconds to wait, None to wait forever.
+
+        Returns:
+            bool: True if a slot was acquired, False on timeout.
+        """
+        with self._cond:
+            self._waiting[owner] = self._waiting.get(owner, 0) + 1
+            try:
+                acquired = self._cond.wait_for(lambda: self._can_acquire(owner), timeout)
+                if acquired:
+                    self._in_flight[owner] = self._in_flight.get(owner, 0) + 1
+                return acquired
+            finally:
+                self._waiting[owner] -= 1
+                if self._waiting[owner] == 0:
+                    del self._waiting[owner]
+                # The set of active owners changed, which changes every fair share
+                self._cond.notify_all()
+
+    def release(self, owner: Hashable):
+        with self._cond:
+            count = self._in_flight.get(owner, 0) - 1
+            if count < 0:
+                raise RuntimeError(f"release() called more often than acquire() for {owner!r}")
+            if count == 0:
+                del self._in_flight[owner]
+            else:
+                self._in_flight[owner] = count
+            self._cond.notify_all()
+
+    async def acquire_async(self, owner: Hashable):
+        """Acquires a slot without blocking the event loop"""
+        future = asyncio.ensure_future(asyncio.to_thread(self.acquire, owner))
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The worker thread keeps waiting; hand its slot back as soon as it gets one
+            def _release_if_acquired(f):
+                if not f.cancelled() and f.exception() is None and f.result():
+                    self.release(owner)
+            future.add_done_callback(_release_if_acquired)
+            raise
+
+    @contextmanager
+    def slot(self, owner: Hashable):
+        self.acquire(owner)
+        try:
+            yield
+        finally:
+            self.release(owner)
+
+
+def window_wait(entries: Sequence, used: int, tokens: int, now: float, window: float,
+                tokens_per_minute: Optional[int] = None, requests_per_minute: Optional[int] = None) -> float:
+    """
+    Seconds until a request of `tokens` fits into a sliding window, 0 if it fits now.
+
+    Args:
+        entries: [admitted_at, tokens] of the requests in the window, oldest first.
+        used: Sum of their tokens.
+    """
+    wait = 0.0
+    if requests_per_minute is not None and len(entries) >= requests_per_minute:
+        wait = entries[len(entries) - requests_per_minute][0] + window - now
+    if tokens_per_minute is None or not entries:
+        return wait
+    excess = used + min(tokens, tokens_per_minute) - tokens_per_minute
+    if excess <= 0:
+        return wait
+    if tokens > tokens_per_minute:
+        return max(wait, entries[-1][0] + window - now)
+    for admitted_at, entry_tokens in entries:
+        excess -= entry_tokens
+        if excess <= 0:
+            return max(wait, admitted_at + window - now)
+    return max(wait, entries[-1][0] + window - now)
+
+
+class TokenBudget:
+    """
+    Tokens-per-minute (and requests-per-minute) budget over a sliding window.
+
+    A request is admitted while the tokens of the requests admitted in the last
+    `window` seconds plus its own stay within the limit; a request larger than
+    the whole limit is admitted once the window is empty. Admission reserves the
+    estimated tokens, and settle() replaces them with the tokens the provider
+    reported, so over-estimates are given back as soon as a response arrives.
+    With requests_per_minute, at most that many requests are admitted per window.
+    Thread-safe; async callers use acquire_async.
+
+    Args:
+        tokens_per_minute: Tokens admitted per window, None for no token limit.
+        window: Length of the window in seconds.
+        requests_per_minute: Requests admitted per window, None for no request limit.
+    """
+
+    def __init__(self, tokens_per_minute: Optional[int] = None, window: float = 60.0, requests_per_minute: Optional[int] = None):
+        if tokens_per_minute is None and requests_per_minute is None:
+            raise ValueError("tokens_per_minute or requests_per_minute is required")
+        if tokens_per_minute is not None and tokens_per_minute < 1:
+            raise ValueError(f"tokens_per_minute should be >= 1, got {tokens_per_minute}")
+        if requests_per_minute is not None and requests_per_minute < 1:
+            raise ValueError(f"requests_per_minute should be >= 1, got {requests_per_minute}")
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.window = window
+        self._cond = threading.Condition()
+        self._entries = deque()  # [admitted_at, tokens], oldest first
+        self._used = 0
+
+    @property
+    def used(self) -> int:
+        """Tokens admitted in the current window"""
+        with self._cond:
+            self._expire(time.monotonic())
+            return self._used
+
+    def _expire(self, now: float):
+        while self._entries and self._entries[0][0] <= now - self.window:
+            self._used -= self._entries.popleft()[1]
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        """Seconds until `tokens` fit into the window, 0 if they fit now"""
+        return window_wait(self._entries, self._used, tokens, now, self.window, self.tokens_per_minute, self.requests_per_minute)
+
+    def acquire(self, tokens: int) -> List:
+        """
+        Blocks until `tokens` may be spent.
+
+        Returns:
+            list: The reservation, to be passed to settle().
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = self._reserve(tokens, now)
+                if isinstance(wait, list):
+                    return wait
+                self._cond.wait(wait)
+
+    def _reserve(self, tokens: int, now: float):
+        """Reserves `tokens` if they fit and returns the reservation, else the seconds to wait"""
+        self._expire(now)
+        wait = self._wait_time(tokens, now)
+        if wait > 0:
+            return wait
+        reservation = [now, tokens]
+        self._entries.append(reservation)
+        self._used += tokens
+        return reservation
+
+    def settle(self, reservation: List, tokens: int):
+        """Replaces the tokens of a reservation with the tokens actually used"""
+        with self._cond:
+            self._expire(time.monotonic())
+            if self._entries and reservation[0] >= self._entries[0][0]:  # still in the window
+                self._used += tokens - reservation[1]
+                reservation[1] = tokens
+            self._cond.notify_all()
+
+    async def acquire_async(self, tokens: int) -> List:
+        """Acquires tokens without blocking the event loop"""
+        with self._cond:
+            reservation = self._reserve(tokens, time.monotonic())
+        if isinstance(reservation, list):  # fits now, no need for a thread
+            return reservation
+        future = asyncio.ensure_future(asyncio.to_thread(self.acquire, tokens))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The worker thread keeps waiting; give the tokens back as soon as it gets them
+            def _settle_if_acquired(f):
+                if not f.cancelled() and f.exception() is None:
+                    self.settle(f.result(), 0)
+            future.add_done_callback(_settle_if_acquired)
+            raise
@@ -0,0 +1,249 @@
+"""
+Load balancing across several OpenAI-compatible endpoints
+
+An EndpointPool spreads the requests of a parser over replicas of the same
+model. Every attempt picks an endpoint:
+
+    least_outstanding  fewest requests in flight relative to the weight
+    ewma               lowest expected wait: latency EWMA x (requests in flight + 1) / weight
+
+An endpoint failing `failure_threshold` attempts in a row (server errors,
+timeouts, connection errors; rate limits and bad requests do not count) is
+ejected for `eject_seconds`. After that, a single probe request is let
+through. If it succeeds, the endpoint is back in rotation; if it fails, the
+endpoint is ejected again. Endpoints paused after a 429 (see
+dots_ocr.model.retry) are skipped until the pause is over.
+
+Endpoints are given as "URL[,weight=W][,concurrency=N][,api_key=KEY]", where
+URL may be a base URL or host:port (read as http://host:port/v1):
+
+    pool = EndpointPool([parse_endpoint("gpu-a:8000,weight=2,concurrency=16"), parse_endpoint("gpu-b:8000")])
+"""
+
+import asyncio
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, List, Optional
+
+from dots_ocr.model.retry import classify_error, shared_backoff
+from dots_ocr.utils import metrics
+
+STRATEGIES = ("least_outstanding", "ewma")
+# Error kinds counting as a failure of the endpoint
+UNHEALTHY = ("server_error", "timeout", "connection_error")
+
+
+class Endpoint:
+    """
+    One backend replica and its live state.
+
+    Args:
+        base_url: OpenAI-compatible base URL, e.g. http://gpu-a:8000/v1.
+        weight: Share of the traffic relative to the other endpoints.
+        max_concurrency: Requests in flight at most, None for no limit.
+        api_key: Key of this endpoint, None to use the parser's key.
+    """
+
+    def __init__(self, base_url: str, weight: float = 1.0, max_concurrency: Optional[int] = None, api_key: Optional[str] = None):
+        if weight <= 0:
+            raise ValueError(f"weight should be > 0, got {weight}")
+        self.base_url = base_url.rstrip("/")
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.api_key = api_key
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.probing = False
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+
+    def __repr__(self):
+        return f"Endpoint({self.base_url!r}, weight={self.weight}, max_concurrency={self.max_concurrency})"
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until > 0
+
+
+def parse_endpoint(spec: str) -> Endpoint:
+    """Parses "URL[,weight=W][,concurrency=N][,api_key=KEY]" into an Endpoint"""
+    url, *options = [part.strip() for part in spec.split(",")]
+    if "://" not in url:
+        url = f"http://{url}/v1"
+    kwargs = {}
+    for option in options:
+        key, _, value = option.partition("=")
+        if key == "weight":
+            kwargs["weight"] = float(value)
+        elif key == "concurrency":
+            kwargs["max_concurrency"] = int(value)
+        elif key == "api_key":
+            kwargs["api_key"] = value
+        else:
+            raise ValueError(f"unknown endpoint option {key!r} in {spec!r}")
+    return Endpoint(url, **kwargs)
+
+
+class EndpointPool:
+    """
+    Routes requests over a set of endpoints, ejecting unhealthy ones.
+
+    Thread-safe; async callers use acquire_async. Every acquire() must be
+    followed by release() (track() does both around an attempt).
+
+    Args:
+        endpoints: Endpoints, or specs for parse_endpoint.
+        strategy: "least_outstanding" or "ewma".
+        failure_threshold: Consecutive failures that eject an endpoint.
+        eject_seconds: Time an ejected endpoint is left alone before it is probed.
+        ewma_alpha: Weight of the newest latency in the EWMA.
+    """
+
+    def __init__(self, endpoints: Iterable, strategy: str = "least_outstanding", failure_threshold: int = 3, eject_seconds: float = 30.0, ewma_alpha: float = 0.3):
+        self.endpoints: List[Endpoint] = [e if isinstance(e, Endpoint) else parse_endpoint(e) for e in endpoints]
+        if not self.endpoints:
+            raise ValueError("at least one endpoint is required")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"strategy should be one of {STRATEGIES}, got {strategy}")
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.eject_seconds = eject_seconds
+        self.ewma_alpha = ewma_alpha
+        self._cond = threading.Condition()
+
+    def _score(self, endpoint: Endpoint) -> float:
+        load = (endpoint.outstanding + 1) / endpoint.weight
+        if self.strategy == "ewma":
+            # Endpoints without a measurement yet are tried first
+            return load * (endpoint.ewma_latency or 0.0)
+        return load
+
+    def _pick(self, now: float):
+        """Returns an endpoint to use now, or the seconds until one may become usable"""
+        candidates, waits = [], []
+        for endpoint in self.endpoints:
+            if endpoint.max_concurrency is not None and endpoint.outstanding >= endpoint.max_concurrency:
+                continue
+            if endpoint.ejected:
+                if endpoint.probing:
+                    continue
+                if now < endpoint.ejected_until:
+                    waits.append(endpoint.ejected_until - now)
+                    continue
+            paused = shared_backoff(endpoint.base_url).remaining()
+            if paused > 0:
+                waits.append(paused)
+                continue
+            candidates.append(endpoint)
+        if not candidates:
+            # None: wait for a release
+            return min(waits) if waits else None
+        best = min(self._score(e) for e in candidates)
+        return random.choice([e for e in candidates if self._score(e) == best])
+
+    def _take(self, now: float):
+        picked = self._pick(now)
+        if isinstance(picked, Endpoint):
+            picked.outstanding += 1
+            picked.requests += 1
+            if picked.ejected:
+                picked.probing = True
+        return picked
+
+    def acquire(self) -> Endpoint:
+        """Blocks until an endpoint has capacity (and is neither ejected nor paused) and returns it"""
+        with self._cond:
+            while True:
+                picked = self._take(time.monotonic())
+                if isinstance(picked, Endpoint):
+                    return picked
+                self._cond.wait(picked)
+
+    async def acquire_async(self) -> Endpoint:
+        """Acquires an endpoint without blocking the event loop"""
+        with self._cond:
+            picked = self._take(time.monotonic())
+        if isinstance(picked, Endpoint):
+            return picked
+        future = asyncio.ensure_future(asyncio.to_thread(self.acquire))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The worker thread keeps waiting; hand its endpoint back as soon as it gets one
+            def _release_if_acquired(f):
+                if not f.cancelled() and f.exception() is None:
+                    self.release(f.result(), error=asyncio.CancelledError())
+            future.add_done_callback(_release_if_acquired)
+            raise
+
+    def release(self, endpoint: Endpoint, latency: Optional[float] = None, error: Optional[BaseException] = None):
+        """
+        Returns an endpoint after an attempt and updates its health.
+
+        Args:
+            endpoint: The endpoint returned by acquire().
+            latency: Seconds the attempt took, if it got a response.
+            error: The exception the attempt raised, if any.
+        """
+        kind = classify_error(error)[0] if isinstance(error, Exception) else ("cancelled" if error else "ok")
+        with self._cond:
+            endpoint.outstanding -= 1
+            was_probe, endpoint.probing = endpoint.probing, False
+            if kind in UNHEALTHY:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if was_probe or endpoint.consecutive_failures >= self.failure_threshold:
+                    if not endpoint.ejected or was_probe:
+                        endpoint.ejections += 1
+                        metrics.inc("dots_ocr_endpoint_ejections_total", endpoint=endpoint.base_url)
+                        print(f"Endpoint {endpoint.base_url} ejected for {self.eject_seconds:g}s after {endpoint.consecutive_failures} failures in a row")
+                    endpoint.ejected_until = time.monotonic() + self.eject_seconds
+            elif kind != "cancelled":
+                endpoint.consecutive_failures = 0
+                if endpoint.ejected and kind == "ok":
+                    endpoint.ejected_until = 0.0
+                    print(f"Endpoint {endpoint.base_url} is healthy again")
+                if kind == "ok" and latency is not None:
+                    if endpoint.ewma_latency is None:
+                        endpoint.ewma_latency = latency
+                    else:
+                        endpoint.ewma_latency += self.ewma_alpha * (latency - endpoint.ewma_latency)
+            self._cond.notify_all()
+        metrics.inc("dots_ocr_endpoint_requests_total", endpoint=endpoint.base_url, outcome=kind)
+
+    @contextmanager
+    def track(self, endpoint: Endpoint):
+        """Releases `endpoint` after the attempt in the block, with its latency and error"""
+        started = time.perf_counter()
+        try:
+            yield endpoint
+        except BaseException as e:
+            self.release(endpoint, time.perf_counter() - started, e)
+            raise
+        self.release(endpoint, time.perf_counter() - started)
+
+    def stats(self) -> List[dict]:
+        with self._cond:
+            return [{
+                "base_url": e.base_url,
+                "weight": e.weight,
+                "requests": e.requests,
+                "failures": e.failures,
+                "ejections": e.ejections,
+                "ejected": e.ejected,
+                "ewma_latency_ms": round(e.ewma_latency * 1000, 1) if e.ewma_latency is not None else None,
+            } for e in self.endpoints]
+
+    def format_stats(self) -> str:
+        lines = [f"Endpoints ({self.strategy}):"]
+        for s in self.stats():
+            latency = f"{s['ewma_latency_ms']:.0f} ms" if s['ewma_latency_ms'] is not None else "-"
+            state = " (ejected)" if s['ejected'] else ""
+            lines.append(f"  {s['base_url']:<40} weight {s['weight']:<4g} {s['requests']:5d} requests, "
+                         f"{s['failures']} failures, {s['ejections']} ejections, latency {latency}{state}")
+        return "\n".join(lines)
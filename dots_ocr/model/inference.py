@@ -1,14 +1,62 @@
-import requests
 from dots_ocr.utils.image_utils import PILimage_to_base64
+from dots_ocr.utils.timing import StageTimer
+from dots_ocr.utils import metrics
+from dots_ocr.model.recorder import get_recorder, request_fingerprint
+from dots_ocr.model.tokens import estimate_request_tokens
+from dots_ocr.model.retry import RetryPolicy, classify_error, shared_backoff
 
-from openai import OpenAI, AsyncOpenAI
 import os
-from dotenv import load_dotenv
 import asyncio
 import time
-import random
+from contextlib import nullcontext
+
+# openai and dotenv are imported on the first request: openai alone
+# takes longer to import than the rest of the package
+_env_loaded = False
+
+
+def load_env():
+    """Loads a .env file into os.environ, once (variables already set win)"""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+
+def usage_dict(response):
+    """Returns the token usage reported with a completion as a dict, or None"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+    }
+
+
+def record_usage(response):
+    """Adds the token usage reported with a completion to the metrics"""
+    usage = usage_dict(response)
+    if usage is None:
+        return
+    metrics.inc("dots_ocr_tokens_total", usage["prompt_tokens"], kind="prompt")
+    metrics.inc("dots_ocr_tokens_total", usage["completion_tokens"], kind="completion")
+
+
+def clean_response_content(response_content):
+    """Strips the markdown code fences some models wrap their output in"""
+    # Clean up markdown formatting if present (common with Gemini)
+    if response_content.startswith("```json"):
+        response_content = response_content[7:]
+    elif response_content.startswith("```"):
+        response_content = response_content[3:]
+    
+    if response_content.endswith("```"):
+        response_content = response_content[:-3]
+        
+    return response_content.strip()
 
-load_dotenv()
 
 async def async_inference_with_api(
         image,
@@ -23,11 +71,20 @@ async def async_inference_with_api(
         max_completion_tokens=32768,
         model_name='rednote-hilab/dots.ocr',
         request_delay=2.0,
+        timer=None,
+        token_budget=None,
+        retry_policy=None,
+        endpoint_pool=None,
+        key_pool=None,
         ):
-    
-    # Initial delay to throttle requests
-    if request_delay > 0:
-        await asyncio.sleep(request_delay)
+    # timer: optional StageTimer of the page, receives throttle/encode/request/retry_sleep times and token counts
+    # token_budget: optional TokenBudget or SharedLimiter the request is admitted against (tokens/requests per minute)
+    # retry_policy: optional RetryPolicy (attempts, backoff, timeouts), RetryPolicy() by default
+    # endpoint_pool: optional EndpointPool; every attempt then goes to one of its endpoints instead of base_url
+    # key_pool: optional KeyPool; every attempt then uses the least loaded of its keys instead of api_key
+    timer = timer if timer is not None else StageTimer()
+    load_env()
+    from openai import AsyncOpenAI
 
     # Determine provider based on model name
     is_openai_model = "gpt" in model_name.lower()
@@ -56,8 +113,6 @@ async def async_inference_with_api(
     if model_name == 'rednote-hilab/dots.ocr' and os.environ.get("GEMINI_MODEL"):
          model_name = os.environ.get("GEMINI_MODEL")
 
-    client = AsyncOpenAI(api_key=final_api_key, base_url=base_url)
-    
     # Prompt adjustment
     # Both Gemini via OpenAI connector and Native OpenAI GPT should use plain text prompt
     if is_gemini_model or is_openai_model:
@@ -65,6 +120,12 @@ async def async_inference_with_api(
     else:
         text_content = f"<|img|><|imgpad|><|endofimg|>{prompt}"
 
+    with timer.stage("encode"):
+        image_url = PILimage_to_base64(image)
+    payload_bytes = len(image_url) + len(text_content.encode("utf-8"))
+    timer.payload_bytes += payload_bytes
+    timer.estimated_tokens = estimate_request_tokens(image.width, image.height, text_content, max_completion_tokens)
+
     messages = []
     messages.append(
         {
@@ -72,56 +133,147 @@ async def async_inference_with_api(
             "content": [
                 {
                     "type": "image_url",
-                    "image_url": {"url":  PILimage_to_base64(image)},
+                    "image_url": {"url": image_url},
                 },
                 {"type": "text", "text": text_content} 
             ],
         }
     )
     
-    max_retries = 8
-    base_delay = 5 # seconds
+    recorder = get_recorder()
+    fingerprint = None
+    if recorder is not None:
+        fingerprint = request_fingerprint(model_name, text_content, image_url, temperature, top_p, max_completion_tokens)
+        if recorder.replaying:
+            entry = recorder.lookup(fingerprint)
+            if entry is not None:
+                if recorder.replay_latency:
+                    with timer.stage("request"):
+                        await asyncio.sleep(entry["latency"])
+                timer.usage = entry.get("usage")
+                metrics.inc("dots_ocr_requests_total", outcome="replayed")
+                return clean_response_content(entry["content"])
+            if not recorder.passthrough:
+                print(f"Replay: no recorded response for request {fingerprint[:12]}")
+                return None
+
+    # Initial delay throttles requests (replayed responses skip it); the budget admits every attempt below
+    if request_delay > 0:
+        with timer.stage("throttle"):
+            await asyncio.sleep(request_delay)
+    reservation = None
 
+    policy = retry_policy if retry_policy is not None else RetryPolicy()
+    backoff = shared_backoff(base_url)
+    deadline = policy.deadline()
+
+    # Retries are done here (see RetryPolicy), not also inside the client
+    client = AsyncOpenAI(api_key=final_api_key, base_url=base_url, max_retries=0)
+    # Closed when the request is done: connections of clients left to the garbage collector
+    # are torn down at random times, which can break connections the event loop opens meanwhile
+    clients = [client]
     try:
-        for attempt in range(max_retries):
+        attempt = 0
+        while True:
+            endpoint = key = None
+            try:
+                if endpoint_pool is None:
+                    # A 429 seen by any request to this endpoint pauses all of them
+                    paused = backoff.remaining()
+                    if paused > 0:
+                        with timer.stage("throttle"):
+                            await asyncio.sleep(paused)
+                if token_budget is not None:
+                    # Every attempt is admitted, so retries count towards the requests/tokens per minute too
+                    with timer.stage("throttle"):
+                        reservation = await token_budget.acquire_async(sum(timer.estimated_tokens.values()))
+                if key_pool is not None:
+                    # Least loaded key that is within its limits and not cooling down after a 429;
+                    # taken first, so waiting for a key holds no endpoint slot
+                    with timer.stage("queue_wait"):
+                        key = await key_pool.acquire_async()
+                if endpoint_pool is not None:
+                    # Every attempt picks an endpoint that is healthy and not paused, so retries fail over
+                    with timer.stage("queue_wait"):
+                        endpoint = await endpoint_pool.acquire_async()
+                    backoff = shared_backoff(endpoint.base_url)
+                if endpoint is not None or key is not None:
+                    client = AsyncOpenAI(
+                        api_key=(key.key if key is not None else None) or (endpoint.api_key if endpoint is not None else None) or final_api_key,
+                        base_url=endpoint.base_url if endpoint is not None else base_url,
+                        max_retries=0,
+                    )
+                    clients.append(client)
+            except BaseException:
+                # Cancelled or failed before the request was sent: give back what this attempt took
+                # (once the request starts, track() releases them)
+                if key is not None:
+                    key_pool.release(key, asyncio.CancelledError())
+                if endpoint is not None:
+                    endpoint_pool.release(endpoint, error=asyncio.CancelledError())
+                if reservation is not None:
+                    token_budget.settle(reservation, 0)  # still counts as a request in the window
+                    reservation = None
+                raise
             try:
-                response = await client.chat.completions.create(
-                    messages=messages, 
-                    model=model_name, 
-                    max_completion_tokens=max_completion_tokens,
-                    temperature=temperature,
-                    top_p=top_p
-                )
+                metrics.inc("dots_ocr_upload_bytes_total", payload_bytes)
+                started = time.perf_counter()
+                with timer.stage("request"), metrics.in_progress("dots_ocr_requests_in_flight"), \
+                        (endpoint_pool.track(endpoint) if endpoint is not None else nullcontext()), \
+                        (key_pool.track(key) if key is not None else nullcontext()):
+                    response = await client.chat.completions.create(
+                        messages=messages, 
+                        model=model_name, 
+                        max_completion_tokens=max_completion_tokens,
+                        temperature=temperature,
+                        top_p=top_p,
+                        timeout=policy.attempt_timeout(deadline),
+                    )
+                metrics.inc("dots_ocr_requests_total", outcome="ok")
+                record_usage(response)
+                timer.usage = usage_dict(response)
+                if key is not None:
+                    key_pool.add_usage(key, timer.usage)
                 break # Success
             except Exception as e:
-                # Check for rate limit error (usually 429)
-                if "429" in str(e) or "quota" in str(e).lower():
-                    if attempt < max_retries - 1:
-                        # Exponential backoff with jitter
-                        delay = (base_delay * (2 ** attempt)) + random.uniform(0, 1)
-                        print(f"Rate limited (429). Retrying in {delay:.2f}s...")
-                        await asyncio.sleep(delay)
-                        continue
-                raise e # Re-raise other errors or if retries exhausted
+                kind, retry_after = classify_error(e)
+                metrics.inc("dots_ocr_requests_total", outcome=kind)
+                if reservation is not None:
+                    # A rejected request uses no tokens; other failures keep their estimate, they may have been billed
+                    if kind == "rate_limited":
+                        token_budget.settle(reservation, 0)
+                    reservation = None
+                delay = policy.next_delay(attempt, kind, retry_after, deadline)
+                if kind == "rate_limited":
+                    metrics.inc("dots_ocr_rate_limited_total")
+                    if delay is not None and key is not None:
+                        # Only this key is limited: it cools down and the next attempt takes another one
+                        delay = 0.0
+                    elif delay is not None:
+                        backoff.pause(delay)
+                if delay is None:
+                    raise # Not retryable, out of attempts or out of time
+                retry_in = "with another key" if delay == 0 and key is not None else f"in {delay:.1f}s"
+                print(f"{kind} ({type(e).__name__}), retrying {retry_in} (attempt {attempt + 1}/{policy.max_attempts})...")
+                timer.retries += 1
+                with timer.stage("retry_sleep"):
+                    await asyncio.sleep(delay)
+                attempt += 1
 
         response_content = response.choices[0].message.content
-        
-        # Clean up markdown formatting if present (common with Gemini)
-        if response_content.startswith("```json"):
-            response_content = response_content[7:]
-        elif response_content.startswith("```"):
-            response_content = response_content[3:]
-        
-        if response_content.endswith("```"):
-            response_content = response_content[:-3]
-            
-        return response_content.strip()
-    except requests.exceptions.RequestException as e:
-        print(f"request error: {e}")
-        return None
+        if fingerprint is not None and recorder.recording and response_content is not None:
+            recorder.record(fingerprint, model_name, response_content, latency=time.perf_counter() - started, attempts=attempt + 1, usage=usage_dict(response))
+
+        return clean_response_content(response_content)
     except Exception as e:
         print(f"API error: {e}")
         return None
+    finally:
+        for client in clients:
+            await client.close()
+        if reservation is not None and timer.usage:
+            # The window holds what the provider counted; without usage the estimate stays reserved
+            token_budget.settle(reservation, timer.usage["prompt_tokens"] + timer.usage["completion_tokens"])
 
 def inference_with_api(
         image,
@@ -136,11 +288,20 @@ def inference_with_api(
         max_completion_tokens=32768,
         model_name='rednote-hilab/dots.ocr',
         request_delay=2.0,
+        timer=None,
+        token_budget=None,
+        retry_policy=None,
+        endpoint_pool=None,
+        key_pool=None,
         ):
-    
-    # Initial delay to throttle requests
-    if request_delay > 0:
-        time.sleep(request_delay)
+    # timer: optional StageTimer of the page, receives throttle/encode/request/retry_sleep times and token counts
+    # token_budget: optional TokenBudget or SharedLimiter the request is admitted against (tokens/requests per minute)
+    # retry_policy: optional RetryPolicy (attempts, backoff, timeouts), RetryPolicy() by default
+    # endpoint_pool: optional EndpointPool; every attempt then goes to one of its endpoints instead of base_url
+    # key_pool: optional KeyPool; every attempt then uses the least loaded of its keys instead of api_key
+    timer = timer if timer is not None else StageTimer()
+    load_env()
+    from openai import OpenAI
 
     # Determine provider based on model name
     is_openai_model = "gpt" in model_name.lower()
@@ -169,8 +330,6 @@ def inference_with_api(
     if model_name == 'rednote-hilab/dots.ocr' and os.environ.get("GEMINI_MODEL"):
          model_name = os.environ.get("GEMINI_MODEL")
 
-    client = OpenAI(api_key=final_api_key, base_url=base_url)
-    
     # Prompt adjustment
     # Both Gemini via OpenAI connector and Native OpenAI GPT should use plain text prompt
     if is_gemini_model or is_openai_model:
@@ -178,6 +337,12 @@ def inference_with_api(
     else:
         text_content = f"<|img|><|imgpad|><|endofimg|>{prompt}"
 
+    with timer.stage("encode"):
+        image_url = PILimage_to_base64(image)
+    payload_bytes = len(image_url) + len(text_content.encode("utf-8"))
+    timer.payload_bytes += payload_bytes
+    timer.estimated_tokens = estimate_request_tokens(image.width, image.height, text_content, max_completion_tokens)
+
     messages = []
     messages.append(
         {
@@ -185,54 +350,144 @@ def inference_with_api(
             "content": [
                 {
                     "type": "image_url",
-                    "image_url": {"url":  PILimage_to_base64(image)},
+                    "image_url": {"url": image_url},
                 },
                 {"type": "text", "text": text_content} 
             ],
         }
     )
     
-    max_retries = 8
-    base_delay = 5 # seconds
+    recorder = get_recorder()
+    fingerprint = None
+    if recorder is not None:
+        fingerprint = request_fingerprint(model_name, text_content, image_url, temperature, top_p, max_completion_tokens)
+        if recorder.replaying:
+            entry = recorder.lookup(fingerprint)
+            if entry is not None:
+                if recorder.replay_latency:
+                    with timer.stage("request"):
+                        time.sleep(entry["latency"])
+                timer.usage = entry.get("usage")
+                metrics.inc("dots_ocr_requests_total", outcome="replayed")
+                return clean_response_content(entry["content"])
+            if not recorder.passthrough:
+                print(f"Replay: no recorded response for request {fingerprint[:12]}")
+                return None
+
+    # Initial delay throttles requests (replayed responses skip it); the budget admits every attempt below
+    if request_delay > 0:
+        with timer.stage("throttle"):
+            time.sleep(request_delay)
+    reservation = None
 
+    policy = retry_policy if retry_policy is not None else RetryPolicy()
+    backoff = shared_backoff(base_url)
+    deadline = policy.deadline()
+
+    # Retries are done here (see RetryPolicy), not also inside the client
+    client = OpenAI(api_key=final_api_key, base_url=base_url, max_retries=0)
+    # Closed when the request is done instead of whenever the garbage collector gets to them
+    clients = [client]
     try:
-        for attempt in range(max_retries):
+        attempt = 0
+        while True:
+            endpoint = key = None
+            try:
+                if endpoint_pool is None:
+                    # A 429 seen by any request to this endpoint pauses all of them
+                    paused = backoff.remaining()
+                    if paused > 0:
+                        with timer.stage("throttle"):
+                            time.sleep(paused)
+                if token_budget is not None:
+                    # Every attempt is admitted, so retries count towards the requests/tokens per minute too
+                    with timer.stage("throttle"):
+                        reservation = token_budget.acquire(sum(timer.estimated_tokens.values()))
+                if key_pool is not None:
+                    # Least loaded key that is within its limits and not cooling down after a 429;
+                    # taken first, so waiting for a key holds no endpoint slot
+                    with timer.stage("queue_wait"):
+                        key = key_pool.acquire()
+                if endpoint_pool is not None:
+                    # Every attempt picks an endpoint that is healthy and not paused, so retries fail over
+                    with timer.stage("queue_wait"):
+                        endpoint = endpoint_pool.acquire()
+                    backoff = shared_backoff(endpoint.base_url)
+                if endpoint is not None or key is not None:
+                    client = OpenAI(
+                        api_key=(key.key if key is not None else None) or (endpoint.api_key if endpoint is not None else None) or final_api_key,
+                        base_url=endpoint.base_url if endpoint is not None else base_url,
+                        max_retries=0,
+                    )
+                    clients.append(client)
+            except BaseException:
+                # Cancelled or failed before the request was sent: give back what this attempt took
+                # (once the request starts, track() releases them)
+                if key is not None:
+                    key_pool.release(key, asyncio.CancelledError())
+                if endpoint is not None:
+                    endpoint_pool.release(endpoint, error=asyncio.CancelledError())
+                if reservation is not None:
+                    token_budget.settle(reservation, 0)  # still counts as a request in the window
+                    reservation = None
+                raise
             try:
-                response = client.chat.completions.create(
-                    messages=messages, 
-                    model=model_name, 
-                    max_completion_tokens=max_completion_tokens,
-                    temperature=temperature,
-                    top_p=top_p
-                )
+                metrics.inc("dots_ocr_upload_bytes_total", payload_bytes)
+                started = time.perf_counter()
+                with timer.stage("request"), metrics.in_progress("dots_ocr_requests_in_flight"), \
+                        (endpoint_pool.track(endpoint) if endpoint is not None else nullcontext()), \
+                        (key_pool.track(key) if key is not None else nullcontext()):
+                    response = client.chat.completions.create(
+                        messages=messages, 
+                        model=model_name, 
+                        max_completion_tokens=max_completion_tokens,
+                        temperature=temperature,
+                        top_p=top_p,
+                        timeout=policy.attempt_timeout(deadline),
+                    )
+                metrics.inc("dots_ocr_requests_total", outcome="ok")
+                record_usage(response)
+                timer.usage = usage_dict(response)
+                if key is not None:
+                    key_pool.add_usage(key, timer.usage)
                 break # Success
             except Exception as e:
-                # Check for rate limit error (usually 429)
-                if "429" in str(e) or "quota" in str(e).lower():
-                    if attempt < max_retries - 1:
-                        # Exponential backoff with jitter
-                         delay = (base_delay * (2 ** attempt)) + random.uniform(0, 1)
-                         print(f"Rate limited (429). Retrying in {delay}s...")
-                         time.sleep(delay)
-                         continue
-                raise e # Re-raise other errors or if retries exhausted
+                kind, retry_after = classify_error(e)
+                metrics.inc("dots_ocr_requests_total", outcome=kind)
+                if reservation is not None:
+                    # A rejected request uses no tokens; other failures keep their estimate, they may have been billed
+                    if kind == "rate_limited":
+                        token_budget.settle(reservation, 0)
+                    reservation = None
+                delay = policy.next_delay(attempt, kind, retry_after, deadline)
+                if kind == "rate_limited":
+                    metrics.inc("dots_ocr_rate_limited_total")
+                    if delay is not None and key is not None:
+                        # Only this key is limited: it cools down and the next attempt takes another one
+                        delay = 0.0
+                    elif delay is not None:
+                        backoff.pause(delay)
+                if delay is None:
+                    raise # Not retryable, out of attempts or out of time
+                retry_in = "with another key" if delay == 0 and key is not None else f"in {delay:.1f}s"
+                print(f"{kind} ({type(e).__name__}), retrying {retry_in} (attempt {attempt + 1}/{policy.max_attempts})...")
+                timer.retries += 1
+                with timer.stage("retry_sleep"):
+                    time.sleep(delay)
+                attempt += 1
 
         response_content = response.choices[0].message.content
-        
-        # Clean up markdown formatting if present (common with Gemini)
-        if response_content.startswith("```json"):
-            response_content = response_content[7:]
-        elif response_content.startswith("```"):
-            response_content = response_content[3:]
-        
-        if response_content.endswith("```"):
-            response_content = response_content[:-3]
-            
-        return response_content.strip()
-    except requests.exceptions.RequestException as e:
-        print(f"request error: {e}")
-        return None
+        if fingerprint is not None and recorder.recording and response_content is not None:
+            recorder.record(fingerprint, model_name, response_content, latency=time.perf_counter() - started, attempts=attempt + 1, usage=usage_dict(response))
+
+        return clean_response_content(response_content)
     except Exception as e:
         print(f"API error: {e}")
         return None
+    finally:
+        for client in clients:
+            client.close()
+        if reservation is not None and timer.usage:
+            # The window holds what the provider counted; without usage the estimate stays reserved
+            token_budget.settle(reservation, timer.usage["prompt_tokens"] + timer.usage["completion_tokens"])
 
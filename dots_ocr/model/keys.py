@@ -0,0 +1,218 @@
+"""
+Pool of API keys
+
+Providers rate limit per key, so a batch job with several keys can go as fast
+as all of them together. A KeyPool is loaded once (see load_key_pool) and
+hands every attempt the least loaded key that is available, i.e.
+
+- below its own requests-per-minute limit and concurrency limit,
+- not cooling down after a 429 (for as long as Retry-After asked, or
+  `cooldown` seconds).
+
+A rate limited attempt is retried right away with another key instead of
+pausing the endpoint. Requests, outcomes and reported tokens are counted per
+key and printed with the run summary; keys are only shown masked.
+
+Key files have one key per line, "KEY[,name=NAME][,rpm=N][,concurrency=N]";
+blank lines and lines starting with # are skipped.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterable, List, Optional
+
+from dots_ocr.model.retry import classify_error
+from dots_ocr.utils import metrics
+
+
+def mask_key(key: str) -> str:
+    return f"{key[:3]}...{key[-4:]}" if len(key) > 10 else "***"
+
+
+class ApiKey:
+    """
+    One API key, its limits and its usage.
+
+    Args:
+        key: The secret.
+        name: Label in the summary and metrics (default: the masked key).
+        rpm: Requests per minute allowed on the key, None for no limit.
+        max_concurrency: Requests in flight at most, None for no limit.
+    """
+
+    def __init__(self, key: str, name: Optional[str] = None, rpm: Optional[int] = None, max_concurrency: Optional[int] = None):
+        self.key = key
+        self.name = name or mask_key(key)
+        self.rpm = rpm
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.cooldown_until = 0.0
+        self.started = deque()  # monotonic start times of the last minute
+        self.requests = 0
+        self.ok = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def __repr__(self):
+        return f"ApiKey({self.name!r}, rpm={self.rpm}, max_concurrency={self.max_concurrency})"
+
+
+def parse_key(line: str) -> ApiKey:
+    """Parses "KEY[,name=NAME][,rpm=N][,concurrency=N]" into an ApiKey"""
+    key, *options = [part.strip() for part in line.split(",")]
+    kwargs = {}
+    for option in options:
+        name, _, value = option.partition("=")
+        if name == "name":
+            kwargs["name"] = value
+        elif name == "rpm":
+            kwargs["rpm"] = int(value)
+        elif name == "concurrency":
+            kwargs["max_concurrency"] = int(value)
+        else:
+            raise ValueError(f"unknown key option {name!r} for key {mask_key(key)}")
+    return ApiKey(key, **kwargs)
+
+
+class KeyPool:
+    """
+    Assigns API keys to requests, least loaded first.
+
+    Thread-safe; async callers use acquire_async. Every acquire() must be
+    followed by release() (track() does it around an attempt).
+
+    Args:
+        keys: ApiKey objects or lines for parse_key.
+        rpm: Default requests-per-minute limit of keys without their own.
+        max_concurrency: Default concurrency limit of keys without their own.
+        cooldown: Seconds a key rests after a 429 without Retry-After.
+    """
+
+    def __init__(self, keys: Iterable, rpm: Optional[int] = None, max_concurrency: Optional[int] = None, cooldown: float = 30.0):
+        self.keys: List[ApiKey] = [k if isinstance(k, ApiKey) else parse_key(k) for k in keys]
+        if not self.keys:
+            raise ValueError("at least one API key is required")
+        for key in self.keys:
+            key.rpm = key.rpm if key.rpm is not None else rpm
+            key.max_concurrency = key.max_concurrency if key.max_concurrency is not None else max_concurrency
+        self.cooldown = cooldown
+        self._cond = threading.Condition()
+
+    def _pick(self, now: float):
+        """Returns the key to use now, or the seconds until one may become available (None: until a release)"""
+        best, waits = None, []
+        for key in self.keys:
+            while key.started and key.started[0] <= now - 60:
+                key.started.popleft()
+            if key.cooldown_until > now:
+                waits.append(key.cooldown_until - now)
+                continue
+            if key.rpm is not None and len(key.started) >= key.rpm:
+                waits.append(key.started[0] + 60 - now)
+                continue
+            if key.max_concurrency is not None and key.outstanding >= key.max_concurrency:
+                continue
+            load = (key.outstanding, len(key.started))
+            if best is None or load < best[0]:
+                best = (load, key)
+        if best is None:
+            return min(waits) if waits else None
+        key = best[1]
+        key.outstanding += 1
+        key.requests += 1
+        key.started.append(now)
+        return key
+
+    def acquire(self) -> ApiKey:
+        """Blocks until a key is available and returns it"""
+        with self._cond:
+            while True:
+                picked = self._pick(time.monotonic())
+                if isinstance(picked, ApiKey):
+                    return picked
+                self._cond.wait(picked)
+
+    async def acquire_async(self) -> ApiKey:
+        """Acquires a key without blocking the event loop"""
+        with self._cond:
+            picked = self._pick(time.monotonic())
+        if isinstance(picked, ApiKey):
+            return picked
+        future = asyncio.ensure_future(asyncio.to_thread(self.acquire))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The worker thread keeps waiting; hand its key back as soon as it gets one
+            def _release_if_acquired(f):
+                if not f.cancelled() and f.exception() is None:
+                    self.release(f.result(), asyncio.CancelledError())
+            future.add_done_callback(_release_if_acquired)
+            raise
+
+    def release(self, key: ApiKey, error: Optional[BaseException] = None):
+        """Returns a key after an attempt; a 429 starts its cooldown"""
+        kind, retry_after = classify_error(error) if isinstance(error, Exception) else ("cancelled" if error else "ok", None)
+        with self._cond:
+            key.outstanding -= 1
+            if kind == "ok":
+                key.ok += 1
+            elif kind == "rate_limited":
+                key.rate_limited += 1
+                key.cooldown_until = max(key.cooldown_until, time.monotonic() + (retry_after if retry_after is not None else self.cooldown))
+            elif kind != "cancelled":
+                key.errors += 1
+            self._cond.notify_all()
+        metrics.inc("dots_ocr_key_requests_total", key=key.name, outcome=kind)
+
+    def add_usage(self, key: ApiKey, usage: Optional[dict]):
+        if not usage:
+            return
+        with self._cond:
+            key.prompt_tokens += usage.get("prompt_tokens", 0)
+            key.completion_tokens += usage.get("completion_tokens", 0)
+
+    @contextmanager
+    def track(self, key: ApiKey):
+        """Releases `key` after the attempt in the block, with its error"""
+        try:
+            yield key
+        except BaseException as e:
+            self.release(key, e)
+            raise
+        self.release(key)
+
+    def stats(self) -> List[dict]:
+        now = time.monotonic()
+        with self._cond:
+            return [{
+                "name": k.name,
+                "requests": k.requests,
+                "ok": k.ok,
+                "rate_limited": k.rate_limited,
+                "errors": k.errors,
+                "prompt_tokens": k.prompt_tokens,
+                "completion_tokens": k.completion_tokens,
+                "cooling_down_s": round(max(0.0, k.cooldown_until - now), 1),
+            } for k in self.keys]
+
+    def format_stats(self) -> str:
+        lines = [f"API keys ({len(self.keys)}):"]
+        for s in self.stats():
+            cooling = f", cooling down {s['cooling_down_s']:.0f}s" if s['cooling_down_s'] else ""
+            lines.append(f"  {s['name']:<16} {s['requests']:5d} requests ({s['ok']} ok, {s['rate_limited']} x 429, {s['errors']} errors), "
+                         f"{s['prompt_tokens']:,} prompt + {s['completion_tokens']:,} completion tokens{cooling}")
+        return "\n".join(lines)
+
+
+def load_key_pool(path: str, **kwargs) -> KeyPool:
+    """Reads a key file (see the module docstring) into a KeyPool; kwargs go to KeyPool"""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    pool = KeyPool([line for line in lines if line and not line.startswith("#")], **kwargs)
+    print(f"Loaded {len(pool.keys)} API keys from {path}")
+    return pool
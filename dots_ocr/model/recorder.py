@@ -0,0 +1,170 @@
+"""
+Record and Replay of API Interactions
+
+In record mode every successful API call is appended to an archive: a
+fingerprint of the request (model, sampling parameters, prompt text and image),
+the raw response text, its token usage and timing. In replay mode the archive
+answers requests with the same fingerprint instead of the provider, so
+post-processing and formatting changes can be re-run on already parsed
+documents for free, optionally with the latency the provider had.
+
+The archive is append-only JSON lines; a name ending in .gz is written as
+gzip members of a few records each, which keeps it compact. Records are also
+readable by benchmarks/mock_server.py --recorded.
+
+    set_recorder(ApiRecorder("run.jsonl.gz", mode="record"))
+    set_recorder(ApiRecorder("run.jsonl.gz", mode="replay", replay_latency=True))
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+MODES = ("record", "replay")
+
+
+def request_fingerprint(model: str, text: str, image_url: str, temperature, top_p, max_completion_tokens) -> str:
+    """Hashes everything in a request that can change the response"""
+    digest = hashlib.sha256()
+    header = json.dumps([model, temperature, top_p, max_completion_tokens, text], ensure_ascii=False)
+    digest.update(header.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(image_url.encode("ascii", errors="replace"))
+    return digest.hexdigest()
+
+
+def read_archive(path: str) -> List[dict]:
+    """Reads all records of an archive (plain or gzip JSON lines)"""
+    opener = gzip.open if path.endswith(".gz") else open
+    records = []
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+
+class ApiRecorder:
+    """
+    Records API responses to an archive or replays them from it.
+
+    Args:
+        path: Archive file (.jsonl, or .jsonl.gz for compressed).
+        mode: "record" appends responses, "replay" serves them.
+        replay_latency: In replay mode, wait as long as the recorded request took.
+        passthrough: In replay mode, send requests missing from the archive to the
+            API (and record them) instead of failing them.
+        flush_every: Records buffered per gzip member; plain archives are flushed per record.
+    """
+
+    def __init__(self, path: str, mode: str = "record", replay_latency: bool = False, passthrough: bool = False, flush_every: int = 16):
+        if mode not in MODES:
+            raise ValueError(f"mode should be one of {MODES}, got {mode}")
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self.passthrough = passthrough
+        self.flush_every = flush_every
+        self.compressed = path.endswith(".gz")
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._lock = threading.Lock()
+        self._pending: List[str] = []
+        self._entries: Dict[str, dict] = {}
+
+        if mode == "replay":
+            for record in read_archive(path):
+                self._entries[record["fingerprint"]] = record  # the latest recording wins
+            print(f"Replaying {len(self._entries)} recorded responses from {path}")
+        else:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record" or self.passthrough
+
+    def lookup(self, fingerprint: str) -> Optional[dict]:
+        """Returns the recorded response of a request, or None"""
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def record(self, fingerprint: str, model: str, content: str, latency: float, attempts: int = 1, usage: Optional[dict] = None):
+        """
+        Appends a response to the archive.
+
+        Args:
+            fingerprint: request_fingerprint of the request.
+            model: Model name the request was sent to.
+            content: Raw response text, before any cleanup.
+            latency: Seconds the successful attempt took.
+            attempts: Attempts needed, including rate limited ones.
+            usage: Token usage reported by the provider.
+        """
+        entry = {
+            "fingerprint": fingerprint,
+            "model": model,
+            "created": round(time.time(), 3),
+            "latency": round(latency, 4),
+            "attempts": attempts,
+            "usage": usage,
+            "content": content,
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.recorded += 1
+            if self.replaying:
+                self._entries[fingerprint] = entry
+            self._pending.append(line)
+            if not self.compressed or len(self._pending) >= self.flush_every:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        data = "".join(self._pending).encode("utf-8")
+        self._pending = []
+        if self.compressed:
+            # Each flush is a complete gzip member; gzip readers read concatenated members as one stream
+            data = gzip.compress(data)
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        self.flush()
+        if self.replaying:
+            print(f"Replay: {self.hits} hits, {self.misses} misses")
+        if self.recorded:
+            print(f"Recorded {self.recorded} responses to {self.path}")
+
+
+_recorder: Optional[ApiRecorder] = None
+
+
+def set_recorder(recorder: Optional[ApiRecorder]):
+    """Installs the process-wide recorder used by inference_with_api (None removes it)"""
+    global _recorder
+    _recorder = recorder
+
+
+def get_recorder() -> Optional[ApiRecorder]:
+    return _recorder
@@ -0,0 +1,170 @@
+"""
+Retry policy for API requests
+
+Errors are classified by their openai exception class and HTTP status
+instead of their message:
+
+    rate_limited      429; waits as long as the server asks (Retry-After)
+    server_error      5xx, 408 and 409; retried with exponential backoff
+    timeout           the attempt ran out of time; retried
+    connection_error  connection refused or reset; retried
+    error             anything else (bad request, authentication, ...); not retried
+
+Every request has a total time budget across attempts and backoff, and every
+attempt its own timeout. A 429 pauses all requests to the same endpoint
+through a SharedBackoff, so concurrent workers back off together instead of
+each one running into the limit on its own. set_backoff_factory swaps in
+pauses shared across processes (see dots_ocr.model.shared_limiter).
+"""
+
+import email.utils
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+RETRYABLE = ("rate_limited", "server_error", "timeout", "connection_error")
+
+
+def _retry_after(exc) -> Optional[float]:
+    """Seconds the server asked to wait (retry-after-ms / Retry-After headers), or None"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:  # HTTP date
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(exc: BaseException) -> Tuple[str, Optional[float]]:
+    """
+    Classifies an exception raised by an API call.
+
+    Returns:
+        tuple: (kind, retry_after) where kind is one of RETRYABLE or "error", and
+            retry_after the delay requested by the server in seconds, or None.
+    """
+    import openai
+
+    if isinstance(exc, openai.APITimeoutError):  # subclass of APIConnectionError, check first
+        return "timeout", None
+    if isinstance(exc, openai.APIConnectionError):
+        return "connection_error", None
+    if isinstance(exc, openai.APIStatusError):
+        status = exc.status_code
+        if status == 429:
+            return "rate_limited", _retry_after(exc)
+        if status >= 500 or status in (408, 409):
+            return "server_error", _retry_after(exc)
+        return "error", None
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return ("timeout" if isinstance(exc, TimeoutError) else "connection_error"), None
+    return "error", None
+
+
+@dataclass
+class RetryPolicy:
+    """
+    How long and how often a request is retried.
+
+    Args:
+        max_attempts: Attempts per request, the first one included.
+        base_delay: Backoff before the second attempt in seconds; doubles per attempt.
+        max_delay: Upper bound of the exponential backoff (a longer Retry-After is still honoured).
+        request_timeout: Seconds a single attempt may take.
+        total_timeout: Seconds for all attempts and backoff together, None for no limit.
+    """
+    max_attempts: int = 8
+    base_delay: float = 2.0
+    max_delay: float = 60.0
+    request_timeout: float = 300.0
+    total_timeout: Optional[float] = 900.0
+
+    def deadline(self) -> Optional[float]:
+        return time.monotonic() + self.total_timeout if self.total_timeout else None
+
+    def attempt_timeout(self, deadline: Optional[float]) -> float:
+        if deadline is None:
+            return self.request_timeout
+        return max(0.001, min(self.request_timeout, deadline - time.monotonic()))
+
+    def next_delay(self, attempt: int, kind: str, retry_after: Optional[float], deadline: Optional[float]) -> Optional[float]:
+        """
+        Seconds to wait before retrying after a failed attempt, or None to give up.
+
+        Args:
+            attempt: Number of the failed attempt, starting at 0.
+            kind: Error kind from classify_error.
+            retry_after: Delay requested by the server, if any.
+            deadline: time.monotonic() deadline of the request, if any.
+        """
+        if kind not in RETRYABLE or attempt + 1 >= self.max_attempts:
+            return None
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, 0.1 * retry_after + 0.1)
+        else:
+            # Exponential backoff with jitter
+            delay = min(self.max_delay, self.base_delay * (2 ** attempt)) * random.uniform(0.5, 1.0)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+
+class SharedBackoff:
+    """
+    A pause shared by all requests to one endpoint.
+
+    A rate limited request pauses the endpoint; every request checks remaining()
+    before its next attempt and waits it out. Thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        with self._lock:
+            return max(0.0, self._resume_at - time.monotonic())
+
+
+_backoffs: Dict[str, SharedBackoff] = {}
+_backoffs_lock = threading.Lock()
+# Called as factory(key), returning an object with pause() and remaining(); None for SharedBackoff
+_backoff_factory: Optional[Callable] = None
+
+
+def set_backoff_factory(factory: Optional[Callable]):
+    """Makes shared_backoff create its pauses with factory(key), e.g. SharedLimiter.backoff; None restores SharedBackoff"""
+    global _backoff_factory
+    with _backoffs_lock:
+        _backoff_factory = factory
+        _backoffs.clear()
+
+
+def shared_backoff(key: str) -> SharedBackoff:
+    """Returns the process-wide SharedBackoff of an endpoint (e.g. its base URL)"""
+    with _backoffs_lock:
+        backoff = _backoffs.get(key)
+        if backoff is None:
+            backoff = _backoffs[key] = _backoff_factory(key) if _backoff_factory is not None else SharedBackoff()
+        return backoff
@@ -0,0 +1,168 @@
+"""
+Rate limiting shared by several processes
+
+Parser processes running side by side against the same account each have
+their own TokenBudget and 429 pauses, so together they overshoot the quota.
+A SharedLimiter keeps both in one SQLite file that all of them open:
+
+- the sliding window of admitted requests, checked against one
+  tokens-per-minute and requests-per-minute limit (same rules as TokenBudget),
+- the 429 pause of every endpoint: a rate limited request in one process
+  pauses the endpoint for all of them.
+
+Every admission is a short BEGIN IMMEDIATE transaction, which SQLite
+serializes across processes. Waiting processes poll the window (a release in
+another process cannot wake them), at most every `poll_interval` seconds.
+Times are wall-clock (time.time()), the only clock the processes share.
+
+    limiter = SharedLimiter("/tmp/dots_ocr_limiter.sqlite3", tokens_per_minute=200000, requests_per_minute=60)
+    set_backoff_factory(limiter.backoff)  # 429 pauses across processes
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from dots_ocr.model.concurrency import window_wait
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS admissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    admitted_at REAL NOT NULL,
+    tokens INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_admissions_time ON admissions(admitted_at);
+CREATE TABLE IF NOT EXISTS backoff (
+    key TEXT PRIMARY KEY,
+    resume_at REAL NOT NULL
+);
+"""
+
+
+class SharedLimiter:
+    """
+    Tokens/requests-per-minute budget and 429 pauses in a SQLite file.
+
+    Drop-in for TokenBudget (acquire, acquire_async, settle; reservations are
+    row ids). Thread-safe within a process, transactional across processes.
+
+    Args:
+        db_path: Path of the database file, created if missing. All processes sharing the budget use the same path.
+        tokens_per_minute: Tokens admitted per window, None for no token limit.
+        requests_per_minute: Requests admitted per window, None for no request limit.
+        window: Length of the window in seconds.
+        poll_interval: Longest sleep between checks while waiting for the window.
+    """
+
+    def __init__(self, db_path: str, tokens_per_minute: Optional[int] = None, requests_per_minute: Optional[int] = None,
+                 window: float = 60.0, poll_interval: float = 0.25):
+        self.db_path = db_path
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.window = window
+        self.poll_interval = poll_interval
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit mode, transactions are started explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    @property
+    def used(self) -> int:
+        """Tokens admitted in the current window, by all processes"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(SUM(tokens), 0) FROM admissions WHERE admitted_at > ?", (time.time() - self.window,)
+            ).fetchone()
+        return row[0]
+
+    def _reserve(self, tokens: int):
+        """Reserves `tokens` if they fit and returns the reservation id, else the seconds to wait"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                self._conn.execute("DELETE FROM admissions WHERE admitted_at <= ?", (now - self.window,))
+                entries = self._conn.execute("SELECT admitted_at, tokens FROM admissions ORDER BY admitted_at").fetchall()
+                used = sum(entry[1] for entry in entries)
+                wait = window_wait(entries, used, tokens, now, self.window, self.tokens_per_minute, self.requests_per_minute)
+                if wait > 0:
+                    self._conn.execute("COMMIT")
+                    return wait
+                reservation = self._conn.execute(
+                    "INSERT INTO admissions (admitted_at, tokens) VALUES (?, ?)", (now, tokens)
+                ).lastrowid
+                self._conn.execute("COMMIT")
+                return reservation
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def acquire(self, tokens: int) -> int:
+        """
+        Blocks until `tokens` may be spent.
+
+        Returns:
+            int: The reservation, to be passed to settle().
+        """
+        while True:
+            reservation = self._reserve(tokens)
+            if isinstance(reservation, int):
+                return reservation
+            # Another process may settle below its estimate before then, so look again soon
+            time.sleep(min(reservation, self.poll_interval))
+
+    def settle(self, reservation: int, tokens: int):
+        """Replaces the tokens of a reservation with the tokens actually used (no-op once it left the window)"""
+        with self._lock:
+            self._conn.execute("UPDATE admissions SET tokens = ? WHERE id = ?", (tokens, reservation))
+
+    async def acquire_async(self, tokens: int) -> int:
+        """Acquires tokens without blocking the event loop"""
+        reservation = self._reserve(tokens)
+        if isinstance(reservation, int):  # fits now, no need for a thread
+            return reservation
+        future = asyncio.ensure_future(asyncio.to_thread(self.acquire, tokens))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The worker thread keeps waiting; give the tokens back as soon as it gets them
+            def _settle_if_acquired(f):
+                if not f.cancelled() and f.exception() is None:
+                    self.settle(f.result(), 0)
+            future.add_done_callback(_settle_if_acquired)
+            raise
+
+    def backoff(self, key: str) -> "SharedFileBackoff":
+        """The 429 pause of endpoint `key` shared by all processes, for retry.set_backoff_factory"""
+        return SharedFileBackoff(self, key)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SharedFileBackoff:
+    """A SharedBackoff (pause, remaining) stored in the database of a SharedLimiter"""
+
+    def __init__(self, limiter: SharedLimiter, key: str):
+        self._limiter = limiter
+        self.key = key
+
+    def pause(self, seconds: float):
+        with self._limiter._lock:
+            self._limiter._conn.execute(
+                "INSERT INTO backoff (key, resume_at) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET resume_at = MAX(resume_at, excluded.resume_at)",
+                (self.key, time.time() + seconds),
+            )
+
+    def remaining(self) -> float:
+        with self._limiter._lock:
+            row = self._limiter._conn.execute("SELECT resume_at FROM backoff WHERE key = ?", (self.key,)).fetchone()
+        return max(0.0, row[0] - time.time()) if row else 0.0
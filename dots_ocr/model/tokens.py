@@ -0,0 +1,50 @@
+"""
+Token estimates of API requests
+
+Providers throttle on tokens per minute, so the cost of a page is known
+before it is sent: the image is resized by smart_resize to a multiple of
+IMAGE_FACTOR (28 px) in both directions, and the vision encoder turns every
+28x28 block into one token (14 px patches, merged 2x2). Text is estimated at
+about four characters per token, and the output at most max_completion_tokens.
+
+Hosted models (GPT, Gemini) tile images their own way, so for them the image
+estimate is only an approximation; the token budget corrects it with the usage
+each response reports.
+"""
+
+import math
+from typing import Dict
+
+from dots_ocr.utils.consts import IMAGE_FACTOR
+
+# Vision start/end markers around the image tokens
+IMAGE_MARKER_TOKENS = 2
+# Role and formatting tokens of a single user message
+MESSAGE_OVERHEAD_TOKENS = 8
+CHARS_PER_TOKEN = 4
+
+
+def estimate_image_tokens(width: int, height: int, factor: int = IMAGE_FACTOR) -> int:
+    """Tokens of an image already resized by smart_resize (one per factor x factor block)"""
+    return math.ceil(width / factor) * math.ceil(height / factor) + IMAGE_MARKER_TOKENS
+
+
+def estimate_text_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_request_tokens(width: int, height: int, prompt: str, max_completion_tokens: int) -> Dict[str, int]:
+    """
+    Estimates the tokens of one page request.
+
+    Args:
+        width, height: Size of the image sent, after smart_resize.
+        prompt: Prompt text sent with the image.
+        max_completion_tokens: Output limit of the request.
+
+    Returns:
+        dict: {'input_tokens', 'output_tokens'}; output_tokens is the upper bound
+            providers count when admitting a request.
+    """
+    input_tokens = estimate_image_tokens(width, height) + estimate_text_tokens(prompt) + MESSAGE_OVERHEAD_TOKENS
+    return {'input_tokens': input_tokens, 'output_tokens': max_completion_tokens}
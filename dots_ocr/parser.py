@@ -1,18 +1,41 @@
 import os
 import json
-from tqdm import tqdm
-from multiprocessing.pool import ThreadPool
 import argparse
 import asyncio
+import tempfile
 
 
 from dots_ocr.model.inference import inference_with_api, async_inference_with_api
+from dots_ocr.model.recorder import ApiRecorder, set_recorder
+from dots_ocr.model.concurrency import TokenBudget
+from dots_ocr.model.retry import RetryPolicy, set_backoff_factory
+from dots_ocr.model.endpoints import EndpointPool
+from dots_ocr.model.keys import KeyPool, load_key_pool
 from dots_ocr.utils.consts import image_extensions, MIN_PIXELS, MAX_PIXELS
 from dots_ocr.utils.image_utils import get_image_by_fitz_doc, fetch_image, smart_resize
-from dots_ocr.utils.doc_utils import load_images_from_pdf
+from dots_ocr.utils.doc_utils import PdfPageRenderer
 from dots_ocr.utils.prompts import dict_promptmode_to_prompt, dict_gemini_prompts
 from dots_ocr.utils.layout_utils import post_process_output, draw_layout_on_image, pre_process_bboxes
-from dots_ocr.utils.format_transformer import layoutjson2md
+from dots_ocr.utils.format_transformer import render_markdown_variants
+from dots_ocr.utils.asset_store import PictureAssetStore
+from dots_ocr.utils.output_sinks import OutputSink, make_output_sink
+from dots_ocr.utils.timing import StageTimer, summarize_timings, format_timing_summary
+from dots_ocr.utils import metrics
+from dots_ocr.utils.trace import TraceRecorder
+from dots_ocr.utils.profiling import StageProfiler
+
+
+# Keys of a page result holding its content in memory; the other keys are metadata and file paths
+PAGE_CONTENT_KEYS = ('cells', 'md_content', 'md_content_nohf', 'layout_image')
+
+
+def result_metadata(result):
+    """Returns a page result without its in-memory content, e.g. to write it as JSON"""
+    return {k: v for k, v in result.items() if k not in PAGE_CONTENT_KEYS}
+
+
+class ParseCancelled(Exception):
+    """Raised by parse_pdf when its cancel_event was set"""
 
 
 class DotsOCRParser:
@@ -34,6 +57,22 @@ class DotsOCRParser:
             min_pixels=None,
             max_pixels=None,
             request_delay=2.0,
+            picture_mode="inline",
+            picture_format="webp",
+            api_budget=None,
+            budget_owner=None,
+            output_sink="files",
+            page_image=None,
+            page_image_max_size=1600,
+            tpm_limit=None,
+            rpm_limit=None,
+            token_budget=None,
+            retry_policy=None,
+            endpoints=None,
+            routing="least_outstanding",
+            api_keys=None,
+            key_rpm=None,
+            key_concurrency=None,
         ):
         self.dpi = dpi
 
@@ -51,12 +90,52 @@ class DotsOCRParser:
         self.min_pixels = min_pixels
         self.max_pixels = max_pixels
         self.request_delay = request_delay
+        # "inline": Picture crops embedded as base64 in markdown, "assets": written once to save_dir/assets
+        assert picture_mode in ("inline", "assets"), f"picture_mode should be 'inline' or 'assets', got {picture_mode}"
+        self.picture_mode = picture_mode
+        self.picture_format = picture_format
+        self._picture_stores = {}
+        # Optional ConcurrencyBudget shared with other parsers (e.g. other demo sessions)
+        self.api_budget = api_budget
+        self.budget_owner = budget_owner if budget_owner is not None else id(self)
+        # Optional TokenBudget (tokens/requests per minute), shared like api_budget or created from tpm_limit and rpm_limit.
+        # A SharedLimiter (dots_ocr.model.shared_limiter) shares it with other processes
+        if token_budget is None and (tpm_limit or rpm_limit):
+            token_budget = TokenBudget(tpm_limit or None, requests_per_minute=rpm_limit or None)
+        self.token_budget = token_budget
+        # Attempts, backoff and timeouts of every request
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        # Optional replicas (specs, Endpoint objects or an EndpointPool) used instead of protocol://ip:port
+        if endpoints is not None and not isinstance(endpoints, EndpointPool):
+            endpoints = EndpointPool(endpoints, strategy=routing)
+        self.endpoint_pool = endpoints
+        # Optional API keys (a key file, key specs or a KeyPool) used instead of a single key, with per-key limits
+        if isinstance(api_keys, str):
+            api_keys = load_key_pool(api_keys, rpm=key_rpm, max_concurrency=key_concurrency)
+        elif api_keys is not None and not isinstance(api_keys, KeyPool):
+            api_keys = KeyPool(api_keys, rpm=key_rpm, max_concurrency=key_concurrency)
+        self.key_pool = api_keys
+        # Results always carry their cells, markdown and page image; the sink decides what is written to disk
+        if not isinstance(output_sink, OutputSink):
+            output_sink = make_output_sink(output_sink, page_image=page_image, page_image_max_size=page_image_max_size)
+        self.output_sink = output_sink
 
         print(f"use api model, num_thread will be set to {self.num_thread}")
         assert self.min_pixels is None or self.min_pixels >= MIN_PIXELS
         assert self.max_pixels is None or self.max_pixels <= MAX_PIXELS
 
-    def _inference_with_vllm(self, image, prompt):
+    def _inference_with_vllm(self, image, prompt, timer=None):
+        timer = timer if timer is not None else StageTimer()
+        if self.api_budget is not None:
+            with timer.stage("queue_wait"), metrics.in_progress("dots_ocr_queue_depth"):
+                self.api_budget.acquire(self.budget_owner)
+            try:
+                return self._request_api(image, prompt, timer)
+            finally:
+                self.api_budget.release(self.budget_owner)
+        return self._request_api(image, prompt, timer)
+
+    def _request_api(self, image, prompt, timer=None):
         response = inference_with_api(
             image,
             prompt, 
@@ -68,10 +147,26 @@ class DotsOCRParser:
             top_p=self.top_p,
             max_completion_tokens=self.max_completion_tokens,
             request_delay=self.request_delay,
+            timer=timer,
+            token_budget=self.token_budget,
+            retry_policy=self.retry_policy,
+            endpoint_pool=self.endpoint_pool,
+            key_pool=self.key_pool,
         )
         return response
 
-    async def _async_inference_with_vllm(self, image, prompt):
+    async def _async_inference_with_vllm(self, image, prompt, timer=None):
+        timer = timer if timer is not None else StageTimer()
+        if self.api_budget is not None:
+            with timer.stage("queue_wait"), metrics.in_progress("dots_ocr_queue_depth"):
+                await self.api_budget.acquire_async(self.budget_owner)
+            try:
+                return await self._async_request_api(image, prompt, timer)
+            finally:
+                self.api_budget.release(self.budget_owner)
+        return await self._async_request_api(image, prompt, timer)
+
+    async def _async_request_api(self, image, prompt, timer=None):
         response = await async_inference_with_api(
             image,
             prompt, 
@@ -83,9 +178,21 @@ class DotsOCRParser:
             top_p=self.top_p,
             max_completion_tokens=self.max_completion_tokens,
             request_delay=self.request_delay,
+            timer=timer,
+            token_budget=self.token_budget,
+            retry_policy=self.retry_policy,
+            endpoint_pool=self.endpoint_pool,
+            key_pool=self.key_pool,
         )
         return response
 
+    def _get_picture_store(self, save_dir):
+        if self.picture_mode != "assets":
+            return None
+        if save_dir not in self._picture_stores:
+            self._picture_stores[save_dir] = PictureAssetStore(save_dir, image_format=self.picture_format)
+        return self._picture_stores[save_dir]
+
     def get_prompt(self, prompt_mode, bbox=None, origin_image=None, image=None, min_pixels=None, max_pixels=None):
         # Determine which prompt dictionary to use
         if "gemini" in self.model_name.lower():
@@ -102,18 +209,8 @@ class DotsOCRParser:
             prompt = prompt + str(bbox)
         return prompt
 
-    # def post_process_results(self, response, prompt_mode, save_dir, save_name, origin_image, image, min_pixels, max_pixels)
-    def _parse_single_image(
-        self, 
-        origin_image, 
-        prompt_mode, 
-        save_dir, 
-        save_name, 
-        source="image", 
-        page_idx=0, 
-        bbox=None,
-        fitz_preprocess=False,
-        ):
+    def _prepare_input(self, origin_image, prompt_mode, source="image", bbox=None, fitz_preprocess=False, timer=None):
+        timer = timer if timer is not None else StageTimer()
         min_pixels, max_pixels = self.min_pixels, self.max_pixels
         if prompt_mode == "prompt_grounding_ocr":
             min_pixels = min_pixels or MIN_PIXELS  # preprocess image to the final input
@@ -121,51 +218,39 @@ class DotsOCRParser:
         if min_pixels is not None: assert min_pixels >= MIN_PIXELS, f"min_pixels should >= {MIN_PIXELS}"
         if max_pixels is not None: assert max_pixels <= MAX_PIXELS, f"max_pixels should <= {MAX_PIXELS}"
 
-        if source == 'image' and fitz_preprocess:
-            image = get_image_by_fitz_doc(origin_image, target_dpi=self.dpi)
-            image = fetch_image(image, min_pixels=min_pixels, max_pixels=max_pixels)
-        else:
-            image = fetch_image(origin_image, min_pixels=min_pixels, max_pixels=max_pixels)
-        input_height, input_width = smart_resize(image.height, image.width)
+        with timer.stage("resize"):
+            if source == 'image' and fitz_preprocess:
+                image = get_image_by_fitz_doc(origin_image, target_dpi=self.dpi)
+                image = fetch_image(image, min_pixels=min_pixels, max_pixels=max_pixels)
+            else:
+                image = fetch_image(origin_image, min_pixels=min_pixels, max_pixels=max_pixels)
         prompt = self.get_prompt(prompt_mode, bbox, origin_image, image, min_pixels=min_pixels, max_pixels=max_pixels)
-        
-        response = self._inference_with_vllm(image, prompt)
-        
+        return image, prompt, min_pixels, max_pixels
+
+    def _build_page_result(self, response, prompt_mode, origin_image, image, page_idx, min_pixels, max_pixels, save_dir, timer=None):
+        """Post-processes a model response into an in-memory page result (cells, markdown and page image)"""
+        timer = timer if timer is not None else StageTimer()
+        input_height, input_width = smart_resize(image.height, image.width)
         result = {'page_no': page_idx,
             "input_height": input_height,
             "input_width": input_width
         }
-        if source == 'pdf':
-            save_name = f"{save_name}_page_{page_idx}"
         if prompt_mode in ['prompt_layout_all_en', 'prompt_layout_only_en', 'prompt_grounding_ocr']:
-            cells, filtered = post_process_output(
-                response, 
-                prompt_mode, 
-                origin_image, 
-                image,
-                min_pixels=min_pixels, 
-                max_pixels=max_pixels,
-                )
+            with timer.stage("post_process"):
+                cells, filtered = post_process_output(
+                    response, 
+                    prompt_mode, 
+                    origin_image, 
+                    image,
+                    min_pixels=min_pixels, 
+                    max_pixels=max_pixels,
+                    )
             if filtered and prompt_mode != 'prompt_layout_only_en':  # model output json failed, use filtered process
-                json_file_path = os.path.join(save_dir, f"{save_name}.json")
-                with open(json_file_path, 'w', encoding="utf-8") as w:
-                    json.dump(response, w, ensure_ascii=False)
-
-                image_layout_path = os.path.join(save_dir, f"{save_name}.jpg")
-                origin_image.save(image_layout_path)
                 result.update({
-                    'layout_info_path': json_file_path,
-                    'layout_image_path': image_layout_path,
-                })
-
-                md_file_path = os.path.join(save_dir, f"{save_name}.md")
-                with open(md_file_path, "w", encoding="utf-8") as md_file:
-                    md_file.write(cells)
-                result.update({
-                    'md_content_path': md_file_path
-                })
-                result.update({
-                    'filtered': True
+                    'cells': response,
+                    'layout_image': origin_image,
+                    'md_content': cells,
+                    'filtered': True,
                 })
             else:
                 try:
@@ -176,44 +261,48 @@ class DotsOCRParser:
                     print(f"Error drawing layout on image: {e}")
                     image_with_layout = origin_image
 
-                json_file_path = os.path.join(save_dir, f"{save_name}.json")
-                with open(json_file_path, 'w', encoding="utf-8") as w:
-                    json.dump(cells, w, ensure_ascii=False)
-
-                image_layout_path = os.path.join(save_dir, f"{save_name}.jpg")
-                image_with_layout.save(image_layout_path)
                 result.update({
-                    'layout_info_path': json_file_path,
-                    'layout_image_path': image_layout_path,
+                    'cells': cells,
+                    'layout_image': image_with_layout,
                 })
                 if prompt_mode != "prompt_layout_only_en":  # no text md when detection only
-                    md_content = layoutjson2md(origin_image, cells, text_key='text', model_name=self.model_name)
-                    md_content_no_hf = layoutjson2md(origin_image, cells, text_key='text', no_page_hf=True, model_name=self.model_name) # used for clean output or metric of omnidocbench、olmbench 
-                    md_file_path = os.path.join(save_dir, f"{save_name}.md")
-                    with open(md_file_path, "w", encoding="utf-8") as md_file:
-                        md_file.write(md_content)
-                    md_nohf_file_path = os.path.join(save_dir, f"{save_name}_nohf.md")
-                    with open(md_nohf_file_path, "w", encoding="utf-8") as md_file:
-                        md_file.write(md_content_no_hf)
+                    with timer.stage("markdown"):
+                        md_variants = render_markdown_variants(origin_image, cells, text_key='text', model_name=self.model_name, picture_store=self._get_picture_store(save_dir))
                     result.update({
-                        'md_content_path': md_file_path,
-                        'md_content_nohf_path': md_nohf_file_path,
+                        'md_content': md_variants['md'],
+                        'md_content_nohf': md_variants['md_nohf'],
                     })
         else:
-            image_layout_path = os.path.join(save_dir, f"{save_name}.jpg")
-            origin_image.save(image_layout_path)
-            result.update({
-                'layout_image_path': image_layout_path,
-            })
-
-            md_content = response
-            md_file_path = os.path.join(save_dir, f"{save_name}.md")
-            with open(md_file_path, "w", encoding="utf-8") as md_file:
-                md_file.write(md_content)
             result.update({
-                'md_content_path': md_file_path,
+                'layout_image': origin_image,
+                'md_content': response,
             })
+        if response is None:  # the API request failed, the page holds no content
+            result['error'] = True
+        return result
 
+    def _parse_single_image(
+        self, 
+        origin_image, 
+        prompt_mode, 
+        save_dir, 
+        save_name, 
+        source="image", 
+        page_idx=0, 
+        bbox=None,
+        fitz_preprocess=False,
+        timer=None,
+        ):
+        timer = timer if timer is not None else StageTimer()
+        image, prompt, min_pixels, max_pixels = self._prepare_input(origin_image, prompt_mode, source, bbox, fitz_preprocess, timer)
+        response = self._inference_with_vllm(image, prompt, timer)
+        result = self._build_page_result(response, prompt_mode, origin_image, image, page_idx, min_pixels, max_pixels, save_dir, timer)
+        page_name = f"{save_name}_page_{page_idx}" if source == 'pdf' else save_name
+        timer.record(result)
+        with timer.stage("write"):
+            self.output_sink.write_page(result, save_dir, save_name, page_name)
+        timer.record(result)  # the sink only saw the timings up to the write
+        metrics.inc("dots_ocr_pages_total", status="error" if result.get('error') else "filtered" if result.get('filtered') else "ok")
         return result
     
     async def _parse_single_image_async(
@@ -226,156 +315,126 @@ class DotsOCRParser:
         page_idx=0, 
         bbox=None,
         fitz_preprocess=False,
+        timer=None,
         ):
-        min_pixels, max_pixels = self.min_pixels, self.max_pixels
-        if prompt_mode == "prompt_grounding_ocr":
-            min_pixels = min_pixels or MIN_PIXELS  # preprocess image to the final input
-            max_pixels = max_pixels or MAX_PIXELS
-        if min_pixels is not None: assert min_pixels >= MIN_PIXELS, f"min_pixels should >= {MIN_PIXELS}"
-        if max_pixels is not None: assert max_pixels <= MAX_PIXELS, f"max_pixels should <= {MAX_PIXELS}"
-
-        if source == 'image' and fitz_preprocess:
-            image = get_image_by_fitz_doc(origin_image, target_dpi=self.dpi)
-            image = fetch_image(image, min_pixels=min_pixels, max_pixels=max_pixels)
-        else:
-            image = fetch_image(origin_image, min_pixels=min_pixels, max_pixels=max_pixels)
-        input_height, input_width = smart_resize(image.height, image.width)
-        prompt = self.get_prompt(prompt_mode, bbox, origin_image, image, min_pixels=min_pixels, max_pixels=max_pixels)
-        
-        response = await self._async_inference_with_vllm(image, prompt)
-        
-        result = {'page_no': page_idx,
-            "input_height": input_height,
-            "input_width": input_width
-        }
-        if source == 'pdf':
-            save_name = f"{save_name}_page_{page_idx}"
-        if prompt_mode in ['prompt_layout_all_en', 'prompt_layout_only_en', 'prompt_grounding_ocr']:
-            cells, filtered = post_process_output(
-                response, 
-                prompt_mode, 
-                origin_image, 
-                image,
-                min_pixels=min_pixels, 
-                max_pixels=max_pixels,
-                )
-            if filtered and prompt_mode != 'prompt_layout_only_en':  # model output json failed, use filtered process
-                json_file_path = os.path.join(save_dir, f"{save_name}.json")
-                with open(json_file_path, 'w', encoding="utf-8") as w:
-                    json.dump(response, w, ensure_ascii=False)
-
-                image_layout_path = os.path.join(save_dir, f"{save_name}.jpg")
-                origin_image.save(image_layout_path)
-                result.update({
-                    'layout_info_path': json_file_path,
-                    'layout_image_path': image_layout_path,
-                })
-
-                md_file_path = os.path.join(save_dir, f"{save_name}.md")
-                with open(md_file_path, "w", encoding="utf-8") as md_file:
-                    md_file.write(cells)
-                result.update({
-                    'md_content_path': md_file_path
-                })
-                result.update({
-                    'filtered': True
-                })
-            else:
-                try:
-                    # Disabled layout drawing per user request (API models lack precise grounding)
-                    image_with_layout = origin_image 
-                except Exception as e:
-                    print(f"Error drawing layout on image: {e}")
-                    image_with_layout = origin_image
-
-                json_file_path = os.path.join(save_dir, f"{save_name}.json")
-                with open(json_file_path, 'w', encoding="utf-8") as w:
-                    json.dump(cells, w, ensure_ascii=False)
-
-                image_layout_path = os.path.join(save_dir, f"{save_name}.jpg")
-                image_with_layout.save(image_layout_path)
-                result.update({
-                    'layout_info_path': json_file_path,
-                    'layout_image_path': image_layout_path,
-                })
-                if prompt_mode != "prompt_layout_only_en":  # no text md when detection only
-                    md_content = layoutjson2md(origin_image, cells, text_key='text', model_name=self.model_name)
-                    md_content_no_hf = layoutjson2md(origin_image, cells, text_key='text', no_page_hf=True, model_name=self.model_name) # used for clean output or metric of omnidocbench、olmbench 
-                    md_file_path = os.path.join(save_dir, f"{save_name}.md")
-                    with open(md_file_path, "w", encoding="utf-8") as md_file:
-                        md_file.write(md_content)
-                    md_nohf_file_path = os.path.join(save_dir, f"{save_name}_nohf.md")
-                    with open(md_nohf_file_path, "w", encoding="utf-8") as md_file:
-                        md_file.write(md_content_no_hf)
-                    result.update({
-                        'md_content_path': md_file_path,
-                        'md_content_nohf_path': md_nohf_file_path,
-                    })
-        else:
-            image_layout_path = os.path.join(save_dir, f"{save_name}.jpg")
-            origin_image.save(image_layout_path)
-            result.update({
-                'layout_image_path': image_layout_path,
-            })
-
-            md_content = response
-            md_file_path = os.path.join(save_dir, f"{save_name}.md")
-            with open(md_file_path, "w", encoding="utf-8") as md_file:
-                md_file.write(md_content)
-            result.update({
-                'md_content_path': md_file_path,
-            })
-
+        timer = timer if timer is not None else StageTimer()
+        image, prompt, min_pixels, max_pixels = self._prepare_input(origin_image, prompt_mode, source, bbox, fitz_preprocess, timer)
+        response = await self._async_inference_with_vllm(image, prompt, timer)
+        result = self._build_page_result(response, prompt_mode, origin_image, image, page_idx, min_pixels, max_pixels, save_dir, timer)
+        page_name = f"{save_name}_page_{page_idx}" if source == 'pdf' else save_name
+        timer.record(result)
+        # Write off the event loop so other pages keep requesting meanwhile
+        await asyncio.to_thread(timer.call, "write", self.output_sink.write_page, result, save_dir, save_name, page_name)
+        timer.record(result)  # the sink only saw the timings up to the write
+        metrics.inc("dots_ocr_pages_total", status="error" if result.get('error') else "filtered" if result.get('filtered') else "ok")
         return result
     
     def parse_image(self, input_path, filename, prompt_mode, save_dir, bbox=None, fitz_preprocess=False):
-        origin_image = fetch_image(input_path)
-        result = self._parse_single_image(origin_image, prompt_mode, save_dir, filename, source="image", bbox=bbox, fitz_preprocess=fitz_preprocess)
+        timer = StageTimer(label=filename)
+        with timer.stage("render"):
+            origin_image = fetch_image(input_path)
+        result = self._parse_single_image(origin_image, prompt_mode, save_dir, filename, source="image", bbox=bbox, fitz_preprocess=fitz_preprocess, timer=timer)
+        self.output_sink.finish_document(save_dir, filename)
+        metrics.inc("dots_ocr_documents_total")
         result['file_path'] = input_path
         return [result]
         
-    async def _parse_pdf_async(self, input_path, filename, prompt_mode, save_dir):
+    async def _parse_pdf_async(self, input_path, filename, prompt_mode, save_dir, on_page_done=None, renderer=None, keep_images=False, cancel_event=None):
         print(f"loading pdf: {input_path}")
-        images_origin = load_images_from_pdf(input_path, dpi=self.dpi)
-        total_pages = len(images_origin)
+        own_renderer = renderer is None
+        if own_renderer:
+            renderer = PdfPageRenderer(input_path, dpi=self.dpi, cache_size=0)
+        total_pages = renderer.page_count
         
         sem = asyncio.Semaphore(self.num_thread)
 
         async def sem_task(task_args):
-            async with sem:
-                return await self._parse_single_image_async(**task_args)
+            timer = StageTimer(label=f"{filename} page {task_args['page_idx']}")
+            with timer.stage("queue_wait"), metrics.in_progress("dots_ocr_queue_depth"):
+                await sem.acquire()
+            try:
+                # Render inside the semaphore so only the pages in flight are held in memory
+                origin_image = await asyncio.to_thread(timer.call, "render", renderer.render, task_args["page_idx"])
+                return await self._parse_single_image_async(origin_image=origin_image, timer=timer, **task_args)
+            finally:
+                sem.release()
 
         tasks_args = [
             {
-                "origin_image": image,
                 "prompt_mode": prompt_mode,
                 "save_dir": save_dir,
                 "save_name": filename,
                 "source":"pdf",
                 "page_idx": i,
-            } for i, image in enumerate(images_origin)
+            } for i in range(total_pages)
         ]
 
         print(f"Parsing PDF with {total_pages} pages using {self.num_thread} concurrent async tasks...")
         
-        tasks = [sem_task(args) for args in tasks_args]
+        tasks = [asyncio.ensure_future(sem_task(args)) for args in tasks_args]
         results = []
+
+        async def cancel_when_set():
+            while not cancel_event.is_set():
+                await asyncio.sleep(0.1)
+            for task in tasks:
+                task.cancel()
+        watcher = asyncio.ensure_future(cancel_when_set()) if cancel_event is not None else None
         
         # Use simple gather if tqdm is too complex, but let's try to keep tqdm
         # We can iterate over as_completed
-        with tqdm(total=total_pages, desc="Processing PDF pages (Async)") as pbar:
-            for coro in asyncio.as_completed(tasks):
-                res = await coro
-                results.append(res)
-                pbar.update(1)
-
+        from tqdm import tqdm  # imported here, it is only needed for PDFs
+        try:
+            with tqdm(total=total_pages, desc="Processing PDF pages (Async)") as pbar:
+                for coro in asyncio.as_completed(tasks):
+                    try:
+                        res = await coro
+                    except asyncio.CancelledError:
+                        if cancel_event is not None and cancel_event.is_set():
+                            raise ParseCancelled(f"parsing {input_path} was cancelled")
+                        raise
+                    res['file_path'] = input_path
+                    results.append(res)
+                    pbar.update(1)
+                    if on_page_done is not None:
+                        # Pages finish out of order; page_no tells the caller where the result belongs
+                        on_page_done(res, total_pages)
+                    if not keep_images:
+                        # Page images are large; only hold on to them until the callback has seen them
+                        res.pop('layout_image', None)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            # After a failure or cancellation no page may keep requesting or writing
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.output_sink.finish_document(save_dir, filename)
+            if own_renderer:
+                renderer.close()
+
+        metrics.inc("dots_ocr_documents_total")
         results.sort(key=lambda x: x["page_no"])
-        for i in range(len(results)):
-            results[i]['file_path'] = input_path
         return results
 
-    def parse_pdf(self, input_path, filename, prompt_mode, save_dir):
-        return asyncio.run(self._parse_pdf_async(input_path, filename, prompt_mode, save_dir))
+    def parse_pdf(self, input_path, filename, prompt_mode, save_dir, on_page_done=None, renderer=None, keep_images=False, cancel_event=None):
+        """
+        Parses every page of a PDF.
+
+        on_page_done(result, total_pages) is called from the parsing thread as
+        soon as a page is done (and its files are written), in completion order.
+        Its result still holds the page image; the returned results only do
+        with keep_images=True.
+        Pages are rendered lazily; pass a PdfPageRenderer (with the same dpi)
+        to reuse pages that were already rendered, e.g. for a preview.
+        Setting cancel_event (a threading.Event) from another thread cancels
+        the pages still running; parse_pdf then raises ParseCancelled once
+        they have stopped.
+        """
+        return asyncio.run(self._parse_pdf_async(
+            input_path, filename, prompt_mode, save_dir,
+            on_page_done=on_page_done, renderer=renderer, keep_images=keep_images, cancel_event=cancel_event,
+        ))
 
     def parse_file(self, 
         input_path, 
@@ -388,7 +447,8 @@ class DotsOCRParser:
         output_dir = os.path.abspath(output_dir)
         filename, file_ext = os.path.splitext(os.path.basename(input_path))
         save_dir = os.path.join(output_dir, filename)
-        os.makedirs(save_dir, exist_ok=True)
+        if self.output_sink.uses_save_dir or self.picture_mode == "assets":
+            os.makedirs(save_dir, exist_ok=True)
 
         if file_ext == '.pdf':
             results = self.parse_pdf(input_path, filename, prompt_mode, save_dir)
@@ -397,13 +457,25 @@ class DotsOCRParser:
         else:
             raise ValueError(f"file extension {file_ext} not supported, supported extensions are {image_extensions} and pdf")
         
-        print(f"Parsing finished, results saving to {save_dir}")
-        with open(os.path.join(output_dir, os.path.basename(filename)+'.jsonl'), 'w', encoding="utf-8") as w:
-            for result in results:
-                w.write(json.dumps(result, ensure_ascii=False) + '\n')
+        if self.output_sink.write_index:
+            print(f"Parsing finished, results saving to {save_dir}")
+            with open(os.path.join(output_dir, os.path.basename(filename)+'.jsonl'), 'w', encoding="utf-8") as w:
+                for result in results:
+                    w.write(json.dumps(result_metadata(result), ensure_ascii=False) + '\n')
+        else:
+            print(f"Parsing finished, results written by the {type(self.output_sink).__name__}")
+        print(format_timing_summary(summarize_timings(results)))
+        if self.endpoint_pool is not None:
+            print(self.endpoint_pool.format_stats())
+        if self.key_pool is not None:
+            print(self.key_pool.format_stats())
 
         return results
 
+    def close(self):
+        """Closes the output sink (e.g. its database connection)"""
+        self.output_sink.close()
+
 
 
 def main():
@@ -485,7 +557,134 @@ def main():
         "--request_delay", type=float, default=2.0,
         help="Delay in seconds between API requests to avoid rate limiting"
     )
+    parser.add_argument(
+        "--picture_mode", type=str, choices=['inline', 'assets'], default="inline",
+        help="inline: embed Picture crops as base64 in markdown, assets: write them once to <output>/<file>/assets and link by relative path"
+    )
+    parser.add_argument(
+        "--picture_format", type=str, choices=['webp', 'png'], default="webp",
+        help="Image format of Picture assets when --picture_mode assets"
+    )
+    parser.add_argument(
+        "--output_sink", type=str, choices=['files', 'jsonl', 'sqlite', 'null'], default="files",
+        help="files: .json/.jpg/.md/_nohf.md per page, jsonl: one <file>_pages.jsonl per document, sqlite: <output>/results.sqlite3, null: write nothing"
+    )
+    parser.add_argument(
+        "--page_image", type=str, choices=['full', 'downscale', 'none'], default=None,
+        help="How the page image copy is stored (default: full for files, none for the other sinks)"
+    )
+    parser.add_argument(
+        "--page_image_max_size", type=int, default=1600,
+        help="Longer side in pixels of page images with --page_image downscale"
+    )
+    parser.add_argument(
+        "--tpm", type=int, default=None,
+        help="Tokens-per-minute budget; requests wait until their estimated tokens fit (default: unlimited)"
+    )
+    parser.add_argument(
+        "--rpm", type=int, default=None,
+        help="Requests-per-minute budget (default: unlimited)"
+    )
+    parser.add_argument(
+        "--limiter", type=str, choices=["local", "sqlite"], default="local",
+        help="local: --tpm/--rpm and 429 pauses per process, sqlite: shared by all parser processes using the same --limiter_db"
+    )
+    parser.add_argument(
+        "--limiter_db", type=str, default=None,
+        help="Database file of --limiter sqlite (default: dots_ocr_limiter.sqlite3 in the temp directory)"
+    )
+    parser.add_argument(
+        "--endpoints", type=str, nargs='+', default=None, metavar="URL[,weight=W][,concurrency=N]",
+        help="Replicas to spread requests over instead of --protocol/--ip/--port, e.g. gpu-a:8000,weight=2 gpu-b:8000"
+    )
+    parser.add_argument(
+        "--routing", type=str, choices=["least_outstanding", "ewma"], default="least_outstanding",
+        help="How --endpoints are chosen: fewest requests in flight, or lowest latency EWMA x load"
+    )
+    parser.add_argument(
+        "--api_keys", type=str, default=None, metavar="FILE",
+        help="File with one API key per line (KEY[,name=NAME][,rpm=N][,concurrency=N]); requests use the least loaded key"
+    )
+    parser.add_argument(
+        "--key_rpm", type=int, default=None,
+        help="Requests per minute per key of --api_keys, for keys without their own rpm= (default: unlimited)"
+    )
+    parser.add_argument(
+        "--key_concurrency", type=int, default=None,
+        help="Requests in flight per key of --api_keys, for keys without their own concurrency= (default: unlimited)"
+    )
+    parser.add_argument(
+        "--max_attempts", type=int, default=8,
+        help="Attempts per request for rate limits, 5xx, timeouts and connection errors"
+    )
+    parser.add_argument(
+        "--request_timeout", type=float, default=300,
+        help="Seconds a single API call may take"
+    )
+    parser.add_argument(
+        "--total_timeout", type=float, default=900,
+        help="Seconds per request across all attempts and backoff (0 for no limit)"
+    )
+    parser.add_argument(
+        "--metrics_port", type=int, default=None,
+        help="Serve Prometheus metrics at http://127.0.0.1:<port>/metrics while parsing"
+    )
+    parser.add_argument(
+        "--trace", type=str, default=None,
+        help="Write a Chrome trace (chrome://tracing, ui.perfetto.dev) of all page stages to this JSON file"
+    )
+    parser.add_argument(
+        "--record", type=str, default=None,
+        help="Append every API response to this archive (.jsonl, or .jsonl.gz compressed) for later replay"
+    )
+    parser.add_argument(
+        "--replay", type=str, default=None,
+        help="Answer API requests from an archive written with --record instead of calling the API"
+    )
+    parser.add_argument(
+        "--replay_latency", action='store_true',
+        help="With --replay, wait as long as the recorded requests took"
+    )
+    parser.add_argument(
+        "--replay_passthrough", action='store_true',
+        help="With --replay, send requests missing from the archive to the API and record them"
+    )
+    parser.add_argument(
+        "--profile", action='store_true',
+        help="Profile the run per pipeline stage: sampled flame graph stacks, cProfile stats and allocations of the CPU stages"
+    )
+    parser.add_argument(
+        "--profile_dir", type=str, default=None,
+        help="Directory of the profile files (default: <output>/profile)"
+    )
+    parser.add_argument(
+        "--profile_interval_ms", type=float, default=5,
+        help="Milliseconds between stack samples with --profile"
+    )
+    parser.add_argument(
+        "--profile_top", type=int, default=20,
+        help="Entries per stage in the --profile reports"
+    )
     args = parser.parse_args()
+    if args.record and args.replay:
+        parser.error("--record and --replay cannot be combined (use --replay_passthrough to extend an archive)")
+
+    if args.metrics_port is not None:
+        metrics.enable_metrics().serve(args.metrics_port)
+    recorder = TraceRecorder().start() if args.trace else None
+    api_recorder = None
+    if args.record:
+        api_recorder = ApiRecorder(args.record, mode="record")
+    elif args.replay:
+        api_recorder = ApiRecorder(args.replay, mode="replay", replay_latency=args.replay_latency, passthrough=args.replay_passthrough)
+    set_recorder(api_recorder)
+    shared_limiter = None
+    if args.limiter == "sqlite":
+        from dots_ocr.model.shared_limiter import SharedLimiter
+        limiter_db = args.limiter_db or os.path.join(tempfile.gettempdir(), "dots_ocr_limiter.sqlite3")
+        shared_limiter = SharedLimiter(limiter_db, tokens_per_minute=args.tpm or None, requests_per_minute=args.rpm or None)
+        set_backoff_factory(shared_limiter.backoff)
+        print(f"Sharing rate limits and 429 pauses with other processes through {limiter_db}")
 
     dots_ocr_parser = DotsOCRParser(
         protocol=args.protocol,
@@ -501,17 +700,50 @@ def main():
         min_pixels=args.min_pixels,
         max_pixels=args.max_pixels,
         request_delay=args.request_delay,
+        picture_mode=args.picture_mode,
+        picture_format=args.picture_format,
+        output_sink=args.output_sink,
+        page_image=args.page_image,
+        page_image_max_size=args.page_image_max_size,
+        tpm_limit=args.tpm,
+        rpm_limit=args.rpm,
+        token_budget=shared_limiter if shared_limiter is not None and (args.tpm or args.rpm) else None,
+        endpoints=args.endpoints,
+        routing=args.routing,
+        api_keys=args.api_keys,
+        key_rpm=args.key_rpm,
+        key_concurrency=args.key_concurrency,
+        retry_policy=RetryPolicy(max_attempts=args.max_attempts, request_timeout=args.request_timeout, total_timeout=args.total_timeout or None),
     )
 
     fitz_preprocess = not args.no_fitz_preprocess
     if fitz_preprocess:
         print(f"Using fitz preprocess for image input, check the change of the image pixels")
-    result = dots_ocr_parser.parse_file(
-        args.input_path, 
-        prompt_mode=args.prompt,
-        bbox=args.bbox,
-        fitz_preprocess=fitz_preprocess,
-        )
+    profiler = None
+    if args.profile:
+        profile_dir = args.profile_dir or os.path.join(args.output, "profile")
+        profiler = StageProfiler(profile_dir, interval=args.profile_interval_ms / 1000, top_n=args.profile_top).start()
+    try:
+        result = dots_ocr_parser.parse_file(
+            args.input_path, 
+            prompt_mode=args.prompt,
+            bbox=args.bbox,
+            fitz_preprocess=fitz_preprocess,
+            )
+    finally:
+        dots_ocr_parser.close()
+        if api_recorder is not None:
+            set_recorder(None)
+            api_recorder.close()
+        if shared_limiter is not None:
+            set_backoff_factory(None)
+            shared_limiter.close()
+        if recorder is not None:
+            recorder.stop()
+            recorder.save(args.trace)
+        if profiler is not None:
+            profiler.stop()
+            profiler.save()
     
 
 
@@ -0,0 +1,92 @@
+"""
+Picture Asset Store for dots.ocr
+
+Writes Picture crops as image files instead of inlining them into markdown as
+base64 data URIs. Files are named by a hash of their pixel content, so a crop
+that repeats across pages (e.g. a logo) is encoded and stored only once.
+"""
+
+import hashlib
+import os
+import tempfile
+from typing import Dict
+
+from PIL import Image, features
+
+
+class PictureAssetStore:
+    """
+    Content-addressed store for Picture crops of one output directory.
+
+    Args:
+        root_dir: Directory the markdown files are written to; returned paths are relative to it.
+        asset_dir: Sub-directory of root_dir the images are written to.
+        image_format: "webp" or "png". Falls back to "png" if Pillow lacks WebP support.
+        quality: WebP quality (ignored for PNG).
+    """
+
+    def __init__(self, root_dir: str, asset_dir: str = "assets", image_format: str = "webp", quality: int = 90):
+        image_format = image_format.lower()
+        if image_format not in ("webp", "png"):
+            raise ValueError(f"image_format should be 'webp' or 'png', got {image_format}")
+        if image_format == "webp" and not features.check("webp"):
+            print("WebP is not supported by this Pillow build, writing Picture assets as PNG")
+            image_format = "png"
+
+        self.root_dir = root_dir
+        self.asset_dir = asset_dir
+        self.image_format = image_format
+        self.quality = quality
+        self._paths: Dict[str, str] = {}  # content hash -> relative path
+        self.hits = 0
+        self.writes = 0
+
+    @staticmethod
+    def content_hash(image: Image.Image) -> str:
+        """Hashes the mode, size and pixels of an image"""
+        digest = hashlib.sha256()
+        digest.update(f"{image.mode}:{image.width}x{image.height}:".encode("utf-8"))
+        digest.update(image.tobytes())
+        return digest.hexdigest()[:32]
+
+    def save(self, image: Image.Image) -> str:
+        """
+        Stores an image unless an identical one is already stored.
+
+        Args:
+            image: The Picture crop.
+
+        Returns:
+            str: The path of the file relative to root_dir, using forward slashes for markdown links.
+        """
+        key = self.content_hash(image)
+        rel_path = self._paths.get(key)
+        if rel_path is not None:
+            self.hits += 1
+            return rel_path
+
+        rel_path = f"{self.asset_dir}/{key}.{self.image_format}"
+        abs_path = os.path.join(self.root_dir, self.asset_dir, f"{key}.{self.image_format}")
+        if os.path.exists(abs_path):
+            self.hits += 1
+        else:
+            self._write(image, abs_path)
+            self.writes += 1
+        self._paths[key] = rel_path
+        return rel_path
+
+    def _write(self, image: Image.Image, abs_path: str):
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        # Write to a temporary file first so a concurrent reader never sees a partial image
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(abs_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if self.image_format == "webp":
+                    image.save(f, format="WEBP", quality=self.quality, method=4)
+                else:
+                    image.save(f, format="PNG")
+            os.replace(tmp_path, abs_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
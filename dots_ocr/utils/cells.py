@@ -0,0 +1,361 @@
+"""
+Compact Cell Containers for dots.ocr
+
+Layout cells are normally passed around as lists of dicts with `bbox`, `category`
+and `text` keys. For long documents that is millions of small Python objects.
+PageCells and DocumentCells hold the same information in a few flat buffers:
+
+- an (N, 4) int32 bbox array
+- a uint8 category-code array
+- a UTF-8 text blob addressed by start/end offsets
+
+Slicing a document by page returns views of these buffers, and selecting by
+category shares the text blob instead of copying strings. Conversion to and
+from the JSON schema is lossless; values that do not fit the compact layout
+(e.g. float bboxes or extra keys) are kept verbatim in a sparse side table.
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+
+from dots_ocr.utils.consts import LAYOUT_CATEGORIES
+
+
+# Per-cell flags describing which keys the original dict carried
+HAS_BBOX = 1
+HAS_CATEGORY = 2
+HAS_TEXT = 4
+TEXT_IS_NONE = 8
+
+_INT32_MIN = np.iinfo(np.int32).min
+_INT32_MAX = np.iinfo(np.int32).max
+_COMPACT_KEYS = ('bbox', 'category', 'text')
+
+
+class CategoryVocab:
+    """Maps category names to uint8 codes, seeded with the known layout categories"""
+
+    def __init__(self, names: Iterable[str] = LAYOUT_CATEGORIES):
+        self.names: List[str] = []
+        self.codes: Dict[str, int] = {}
+        for name in names:
+            self.encode(name)
+
+    def encode(self, name: str) -> int:
+        code = self.codes.get(name)
+        if code is None:
+            code = len(self.names)
+            if code > np.iinfo(np.uint8).max:
+                raise ValueError(f"too many distinct categories, uint8 codes support at most 256")
+            self.names.append(name)
+            self.codes[name] = code
+        return code
+
+    def decode(self, code: int) -> str:
+        return self.names[code]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+def _compact_bbox(bbox) -> Optional[List[int]]:
+    """Returns the bbox as 4 ints if it fits the int32 array losslessly, otherwise None"""
+    if not isinstance(bbox, list) or len(bbox) != 4:
+        return None
+    for v in bbox:
+        if type(v) is not int or not _INT32_MIN <= v <= _INT32_MAX:
+            return None
+    return bbox
+
+
+class PageCells:
+    """
+    Array-backed cells of one page (or any selection of cells).
+
+    Iterating yields cell dicts in the original JSON schema, so a PageCells can be
+    passed wherever a list of cells is expected, e.g. to layoutjson2md.
+    """
+
+    __slots__ = ('bboxes', 'categories', 'flags', 'text_starts', 'text_ends', 'rows', '_blob', '_vocab', '_extras')
+
+    def __init__(self, bboxes, categories, flags, text_starts, text_ends, rows, blob, vocab, extras):
+        self.bboxes = bboxes
+        self.categories = categories
+        self.flags = flags
+        self.text_starts = text_starts
+        self.text_ends = text_ends
+        self.rows = rows  # row indices (array or range) into the owning document, used for the extras table
+        self._blob = blob
+        self._vocab = vocab
+        self._extras = extras
+
+    def __len__(self) -> int:
+        return len(self.categories)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self._cell(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._select(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("cell index out of range")
+        return self._cell(index)
+
+    def __repr__(self) -> str:
+        return f"PageCells({len(self)} cells)"
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the per-cell arrays in bytes (the shared text blob is not included)"""
+        arrays = (self.bboxes, self.categories, self.flags, self.text_starts, self.text_ends)
+        rows_nbytes = 0 if isinstance(self.rows, range) else self.rows.nbytes
+        return sum(arr.nbytes for arr in arrays) + rows_nbytes
+
+    def text(self, index: int) -> Optional[str]:
+        """Returns the text of one cell, or None if it has no text"""
+        if not self.flags[index] & HAS_TEXT or self.flags[index] & TEXT_IS_NONE:
+            extra = self._extras.get(int(self.rows[index]))
+            return extra.get('text') if isinstance(extra, dict) else None
+        return str(self._blob[self.text_starts[index]:self.text_ends[index]], 'utf-8')
+
+    def texts(self) -> List[Optional[str]]:
+        return [self.text(i) for i in range(len(self))]
+
+    def category_names(self) -> List[str]:
+        return [self._vocab.decode(code) for code in self.categories.tolist()]
+
+    def category_mask(self, *categories: str) -> np.ndarray:
+        """Boolean mask of the cells whose category is one of `categories`"""
+        codes = [self._vocab.codes[c] for c in categories if c in self._vocab.codes]
+        return np.isin(self.categories, codes) & (self.flags & HAS_CATEGORY).astype(bool)
+
+    def by_category(self, *categories: str) -> 'PageCells':
+        """Selects the cells of the given categories; the text blob is shared, not copied"""
+        return self._select(np.flatnonzero(self.category_mask(*categories)))
+
+    def to_list(self) -> List[Dict]:
+        """Converts back to the JSON schema (a list of cell dicts)"""
+        return list(self)
+
+    def _select(self, index) -> 'PageCells':
+        rows = self.rows
+        if isinstance(rows, range) and not isinstance(index, slice):
+            rows = np.arange(rows.start, rows.stop)
+        return PageCells(
+            self.bboxes[index], self.categories[index], self.flags[index],
+            self.text_starts[index], self.text_ends[index], rows[index],
+            self._blob, self._vocab, self._extras,
+        )
+
+    def _cell(self, i: int) -> Dict:
+        flags = int(self.flags[i])
+        extra = self._extras.get(int(self.rows[i]))
+        if extra is not None and not isinstance(extra, dict):
+            return extra  # the page held a non-dict item, kept verbatim
+        cell = {}
+        if flags & HAS_BBOX:
+            cell['bbox'] = self.bboxes[i].tolist()
+        if flags & HAS_CATEGORY:
+            cell['category'] = self._vocab.decode(int(self.categories[i]))
+        if flags & HAS_TEXT:
+            cell['text'] = None if flags & TEXT_IS_NONE else str(self._blob[self.text_starts[i]:self.text_ends[i]], 'utf-8')
+        if extra:
+            cell.update(extra)
+        return cell
+
+
+class DocumentCells:
+    """
+    Array-backed cells of a whole document.
+
+    All pages share one set of buffers; `page_offsets[i]:page_offsets[i + 1]` is the
+    row range of page i, so `doc[i]` is a zero-copy view.
+    """
+
+    def __init__(self, bboxes, categories, flags, text_offsets, blob, page_offsets, vocab, extras=None, page_extras=None):
+        self.bboxes = bboxes
+        self.categories = categories
+        self.flags = flags
+        self.text_offsets = text_offsets
+        self.page_offsets = page_offsets
+        self.vocab = vocab
+        self._blob = memoryview(blob)
+        self._extras = extras or {}
+        self._page_extras = page_extras or {}  # pages whose JSON is not a list of cells, kept verbatim
+
+    @classmethod
+    def from_pages(cls, pages: Iterable[Union[List[Dict], object]], vocab: Optional[CategoryVocab] = None) -> 'DocumentCells':
+        """
+        Builds a DocumentCells from per-page cell lists.
+
+        Args:
+            pages: One entry per page, normally a list of cell dicts. Any other value
+                (e.g. the raw response string of a filtered page) is kept verbatim.
+            vocab: Category vocabulary to extend, defaults to a fresh one.
+
+        Returns:
+            DocumentCells: The compact representation.
+        """
+        vocab = vocab or CategoryVocab()
+        bboxes, categories, flags, text_lengths, texts = [], [], [], [], []
+        extras, page_extras, page_offsets = {}, {}, [0]
+
+        for page_idx, page in enumerate(pages):
+            if not isinstance(page, list):
+                page_extras[page_idx] = page
+                page_offsets.append(len(flags))
+                continue
+            for cell in page:
+                row = len(flags)
+                if not isinstance(cell, dict):
+                    extras[row] = cell
+                    bboxes.append((0, 0, 0, 0))
+                    categories.append(0)
+                    flags.append(0)
+                    text_lengths.append(0)
+                    continue
+
+                flag, extra = 0, {}
+                bbox = _compact_bbox(cell.get('bbox'))
+                if bbox is not None:
+                    flag |= HAS_BBOX
+                    bboxes.append(bbox)
+                else:
+                    bboxes.append((0, 0, 0, 0))
+                    if 'bbox' in cell:
+                        extra['bbox'] = cell['bbox']
+
+                category = cell.get('category')
+                if isinstance(category, str):
+                    flag |= HAS_CATEGORY
+                    categories.append(vocab.encode(category))
+                else:
+                    categories.append(0)
+                    if 'category' in cell:
+                        extra['category'] = category
+
+                text = cell.get('text')
+                encoded = b''
+                if isinstance(text, str):
+                    flag |= HAS_TEXT
+                    encoded = text.encode('utf-8')
+                    texts.append(encoded)
+                elif text is None and 'text' in cell:
+                    flag |= HAS_TEXT | TEXT_IS_NONE
+                elif 'text' in cell:
+                    extra['text'] = text
+                text_lengths.append(len(encoded))
+
+                for key, value in cell.items():
+                    if key not in _COMPACT_KEYS:
+                        extra[key] = value
+                if extra:
+                    extras[row] = extra
+                flags.append(flag)
+            page_offsets.append(len(flags))
+
+        text_offsets = np.zeros(len(flags) + 1, dtype=np.int64)
+        np.cumsum(text_lengths, out=text_offsets[1:])
+        return cls(
+            bboxes=np.array(bboxes, dtype=np.int32).reshape(-1, 4),
+            categories=np.array(categories, dtype=np.uint8),
+            flags=np.array(flags, dtype=np.uint8),
+            text_offsets=text_offsets,
+            blob=b''.join(texts),
+            page_offsets=np.array(page_offsets, dtype=np.int64),
+            vocab=vocab,
+            extras=extras,
+            page_extras=page_extras,
+        )
+
+    @classmethod
+    def from_merged_json(cls, data: Dict) -> 'DocumentCells':
+        """Builds a DocumentCells from the structure written by merge_json_files"""
+        pages = []
+        for page in data.get('pages', []):
+            if 'elements' in page:
+                elements = page['elements']
+                # merge_json_files wraps non-list page data into a single-element list
+                if len(elements) == 1 and not isinstance(elements[0], dict):
+                    pages.append(elements[0])
+                else:
+                    pages.append(elements)
+            else:
+                pages.append(None)
+        return cls.from_pages(pages)
+
+    @property
+    def num_pages(self) -> int:
+        return len(self.page_offsets) - 1
+
+    @property
+    def num_cells(self) -> int:
+        return len(self.flags)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the arrays and text blob in bytes"""
+        arrays = (self.bboxes, self.categories, self.flags, self.text_offsets, self.page_offsets)
+        return sum(arr.nbytes for arr in arrays) + self._blob.nbytes
+
+    def __len__(self) -> int:
+        return self.num_pages
+
+    def __iter__(self) -> Iterator[PageCells]:
+        for i in range(self.num_pages):
+            yield self.page(i)
+
+    def __getitem__(self, index: int) -> PageCells:
+        return self.page(index)
+
+    def __repr__(self) -> str:
+        return f"DocumentCells({self.num_pages} pages, {self.num_cells} cells)"
+
+    def page(self, index: int) -> PageCells:
+        """Returns a zero-copy view of the cells of one page"""
+        if index < 0:
+            index += self.num_pages
+        if not 0 <= index < self.num_pages:
+            raise IndexError("page index out of range")
+        start, end = int(self.page_offsets[index]), int(self.page_offsets[index + 1])
+        return self._view(start, end)
+
+    def page_data(self, index: int):
+        """Returns one page in the JSON schema, including pages that are not cell lists"""
+        if index in self._page_extras:
+            return self._page_extras[index]
+        return self.page(index).to_list()
+
+    def is_cell_page(self, index: int) -> bool:
+        """False for pages whose JSON is not a list of cells (e.g. filtered pages)"""
+        return index not in self._page_extras
+
+    def by_category(self, *categories: str) -> PageCells:
+        """Selects the cells of the given categories across all pages"""
+        return self._view(0, self.num_cells).by_category(*categories)
+
+    def page_numbers(self) -> np.ndarray:
+        """Page index of every cell, as an int64 array of length num_cells"""
+        return np.repeat(np.arange(self.num_pages), np.diff(self.page_offsets))
+
+    def to_pages(self) -> List:
+        """Converts back to per-page data in the JSON schema"""
+        return [self.page_data(i) for i in range(self.num_pages)]
+
+    def _view(self, start: int, end: int) -> PageCells:
+        return PageCells(
+            self.bboxes[start:end],
+            self.categories[start:end],
+            self.flags[start:end],
+            self.text_offsets[start:end],
+            self.text_offsets[start + 1:end + 1],
+            range(start, end),
+            self._blob,
+            self.vocab,
+            self._extras,
+        )
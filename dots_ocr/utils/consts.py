@@ -3,3 +3,8 @@ MAX_PIXELS=11289600
 IMAGE_FACTOR=28
 
 image_extensions = {'.jpg', '.jpeg', '.png'}
+
+LAYOUT_CATEGORIES = [
+    'Caption', 'Footnote', 'Formula', 'List-item', 'Page-footer', 'Page-header',
+    'Picture', 'Section-header', 'Table', 'Text', 'Title',
+]
@@ -1,4 +1,5 @@
 import os
+from collections import OrderedDict
 from PIL import Image
 
 
@@ -59,3 +60,48 @@ def read_image(image_path, use_native=False):
         
     image = image.resize((new_w, new_h))
     return image, w, h
+
+
+class PreviewCache:
+    """
+    Small LRU cache of page previews downscaled to screen resolution.
+
+    Args:
+        max_items: Number of previews kept; older ones are dropped.
+        max_size: Maximum width/height of a preview in pixels.
+    """
+
+    def __init__(self, max_items=8, max_size=1024):
+        self.max_items = max_items
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        """
+        Returns the preview stored under key, creating it with loader() on a miss.
+
+        Args:
+            key: Hashable key of the preview, e.g. ('page', 3).
+            loader: Callable returning a new PIL image; it is downscaled in place before it is stored.
+
+        Returns:
+            PIL.Image.Image: The preview.
+        """
+        image = self._items.get(key)
+        if image is not None:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return image
+
+        self.misses += 1
+        image = loader()
+        image.thumbnail((self.max_size, self.max_size))
+        self._items[key] = image
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+        return image
+
+    def clear(self):
+        self._items.clear()
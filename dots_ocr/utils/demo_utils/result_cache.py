@@ -0,0 +1,289 @@
+"""
+Persistent result cache for the Gradio demo
+
+Every parse gets its own entry directory under the cache root, which the
+parser writes its result files to. Once the parse succeeds the entry is
+committed under a key made from the SHA-256 of the uploaded file and the
+parse settings, so uploading the same file with the same settings again is
+served from disk without calling the API. Entries are evicted least recently
+used first whenever the cache grows beyond its disk quota, except entries a
+session is still showing (pinned).
+
+The size of every entry is measured when it is committed, and again by
+update_size() when files are added to it later, and kept in its metadata, so
+enforcing the quota does not walk the cache directory.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from dots_ocr.utils import metrics
+
+
+class ResultCache:
+    """
+    Disk-backed cache of parse results with a quota and LRU eviction.
+
+    Args:
+        root_dir: Directory holding one sub-directory per entry.
+        quota_bytes: Maximum total size of all entries; older entries are
+            removed once it is exceeded.
+        pin_seconds: How long a pin protects an entry at most, so entries of
+            sessions that were abandoned without unpinning become evictable again.
+    """
+
+    META_FILE = ".cache_entry.json"
+
+    def __init__(self, root_dir: str, quota_bytes: int, pin_seconds: float = 3600):
+        self.root_dir = os.path.abspath(root_dir)
+        self.quota_bytes = quota_bytes
+        self.pin_seconds = pin_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index: Dict[str, str] = {}     # key -> entry directory
+        self._entries: Dict[str, dict] = {}  # entry directory -> {'key', 'size', 'last_used'} of finished entries
+        self._active = set()                 # entry directories still being written
+        self._pins: Dict[str, list] = {}     # entry directory -> [sessions showing it, time of the last pin]
+        os.makedirs(self.root_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def make_key(file_path: str, settings: dict) -> str:
+        """
+        Hashes the content of a file together with the settings it is parsed with.
+
+        Args:
+            file_path: The uploaded file.
+            settings: JSON-serializable settings that change the result (prompt, model, ...).
+
+        Returns:
+            str: Hex digest identifying the result.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _meta_path(self, entry_dir: str) -> str:
+        return os.path.join(entry_dir, self.META_FILE)
+
+    def _read_meta(self, entry_dir: str) -> Optional[dict]:
+        try:
+            with open(self._meta_path(entry_dir), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, entry_dir: str, meta: dict):
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self._meta_path(entry_dir))
+
+    def _load_index(self):
+        """Rebuilds the key index and entry sizes from the entries left by earlier runs"""
+        entries = []
+        for name in os.listdir(self.root_dir):
+            entry_dir = os.path.join(self.root_dir, name)
+            if not os.path.isdir(entry_dir):
+                continue
+            meta = self._read_meta(entry_dir) or {}
+            key = meta.get("key") if meta.get("complete") else None
+            # Leftovers of interrupted parses have no metadata; their mtime stands in for last use
+            last_used = meta.get("last_used", 0) if meta else os.path.getmtime(entry_dir)
+            size = meta.get("size")
+            self._entries[entry_dir] = {
+                "key": key,
+                "size": size if size is not None else self._dir_size(entry_dir),
+                "last_used": last_used,
+            }
+            if key:
+                entries.append((last_used, key, entry_dir))
+        # The most recently used entry wins if a key was committed twice
+        for _, key, entry_dir in sorted(entries):
+            self._index[key] = entry_dir
+
+    def lookup(self, key: str) -> Optional[Tuple[str, List[dict]]]:
+        """
+        Looks up a committed result and marks it as recently used.
+
+        Returns:
+            (entry_dir, results) on a hit, with result paths made absolute again; None on a miss.
+        """
+        with self._lock:
+            entry_dir = self._index.get(key)
+            meta = self._read_meta(entry_dir) if entry_dir else None
+            if not meta or not meta.get("complete"):
+                self._index.pop(key, None)
+                self.misses += 1
+                metrics.inc("dots_ocr_result_cache_lookups_total", result="miss")
+                return None
+            self.hits += 1
+            metrics.inc("dots_ocr_result_cache_lookups_total", result="hit")
+            meta["last_used"] = time.time()
+            self._write_meta(entry_dir, meta)
+            if entry_dir in self._entries:
+                self._entries[entry_dir]["last_used"] = meta["last_used"]
+        return entry_dir, [self._absolute_paths(r, entry_dir) for r in meta["results"]]
+
+    def create_entry(self) -> Tuple[str, str]:
+        """
+        Creates the directory a new parse writes its results to.
+
+        Returns:
+            (entry_dir, session_id): the directory is named after the session id.
+        """
+        session_id = uuid.uuid4().hex[:8]
+        entry_dir = os.path.join(self.root_dir, session_id)
+        os.makedirs(entry_dir, exist_ok=True)
+        with self._lock:
+            self._active.add(entry_dir)
+        return entry_dir, session_id
+
+    def commit(self, entry_dir: str, key: str, results: List[dict]):
+        """
+        Registers the results of a finished parse under key and enforces the quota.
+
+        Args:
+            entry_dir: Directory returned by create_entry.
+            key: Key from make_key.
+            results: The parser's result dicts; their paths are stored relative to entry_dir.
+        """
+        self._finish(entry_dir, {
+            "key": key,
+            "complete": True,
+            "results": [self._relative_paths(r, entry_dir) for r in results],
+        })
+
+    def release(self, entry_dir: str):
+        """
+        Finishes a parse whose result must not be served again, e.g. because
+        some of its pages failed. Its files stay for the session showing them
+        and are evicted like those of any other entry.
+        """
+        self._finish(entry_dir, {"complete": False})
+
+    def _finish(self, entry_dir: str, meta: dict):
+        # Measured here, outside the lock, instead of on every eviction
+        size = self._dir_size(entry_dir)
+        now = time.time()
+        meta.update({"created": now, "last_used": now, "size": size})
+        with self._lock:
+            self._write_meta(entry_dir, meta)
+            if meta["complete"]:
+                self._index[meta["key"]] = entry_dir
+            self._entries[entry_dir] = {"key": meta.get("key") if meta["complete"] else None, "size": size, "last_used": now}
+            self._active.discard(entry_dir)
+            self._evict(keep={entry_dir})
+
+    def update_size(self, entry_dir: str):
+        """
+        Measures a finished entry again after files were added to it (result
+        archives, download packages), so they count towards the quota.
+        """
+        size = self._dir_size(entry_dir)
+        with self._lock:
+            entry = self._entries.get(entry_dir)
+            if entry is None:  # still being written (measured when finished) or already evicted
+                return
+            entry["size"] = size
+            meta = self._read_meta(entry_dir)
+            if meta:
+                meta["size"] = size
+                self._write_meta(entry_dir, meta)
+            self._evict(keep={entry_dir})
+
+    def discard(self, entry_dir: str):
+        """Removes the directory of a parse that failed"""
+        with self._lock:
+            self._active.discard(entry_dir)
+            self._entries.pop(entry_dir, None)
+            self._pins.pop(entry_dir, None)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+
+    def pin(self, entry_dir: str):
+        """Protects an entry from eviction while a session shows it; every pin() needs an unpin()"""
+        with self._lock:
+            pin = self._pins.setdefault(entry_dir, [0, 0.0])
+            pin[0] += 1
+            pin[1] = time.time()
+
+    def unpin(self, entry_dir: str):
+        with self._lock:
+            pin = self._pins.get(entry_dir)
+            if pin is not None:
+                pin[0] -= 1
+                if pin[0] <= 0:
+                    del self._pins[entry_dir]
+
+    def _pinned(self, entry_dir: str, now: float) -> bool:
+        pin = self._pins.get(entry_dir)
+        return pin is not None and now - pin[1] < self.pin_seconds
+
+    @staticmethod
+    def _dir_size(entry_dir: str) -> int:
+        total = 0
+        for root, _, files in os.walk(entry_dir):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def _evict(self, keep=()):
+        """Removes least recently used entries until the cache fits its quota (entries being written or shown stay)"""
+        total = sum(entry["size"] for entry in self._entries.values())
+        if total <= self.quota_bytes:
+            return
+        now = time.time()
+        candidates = sorted(
+            (entry["last_used"], entry_dir) for entry_dir, entry in self._entries.items()
+            if entry_dir not in keep and not self._pinned(entry_dir, now)
+        )
+        for _, entry_dir in candidates:
+            if total <= self.quota_bytes:
+                break
+            entry = self._entries.pop(entry_dir)
+            if entry["key"] and self._index.get(entry["key"]) == entry_dir:
+                del self._index[entry["key"]]
+            self._pins.pop(entry_dir, None)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= entry["size"]
+            print(f"Result cache: evicted {os.path.basename(entry_dir)} ({entry['size'] / 1024 / 1024:.1f} MB)")
+
+    @staticmethod
+    def _relative_paths(result: dict, entry_dir: str) -> dict:
+        converted = {}
+        for k, v in result.items():
+            if k.endswith("_path") and isinstance(v, str) and os.path.commonpath([os.path.abspath(v), entry_dir]) == entry_dir:
+                v = os.path.relpath(v, entry_dir)
+            converted[k] = v
+        return converted
+
+    @staticmethod
+    def _absolute_paths(result: dict, entry_dir: str) -> dict:
+        return {
+            k: os.path.join(entry_dir, v) if k.endswith("_path") and isinstance(v, str) and not os.path.isabs(v) else v
+            for k, v in result.items()
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._index),
+            }
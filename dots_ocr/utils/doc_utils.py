@@ -1,20 +1,34 @@
-import fitz
-import numpy as np
 import enum
-from pydantic import BaseModel, Field
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 from PIL import Image
 
 
+def load_fitz():
+    """Imports PyMuPDF on first use; it is slow to import and only needed for PDFs.
+
+    Newer releases warn when imported under the old name fitz, older ones only
+    provide that name.
+    """
+    try:
+        import pymupdf as fitz
+    except ImportError:
+        import fitz
+    return fitz
+
+
 class SupportedPdfParseMethod(enum.Enum):
     OCR = 'ocr'
     TXT = 'txt'
 
 
-class PageInfo(BaseModel):
+@dataclass
+class PageInfo:
     """The width and height of page
     """
-    w: float = Field(description='the width of page')
-    h: float = Field(description='the height of page')
+    w: float  # the width of page
+    h: float  # the height of page
 
 
 def fitz_doc_to_image(doc, target_dpi=200, origin_dpi=None) -> dict:
@@ -27,7 +41,7 @@ def fitz_doc_to_image(doc, target_dpi=200, origin_dpi=None) -> dict:
     Returns:
         dict:  {'img': numpy array, 'width': width, 'height': height }
     """
-    from PIL import Image
+    fitz = load_fitz()
     mat = fitz.Matrix(target_dpi / 72, target_dpi / 72)
     pm = doc.get_pixmap(matrix=mat, alpha=False)
 
@@ -41,7 +55,7 @@ def fitz_doc_to_image(doc, target_dpi=200, origin_dpi=None) -> dict:
 
 def load_images_from_pdf(pdf_file, dpi=200, start_page_id=0, end_page_id=None) -> list:
     images = []
-    with fitz.open(pdf_file) as doc:
+    with load_fitz().open(pdf_file) as doc:
         pdf_page_num = doc.page_count
         end_page_id = (
             end_page_id
@@ -57,4 +71,95 @@ def load_images_from_pdf(pdf_file, dpi=200, start_page_id=0, end_page_id=None) -
                 page = doc[index]
                 img = fitz_doc_to_image(page, target_dpi=dpi)
                 images.append(img)
-    return images
\ No newline at end of file
+    return images
+
+
+class PdfPageRenderer:
+    """Renders the pages of a PDF on demand instead of all at once.
+
+    Full-resolution renders are kept in a small LRU cache, so a page rendered
+    for a preview is reused by the parser instead of being rasterized again.
+    Thread-safe: PyMuPDF documents must not be used from several threads at
+    once, so rendering is serialized.
+
+    A renderer shared by several users (e.g. a preview and a running parse) is
+    reference counted: every user besides the creator calls retain(), every
+    user calls close(), and the document is closed by the last one.
+
+    Args:
+        pdf_file (str): path of the PDF.
+        dpi (int, optional): resolution of full renders. Defaults to 200.
+        cache_size (int, optional): number of full renders kept in memory. Defaults to 2.
+    """
+
+    def __init__(self, pdf_file, dpi=200, cache_size=2):
+        self.pdf_file = pdf_file
+        self.dpi = dpi
+        self.cache_size = cache_size
+        self._doc = load_fitz().open(pdf_file)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._refs = 1
+        self.renders = 0
+
+    @property
+    def page_count(self):
+        return self._doc.page_count
+
+    def __len__(self):
+        return self.page_count
+
+    def render(self, index) -> Image.Image:
+        """Renders page `index` at the full resolution"""
+        with self._lock:
+            image = self._cache.get(index)
+            if image is not None:
+                self._cache.move_to_end(index)
+                return image
+            image = fitz_doc_to_image(self._doc[index], target_dpi=self.dpi)
+            self.renders += 1
+            if self.cache_size > 0:
+                self._cache[index] = image
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            return image
+
+    def render_preview(self, index, max_size=1024) -> Image.Image:
+        """Renders page `index` so that its longer side is at most `max_size` pixels.
+
+        A cached full render is downscaled; otherwise the page is rasterized
+        directly at the lower resolution, which is much cheaper.
+        """
+        with self._lock:
+            image = self._cache.get(index)
+            if image is not None:
+                image = image.copy()  # thumbnail() resizes in place
+            else:
+                rect = self._doc[index].rect
+                dpi = min(self.dpi, max_size * 72 / max(rect.width, rect.height, 1))
+                image = fitz_doc_to_image(self._doc[index], target_dpi=dpi)
+        image.thumbnail((max_size, max_size))
+        return image
+
+    def retain(self):
+        """Registers another user of the renderer, which must close() it as well"""
+        with self._lock:
+            if self._refs == 0:
+                raise ValueError(f"renderer of {self.pdf_file} is already closed")
+            self._refs += 1
+        return self
+
+    def close(self):
+        with self._lock:
+            if self._refs == 0:
+                return
+            self._refs -= 1
+            if self._refs == 0:
+                self._cache.clear()
+                self._doc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
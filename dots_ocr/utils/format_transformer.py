@@ -2,11 +2,48 @@ import os
 import sys
 import json
 import re
+from typing import Dict, Iterable, Optional
 
 from PIL import Image
 from dots_ocr.utils.image_utils import PILimage_to_base64
 
 
+# Markdown variants rendered from the same cells: variant name -> categories left out of it
+MARKDOWN_VARIANTS = {
+    'md': frozenset(),
+    'md_nohf': frozenset(['Page-header', 'Page-footer']),  # used for clean output or metric of omnidocbench、olmbench
+}
+
+# Regular expression patterns for LaTeX markdown, combined into a single search
+_LATEX_MARKDOWN_RE = re.compile('|'.join([
+    r'\$\$.*?\$\$',           # Block-level math formula $$...$$
+    r'\$[^$\n]+?\$',          # Inline math formula $...$
+    r'\\begin\{.*?\}.*?\\end\{.*?\}',  # LaTeX environment \begin{...}...\end{...}
+    r'\\[a-zA-Z]+\{.*?\}',    # LaTeX command \command{...}
+    r'\\[a-zA-Z]+',           # Simple LaTeX command \command
+    r'\\\[.*?\\\]',           # Display math formula \[...\]
+    r'\\\(.*?\\\)',           # Inline math formula \(...\)
+]), re.DOTALL)
+
+_LATEX_PREAMBLE_RES = [
+    re.compile(pattern, re.IGNORECASE) for pattern in [
+        r'\\documentclass\{[^}]+\}',  # \documentclass{...}
+        r'\\usepackage\{[^}]+\}',    # \usepackage{...}
+        r'\\usepackage\[[^\]]*\]\{[^}]+\}',  # \usepackage[options]{...}
+        r'\\begin\{document\}',       # \begin{document}
+        r'\\end\{document\}',         # \end{document}
+    ]
+]
+
+_BRACKET_MATH_LINE_RE = re.compile(r'.*\\\[.*\\\].*')
+_INLINE_MATH_RE = re.compile(r'\$([^$]+)\$')
+_DISPLAY_DELIMITER_RE = re.compile(r'(?<!\\)\\\[(.*?)(?<!\\)\\\]', re.DOTALL)
+_INLINE_DELIMITER_RE = re.compile(r'(?<!\\)\\\((.*?)(?<!\\)\\\)', re.DOTALL)
+_PARENS_LATEX_RE = re.compile(r'\(([^)]*?\\[a-zA-Z]+[^)]*?)\)')
+_LEFT_INT_RE = re.compile(r'\\left\s*\\int')
+_DOUBLE_DOLLAR_RE = re.compile(r'\$\$(.*?)\$\$', re.DOTALL)
+
+
 def has_latex_markdown(text: str) -> bool:
     """
     Checks if a string contains LaTeX markdown patterns.
@@ -20,23 +57,8 @@ def has_latex_markdown(text: str) -> bool:
     if not isinstance(text, str):
         return False
     
-    # Define regular expression patterns for LaTeX markdown
-    latex_patterns = [
-        r'\$\$.*?\$\$',           # Block-level math formula $$...$$
-        r'\$[^$\n]+?\$',          # Inline math formula $...$
-        r'\\begin\{.*?\}.*?\\end\{.*?\}',  # LaTeX environment \begin{...}...\end{...}
-        r'\\[a-zA-Z]+\{.*?\}',    # LaTeX command \command{...}
-        r'\\[a-zA-Z]+',           # Simple LaTeX command \command
-        r'\\\[.*?\\\]',           # Display math formula \[...\]
-        r'\\\(.*?\\\)',           # Inline math formula \(...\)
-    ]
-    
     # Check if any of the patterns match
-    for pattern in latex_patterns:
-        if re.search(pattern, text, re.DOTALL):
-            return True
-    
-    return False
+    return _LATEX_MARKDOWN_RE.search(text) is not None
 
 
 def clean_latex_preamble(latex_text: str) -> str:
@@ -49,19 +71,10 @@ def clean_latex_preamble(latex_text: str) -> str:
     Returns:
         str: The cleaned LaTeX text without preamble commands.
     """
-    # Define patterns to be removed
-    patterns = [
-        r'\\documentclass\{[^}]+\}',  # \documentclass{...}
-        r'\\usepackage\{[^}]+\}',    # \usepackage{...}
-        r'\\usepackage\[[^\]]*\]\{[^}]+\}',  # \usepackage[options]{...}
-        r'\\begin\{document\}',       # \begin{document}
-        r'\\end\{document\}',         # \end{document}
-    ]
-    
     # Apply each pattern to clean the text
     cleaned_text = latex_text
-    for pattern in patterns:
-        cleaned_text = re.sub(pattern, '', cleaned_text, flags=re.IGNORECASE)
+    for pattern in _LATEX_PREAMBLE_RES:
+        cleaned_text = pattern.sub('', cleaned_text)
     
     return cleaned_text
     
@@ -93,13 +106,11 @@ def get_formula_in_markdown(text: str) -> str:
         return f"$$\n{inner_content}\n$$"
         
     # Check if it's enclosed in \[ \]
-    if len(re.findall(r'.*\\\[.*\\\].*', text)) > 0:
+    if _BRACKET_MATH_LINE_RE.search(text):
         return text
 
     # Handle inline formulas ($...$)
-    pattern = r'\$([^$]+)\$'
-    matches = re.findall(pattern, text)
-    if len(matches) > 0:
+    if _INLINE_MATH_RE.search(text):
         # It's an inline formula, return it as is
         return text  
 
@@ -142,43 +153,98 @@ def clean_text(text: str) -> str:
     return text
 
 
-def layoutjson2md(image: Image.Image, cells: list, text_key: str = 'text', no_page_hf: bool = False, model_name: str = None) -> str:
+def render_cell_markdown(image: Image.Image, cell: dict, text_key: str = 'text', picture_store=None) -> str:
+    """
+    Converts a single layout cell to its Markdown fragment.
+    
+    Args:
+        image: A PIL Image object, used to crop Picture cells.
+        cell: A dictionary representing a layout cell.
+        text_key: The key for the text field in the cell dictionary.
+        picture_store: A PictureAssetStore. If given, Picture crops are written as files and
+            linked by relative path; otherwise they are inlined as base64 data URIs.
+        
+    Returns:
+        str: The Markdown fragment of the cell.
+    """
+    text = cell.get(text_key, "")
+    
+    if cell['category'] == 'Picture':
+        x1, y1, x2, y2 = [int(coord) for coord in cell['bbox']]
+        image_crop = image.crop((x1, y1, x2, y2))
+        if picture_store is not None:
+            return f"![]({picture_store.save(image_crop)})"
+        image_base64 = PILimage_to_base64(image_crop)
+        return f"![]({image_base64})"
+    elif cell['category'] == 'Formula':
+        return get_formula_in_markdown(text)
+    else:            
+        text = clean_text(text)
+        text = normalize_latex_delimiters(text)
+        return f"{text}"
+
+
+def render_markdown_variants(
+    image: Image.Image,
+    cells: list,
+    text_key: str = 'text',
+    variants: Optional[Iterable[str]] = None,
+    model_name: str = None,
+    picture_store=None
+) -> Dict[str, str]:
+    """
+    Converts a layout JSON format to several Markdown variants in a single pass.
+    
+    Each cell is rendered at most once (Picture crops are encoded once, text is
+    normalized once) and the variants are joined from the shared fragments.
+    
+    Args:
+        image: A PIL Image object.
+        cells: A list of dictionaries, each representing a layout cell, or a PageCells.
+        text_key: The key for the text field in the cell dictionary.
+        variants: Names of the variants to render, keys of MARKDOWN_VARIANTS. Defaults to all.
+        picture_store: A PictureAssetStore to write Picture crops to, instead of inlining them.
+        
+    Returns:
+        dict: Variant name -> text in Markdown format.
+    """
+    variants = list(variants) if variants is not None else list(MARKDOWN_VARIANTS)
+    excluded = {name: MARKDOWN_VARIANTS[name] for name in variants}
+    # Categories no variant includes are never rendered
+    skip_always = frozenset.intersection(*excluded.values()) if excluded else frozenset()
+    text_items = {name: [] for name in variants}
+
+    for cell in cells:
+        category = cell['category']
+        if category in skip_always:
+            continue
+        fragment = render_cell_markdown(image, cell, text_key=text_key, picture_store=picture_store)
+        for name in variants:
+            if category not in excluded[name]:
+                text_items[name].append(fragment)
+
+    return {name: '\n\n'.join(items) for name, items in text_items.items()}
+
+
+def layoutjson2md(image: Image.Image, cells: list, text_key: str = 'text', no_page_hf: bool = False, model_name: str = None, picture_store=None) -> str:
     """
     Converts a layout JSON format to Markdown.
     
     In the layout JSON, formulas are LaTeX, tables are HTML, and text is Markdown.
+    Use render_markdown_variants to get several variants without re-rendering the cells.
     
     Args:
         image: A PIL Image object.
-        cells: A list of dictionaries, each representing a layout cell.
+        cells: A list of dictionaries, each representing a layout cell, or a PageCells.
         text_key: The key for the text field in the cell dictionary.
         no_page_header_footer: If True, skips page headers and footers.
+        picture_store: A PictureAssetStore to write Picture crops to, instead of inlining them.
         
     Returns:
         str: The text in Markdown format.
     """
-    text_items = []
-
-    for i, cell in enumerate(cells):
-        x1, y1, x2, y2 = [int(coord) for coord in cell['bbox']]
-        text = cell.get(text_key, "")
-        
-        if no_page_hf and cell['category'] in ['Page-header', 'Page-footer']:
-            continue
-        
-        if cell['category'] == 'Picture':
-            image_crop = image.crop((x1, y1, x2, y2))
-            image_base64 = PILimage_to_base64(image_crop)
-            text_items.append(f"![]({image_base64})")
-        elif cell['category'] == 'Formula':
-            text_items.append(get_formula_in_markdown(text))
-        else:            
-            text = clean_text(text)
-            text = normalize_latex_delimiters(text)
-            text_items.append(f"{text}")
-
-    markdown_text = '\n\n'.join(text_items)
-    return markdown_text
+    variant = 'md_nohf' if no_page_hf else 'md'
+    return render_markdown_variants(image, cells, text_key=text_key, variants=[variant], model_name=model_name, picture_store=picture_store)[variant]
 
 
 def normalize_latex_delimiters(text: str) -> str:
@@ -197,10 +263,10 @@ def normalize_latex_delimiters(text: str) -> str:
 
     # 1. Convert \[ ... \] to $$ ... $$
     # Look for \[ not preceded by backslash
-    text = re.sub(r'(?<!\\)\\\[(.*?)(?<!\\)\\\]', r'$$\n\1\n$$', text, flags=re.DOTALL)
+    text = _DISPLAY_DELIMITER_RE.sub(r'$$\n\1\n$$', text)
 
     # 2. Convert \( ... \) to $ ... $
-    text = re.sub(r'(?<!\\)\\\((.*?)(?<!\\)\\\)', r'$\1$', text, flags=re.DOTALL)
+    text = _INLINE_DELIMITER_RE.sub(r'$\1$', text)
 
     # 3. Heuristic: Fix ( ... ) wrapping obvious LaTeX math like \times, ^{}, _{}
     # Pattern looks for (...) containing \times, \pm, \approx, or ^{...}, _{...}
@@ -215,10 +281,10 @@ def normalize_latex_delimiters(text: str) -> str:
         return match.group(0)
 
     # Regex for content inside parentheses
-    text = re.sub(r'\(([^)]*?\\[a-zA-Z]+[^)]*?)\)', repl_parens_math, text)
+    text = _PARENS_LATEX_RE.sub(repl_parens_math, text)
 
     # 4. Heuristic: Fix common hallucinations like \left \int (invalid latex)
-    text = re.sub(r'\\left\s*\\int', r'\\int', text)
+    text = _LEFT_INT_RE.sub(r'\\int', text)
 
     # 5. Heuristic: specific fix for equations starting with variable assignments that are not wrapped
     # Example: G = 4\pi... -> $$ G = 4\pi... $$
@@ -257,4 +323,4 @@ def fix_streamlit_formulas(md: str) -> str:
         return f'$$\n{content}\n$$'
     
     # Use regex to find all $$....$$ patterns and replace them using the helper function.
-    return re.sub(r'\$\$(.*?)\$\$', replace_formula, md, flags=re.DOTALL)
+    return _DOUBLE_DOLLAR_RE.sub(replace_formula, md)
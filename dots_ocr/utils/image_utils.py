@@ -1,13 +1,12 @@
 import math
 import base64
+from functools import lru_cache
 from PIL import Image
 from typing import Tuple
 import os
 from dots_ocr.utils.consts import IMAGE_FACTOR, MIN_PIXELS, MAX_PIXELS
-from dots_ocr.utils.doc_utils import fitz_doc_to_image
+from dots_ocr.utils.doc_utils import fitz_doc_to_image, load_fitz
 from io import BytesIO
-import fitz
-import requests
 import copy
 
 
@@ -26,6 +25,7 @@ def floor_by_factor(number: int, factor: int) -> int:
     return math.floor(number / factor) * factor
 
 
+@lru_cache(maxsize=4096)
 def smart_resize(
     height: int,
     width: int,
@@ -41,6 +41,7 @@ def smart_resize(
 
     3. The aspect ratio of the image is maintained as closely as possible.
 
+    Results are memoized since the same page sizes recur across a document.
     """
     if max(height, width) / min(height, width) > 200:
         raise ValueError(
@@ -93,6 +94,7 @@ def fetch_image(
     if isinstance(image, Image.Image):
         image_obj = image
     elif image.startswith("http://") or image.startswith("https://"):
+        import requests
         # fix memory leak issue while using BytesIO
         with requests.get(image, stream=True) as response:
             response.raise_for_status()
@@ -175,6 +177,7 @@ def get_image_by_fitz_doc(image, target_dpi=200):
         assert file_ext in {'.jpg', '.jpeg', '.png'}
 
         if image.startswith("http://") or image.startswith("https://"):
+            import requests
             with requests.get(image, stream=True) as response:
                 response.raise_for_status()
                 data_bytes = response.content
@@ -188,6 +191,7 @@ def get_image_by_fitz_doc(image, target_dpi=200):
         image.save(data_bytes, format='PNG')
 
     origin_dpi = image.info.get('dpi', None)
+    fitz = load_fitz()
     pdf_bytes = fitz.open(stream=data_bytes).convert_to_pdf()
     doc = fitz.open('pdf', pdf_bytes)
     page = doc[0]
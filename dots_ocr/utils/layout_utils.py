@@ -1,11 +1,12 @@
 from PIL import Image
 from typing import Dict, List
 
-import fitz
+import numpy as np
 from io import BytesIO
 import json
 
 from dots_ocr.utils.image_utils import smart_resize
+from dots_ocr.utils.doc_utils import load_fitz
 from dots_ocr.utils.consts import MIN_PIXELS, MAX_PIXELS
 from dots_ocr.utils.output_cleaner import OutputCleaner
 
@@ -47,6 +48,7 @@ def draw_layout_on_image(image, cells, resized_height=None, resized_width=None,
     original_width, original_height = image.size
         
     # Create a new PDF document
+    fitz = load_fitz()
     doc = fitz.open()
     
     # Get image information
@@ -112,6 +114,138 @@ def draw_layout_on_image(image, cells, resized_height=None, resized_width=None,
     return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
 
 
+def _bbox_array(bboxes) -> np.ndarray:
+    """
+    Stacks bounding boxes into an (N, 4) float64 array.
+
+    Args:
+        bboxes: A sequence of [x1, y1, x2, y2] boxes or an existing array.
+
+    Returns:
+        np.ndarray: The boxes as an (N, 4) float64 array.
+    """
+    if len(bboxes) == 0:
+        return np.empty((0, 4), dtype=np.float64)
+    arr = np.asarray(bboxes, dtype=np.float64)
+    if arr.ndim != 2 or arr.shape[1] != 4:
+        raise ValueError(f"bboxes should have shape (N, 4), got {arr.shape}")
+    if not np.isfinite(arr).all():
+        # A null coordinate from the model becomes NaN here; reject it like float(None) did
+        raise ValueError("bboxes should only hold finite coordinates")
+    return arr
+
+
+def get_bbox_scales(
+    origin_size,
+    input_width,
+    input_height,
+    min_pixels: int = 3136,
+    max_pixels: int = 11289600
+):
+    """
+    Computes the per-axis factors between original image coordinates and model input coordinates.
+
+    Args:
+        origin_size: (width, height) of the original image.
+        input_width: The width of the input image sent to the server.
+        input_height: The height of the input image sent to the server.
+        min_pixels: Minimum number of pixels.
+        max_pixels: Maximum number of pixels.
+
+    Returns:
+        tuple: (scale_x, scale_y) as input size divided by original size.
+    """
+    min_pixels = min_pixels or MIN_PIXELS
+    max_pixels = max_pixels or MAX_PIXELS
+    original_width, original_height = origin_size
+    input_height, input_width = smart_resize(input_height, input_width, min_pixels=min_pixels, max_pixels=max_pixels)
+    return input_width / original_width, input_height / original_height
+
+
+def scale_bboxes(bboxes, scale_x, scale_y, clip_width=None, clip_height=None) -> np.ndarray:
+    """
+    Divides bbox coordinates by per-axis scale factors in a single array operation.
+
+    The result matches the scalar ``int(float(v) / scale)`` conversion, i.e. values are
+    truncated toward zero. The scales and clip bounds may be scalars or arrays of shape (N,),
+    which lets boxes from many pages be transformed together.
+
+    Args:
+        bboxes: A sequence of [x1, y1, x2, y2] boxes or an (N, 4) array.
+        scale_x: Horizontal scale factor(s).
+        scale_y: Vertical scale factor(s).
+        clip_width: If given, x coordinates are clamped to [0, clip_width].
+        clip_height: If given, y coordinates are clamped to [0, clip_height].
+
+    Returns:
+        np.ndarray: The transformed boxes as an (N, 4) int64 array.
+    """
+    arr = _bbox_array(bboxes)
+    scale = np.column_stack(np.broadcast_arrays(scale_x, scale_y, scale_x, scale_y))
+    out = np.trunc(arr / scale)
+    if clip_width is not None:
+        out[:, 0::2] = np.clip(out[:, 0::2], 0, np.reshape(clip_width, (-1, 1)))
+    if clip_height is not None:
+        out[:, 1::2] = np.clip(out[:, 1::2], 0, np.reshape(clip_height, (-1, 1)))
+    return out.astype(np.int64)
+
+
+def legal_bbox_mask(bboxes) -> np.ndarray:
+    """
+    Checks which bounding boxes have a positive width and height.
+
+    Args:
+        bboxes: A sequence of [x1, y1, x2, y2] boxes or an (N, 4) array.
+
+    Returns:
+        np.ndarray: A boolean array of shape (N,), True where the box is legal.
+    """
+    arr = _bbox_array(bboxes)
+    return (arr[:, 2] > arr[:, 0]) & (arr[:, 3] > arr[:, 1])
+
+
+def post_process_bboxes_batch(
+    pages,
+    min_pixels: int = 3136,
+    max_pixels: int = 11289600,
+    clip: bool = False
+) -> List[np.ndarray]:
+    """
+    Converts the bboxes of many pages from model input coordinates back to original coordinates at once.
+
+    Args:
+        pages: An iterable of (origin_size, input_width, input_height, bboxes) tuples,
+            where origin_size is the (width, height) of the original page image.
+        min_pixels: Minimum number of pixels.
+        max_pixels: Maximum number of pixels.
+        clip: If True, clamps the boxes to the bounds of their original image.
+
+    Returns:
+        A list with one (N_i, 4) int64 array per page. The arrays are views of a single result buffer.
+    """
+    arrays, scales_x, scales_y, widths, heights = [], [], [], [], []
+    for origin_size, input_width, input_height, bboxes in pages:
+        arr = _bbox_array(bboxes)
+        scale_x, scale_y = get_bbox_scales(origin_size, input_width, input_height, min_pixels, max_pixels)
+        arrays.append(arr)
+        scales_x.append(scale_x)
+        scales_y.append(scale_y)
+        widths.append(origin_size[0])
+        heights.append(origin_size[1])
+    if not arrays:
+        return []
+
+    counts = [len(arr) for arr in arrays]
+    out = scale_bboxes(
+        np.concatenate(arrays),
+        np.repeat(scales_x, counts),
+        np.repeat(scales_y, counts),
+        clip_width=np.repeat(widths, counts) if clip else None,
+        clip_height=np.repeat(heights, counts) if clip else None,
+    )
+    return np.split(out, np.cumsum(counts)[:-1])
+
+
 def pre_process_bboxes(
     origin_image,
     bboxes,
@@ -131,17 +265,7 @@ def pre_process_bboxes(
     scale_x = original_width / input_width
     scale_y = original_height / input_height
 
-    bboxes_out = []
-    for bbox in bboxes:
-        bbox_resized = [
-            int(float(bbox[0]) / scale_x), 
-            int(float(bbox[1]) / scale_y),
-            int(float(bbox[2]) / scale_x), 
-            int(float(bbox[3]) / scale_y)
-        ]
-        bboxes_out.append(bbox_resized)
-    
-    return bboxes_out
+    return scale_bboxes([bbox[:4] for bbox in bboxes], scale_x, scale_y).tolist()
 
 def post_process_cells(
     origin_image: Image.Image, 
@@ -150,7 +274,8 @@ def post_process_cells(
     input_height,
     factor: int = 28,
     min_pixels: int = 3136, 
-    max_pixels: int = 11289600
+    max_pixels: int = 11289600,
+    clip: bool = False
 ) -> List[Dict]:
     """
     Post-processes cell bounding boxes, converting coordinates from the resized dimensions back to the original dimensions.
@@ -163,41 +288,67 @@ def post_process_cells(
         factor: Resizing factor.
         min_pixels: Minimum number of pixels.
         max_pixels: Maximum number of pixels.
+        clip: If True, clamps the boxes to the bounds of the original image.
         
     Returns:
         A list of post-processed cells.
     """
     assert isinstance(cells, list) and len(cells) > 0 and isinstance(cells[0], dict)
-    min_pixels = min_pixels or MIN_PIXELS
-    max_pixels = max_pixels or MAX_PIXELS
+    scale_x, scale_y = get_bbox_scales(origin_image.size, input_width, input_height, min_pixels, max_pixels)
     original_width, original_height = origin_image.size
+    bboxes_out = scale_bboxes(
+        [cell['bbox'][:4] for cell in cells],
+        scale_x,
+        scale_y,
+        clip_width=original_width if clip else None,
+        clip_height=original_height if clip else None,
+    ).tolist()
 
-    input_height, input_width = smart_resize(input_height, input_width, min_pixels=min_pixels, max_pixels=max_pixels)
-    
-    scale_x = input_width / original_width
-    scale_y = input_height / original_height
-    
     cells_out = []
-    for cell in cells:
-        bbox = cell['bbox']
-        bbox_resized = [
-            int(float(bbox[0]) / scale_x), 
-            int(float(bbox[1]) / scale_y),
-            int(float(bbox[2]) / scale_x), 
-            int(float(bbox[3]) / scale_y)
-        ]
+    for cell, bbox_resized in zip(cells, bboxes_out):
         cell_copy = cell.copy()
         cell_copy['bbox'] = bbox_resized
         cells_out.append(cell_copy)
     
     return cells_out
 
+def post_process_cells_batch(
+    pages,
+    min_pixels: int = 3136,
+    max_pixels: int = 11289600,
+    clip: bool = False
+) -> List[List[Dict]]:
+    """
+    Dict-based counterpart of post_process_bboxes_batch for many pages of cells.
+
+    Args:
+        pages: An iterable of (origin_image, cells, input_width, input_height) tuples.
+        min_pixels: Minimum number of pixels.
+        max_pixels: Maximum number of pixels.
+        clip: If True, clamps the boxes to the bounds of their original image.
+
+    Returns:
+        A list with the post-processed cells of each page.
+    """
+    pages = list(pages)
+    bboxes_out = post_process_bboxes_batch(
+        [
+            (origin_image.size, input_width, input_height, [cell['bbox'][:4] for cell in cells])
+            for origin_image, cells, input_width, input_height in pages
+        ],
+        min_pixels=min_pixels,
+        max_pixels=max_pixels,
+        clip=clip,
+    )
+    return [
+        [{**cell, 'bbox': bbox} for cell, bbox in zip(cells, page_bboxes.tolist())]
+        for (_, cells, _, _), page_bboxes in zip(pages, bboxes_out)
+    ]
+
 def is_legal_bbox(cells):
-    for cell in cells:
-        bbox = cell['bbox']
-        if bbox[2] <= bbox[0] or bbox[3] <= bbox[1]:
-            return False
-    return True
+    if not cells:
+        return True
+    return bool(legal_bbox_mask([cell['bbox'][:4] for cell in cells]).all())
 
 def post_process_output(response, prompt_mode, origin_image, input_image, min_pixels=None, max_pixels=None):
     if prompt_mode in ["prompt_ocr", "prompt_table_html", "prompt_table_latex", "prompt_formula_latex"]:
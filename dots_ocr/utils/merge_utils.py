@@ -8,10 +8,16 @@ and create download packages based on user preferences.
 import os
 import re
 import json
+import hashlib
+import tempfile
+import threading
 import zipfile
-from typing import Optional, List, Dict, Literal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Literal, Iterable, Iterator
 import shutil
 
+from dots_ocr.utils.cells import DocumentCells
+
 
 def numerical_sort(value: str) -> List:
     """
@@ -29,18 +35,63 @@ def numerical_sort(value: str) -> List:
     return parts
 
 
+def list_page_files(output_dir: str, extension: str) -> List[str]:
+    """
+    Find all page_* files with the given extension, sorted numerically
+    
+    Args:
+        output_dir: Directory containing page files
+        extension: File extension including the dot, e.g. ".md"
+        
+    Returns:
+        List of full paths (empty if the directory does not exist)
+    """
+    if not os.path.exists(output_dir):
+        return []
+    
+    page_files = []
+    for file in os.listdir(output_dir):
+        if file.endswith(extension) and "page_" in file.lower():
+            page_files.append(os.path.join(output_dir, file))
+    
+    page_files.sort(key=lambda x: numerical_sort(os.path.basename(x)))
+    return page_files
+
+
+_HYPHENATION_RE = re.compile(r'(\w+)-\n(\w+)')
+_TRAILING_HYPHEN_RE = re.compile(r'([^\W\d_])-\s*$')
+_LEADING_LETTER_RE = re.compile(r'\s*([^\W\d_])')
+
+
+def _iter_markdown_pages(md_files: Iterable[str]) -> Iterator[str]:
+    for file_path in md_files:
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                yield f.read()
+        except Exception as e:
+            print(f"Warning: Failed to read {file_path}: {e}")
+
+
 def merge_markdown_files(
     output_dir: str,
     filename_base: Optional[str] = None,
-    output_filename: str = "MERGED_DOCUMENT.md"
+    output_filename: str = "MERGED_DOCUMENT.md",
+    md_files: Optional[List[str]] = None,
+    pages: Optional[Iterable[str]] = None
 ) -> Optional[str]:
     """
     Merge all page_*.md files in output_dir into a single markdown file
     
+    Pages are streamed into the output file one at a time. Hyphenation is
+    removed at line breaks within a page and across page boundaries.
+    
     Args:
         output_dir: Directory containing markdown files
         filename_base: Base filename for context (optional, not used in output)
         output_filename: Name of the output merged file
+        md_files: Page files in order; skips rediscovering them in output_dir
+        pages: Markdown content of each page in order, e.g. straight from parse
+            results; no page files are read
         
     Returns:
         Path to merged file, or None if no files found
@@ -48,59 +99,101 @@ def merge_markdown_files(
     if not os.path.exists(output_dir):
         return None
     
-    # Find all markdown files
-    md_files = []
-    for file in os.listdir(output_dir):
-        if file.endswith(".md") and "page_" in file.lower():
-            full_path = os.path.join(output_dir, file)
-            md_files.append(full_path)
+    if pages is None:
+        if md_files is None:
+            md_files = list_page_files(output_dir, ".md")
+        if not md_files:
+            return None
+        pages = _iter_markdown_pages(md_files)
+    
+    output_path = os.path.join(output_dir, output_filename)
+    num_pages = 0
+    with open(output_path, 'w', encoding='utf-8') as f:
+        # Hold back one page so that a word hyphenated across the page boundary can be joined
+        previous = None
+        for text in pages:
+            # Remove hyphenation at line breaks
+            text = _HYPHENATION_RE.sub(r'\1\2', text)
+            num_pages += 1
+            if previous is None:
+                previous = text
+                continue
+            
+            # A word continues on this page if the previous page ends with "letter-" and this one starts lowercase
+            leading = _LEADING_LETTER_RE.match(text)
+            if leading and leading.group(1).islower() and _TRAILING_HYPHEN_RE.search(previous):
+                f.write(_TRAILING_HYPHEN_RE.sub(r'\1', previous))
+                previous = text.lstrip()
+            else:
+                # Add spacing between pages (but not after the last page)
+                f.write(previous)
+                f.write("\n\n")
+                previous = text
+        if previous is not None:
+            f.write(previous)
     
-    if not md_files:
+    if num_pages == 0:
+        os.remove(output_path)
         return None
     
-    # Sort numerically
-    md_files.sort(key=lambda x: numerical_sort(os.path.basename(x)))
+    return output_path
+
+
+def load_document_cells(output_dir: str) -> Optional[DocumentCells]:
+    """
+    Load all page_*.json files in output_dir into a compact DocumentCells
     
-    # Build merged content - simple concatenation
-    merged_content = ""
+    Args:
+        output_dir: Directory containing JSON files
+        
+    Returns:
+        DocumentCells with one page per JSON file, or None if no files found
+    """
+    json_files = list_page_files(output_dir, ".json")
+    if not json_files:
+        return None
     
-    for idx, file_path in enumerate(md_files, 1):
+    pages = []
+    for file_path in json_files:
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-                # Remove hyphenation at line breaks
-                text = re.sub(r'(\w+)-\n(\w+)', r'\1\2', text)
-                
-                # Simply append the content
-                merged_content += text
-                
-                # Add spacing between pages (but not after the last page)
-                if idx < len(md_files):
-                    merged_content += "\n\n"
+                pages.append(json.load(f))
         except Exception as e:
             print(f"Warning: Failed to read {file_path}: {e}")
-            continue
-    
-    # Save merged file
-    output_path = os.path.join(output_dir, output_filename)
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(merged_content)
+            pages.append(None)
     
-    return output_path
+    return DocumentCells.from_pages(pages)
+
+
+def _indent_json(value, level: int) -> str:
+    """Serialize value the way json.dump(indent=2) does at the given nesting level"""
+    text = json.dumps(value, ensure_ascii=False, indent=2)
+    return text.replace("\n", "\n" + "  " * level)
 
 
 def merge_json_files(
     output_dir: str,
     filename_base: Optional[str] = None,
-    output_filename: str = "MERGED_LAYOUT.json"
+    output_filename: str = "MERGED_LAYOUT.json",
+    document_cells: Optional[DocumentCells] = None,
+    json_files: Optional[List[str]] = None,
+    pages: Optional[Iterable] = None
 ) -> Optional[str]:
     """
     Merge all page_*.json files into a single JSON structure
     
+    The output is written incrementally, one page element at a time, and is
+    formatted exactly like json.dump(..., indent=2) of the whole structure.
+    
     Args:
         output_dir: Directory containing JSON files
         filename_base: Base filename for context (optional)
         output_filename: Name of the output merged file
+        document_cells: In-memory cells of all pages; if given, the page
+            files are not read and output_dir is only used for the output
+        json_files: Page files in order; skips rediscovering them in output_dir
+        pages: Layout data of each page in order, e.g. straight from parse
+            results; no page files are read
         
     Returns:
         Path to merged file, or None if no files found
@@ -108,48 +201,267 @@ def merge_json_files(
     if not os.path.exists(output_dir):
         return None
     
-    # Find all JSON files
-    json_files = []
-    for file in os.listdir(output_dir):
-        if file.endswith(".json") and "page_" in file.lower():
-            full_path = os.path.join(output_dir, file)
-            json_files.append(full_path)
+    if document_cells is not None:
+        pages = [document_cells.page_data(idx) for idx in range(document_cells.num_pages)]
     
-    if not json_files:
-        return None
+    if pages is not None:
+        pages = pages if isinstance(pages, list) else list(pages)
+        total_pages = len(pages)
+        entries = (
+            {"page_number": idx, "elements": page_data if isinstance(page_data, list) else [page_data]}
+            for idx, page_data in enumerate(pages)
+        )
+    else:
+        if json_files is None:
+            json_files = list_page_files(output_dir, ".json")
+        if not json_files:
+            return None
+        total_pages = len(json_files)
+        entries = _iter_json_page_entries(json_files)
     
-    # Sort numerically
-    json_files.sort(key=lambda x: numerical_sort(os.path.basename(x)))
-    
-    # Build merged structure
-    merged_data = {
-        "document": filename_base if filename_base else "Merged Document",
-        "total_pages": len(json_files),
-        "pages": []
-    }
+    # Save merged file
+    output_path = os.path.join(output_dir, output_filename)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write('{\n')
+        f.write(f'  "document": {_indent_json(filename_base if filename_base else "Merged Document", 1)},\n')
+        f.write(f'  "total_pages": {total_pages},\n')
+        if total_pages == 0:
+            f.write('  "pages": []\n}')
+            return output_path
+        f.write('  "pages": [\n')
+        for idx, entry in enumerate(entries):
+            if idx > 0:
+                f.write(',\n')
+            f.write('    ')
+            f.write(_indent_json(entry, 2))
+        f.write('\n  ]\n}')
     
+    return output_path
+
+
+def _iter_json_page_entries(json_files: List[str]) -> Iterator[Dict]:
     for idx, file_path in enumerate(json_files):
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
                 page_data = json.load(f)
-                
-                merged_data["pages"].append({
-                    "page_number": idx,
-                    "elements": page_data if isinstance(page_data, list) else [page_data]
-                })
         except Exception as e:
             print(f"Warning: Failed to read {file_path}: {e}")
-            merged_data["pages"].append({
+            yield {
                 "page_number": idx,
                 "error": str(e)
-            })
+            }
+            continue
+        
+        yield {
+            "page_number": idx,
+            "elements": page_data if isinstance(page_data, list) else [page_data]
+        }
+
+
+# Members that are already compressed are stored as-is instead of being deflated again
+_STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.zip', '.gz'}
+
+
+def _file_state(path: str) -> List[int]:
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _files_signature(files: List[str]) -> str:
+    """Key for a set of files: their names, sizes and modification times"""
+    digest = hashlib.sha1()
+    for path in files:
+        size, mtime_ns = _file_state(path)
+        digest.update(f"{os.path.basename(path)}:{size}:{mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _load_sidecar(path: str) -> Optional[Dict]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _temp_path(path: str) -> str:
+    """A fresh temporary file next to path, so concurrent writers never share one"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    return tmp_path
+
+
+def _save_sidecar(path: str, data: Dict):
+    tmp_path = _temp_path(path)
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _cached_merge(output_dir: str, output_filename: str, page_files: List[str], merge) -> Optional[str]:
+    """
+    Run merge() unless output_filename was already merged from the same page files
     
-    # Save merged file
+    Args:
+        output_dir: Directory containing the page files and the merged output
+        output_filename: Name of the merged file
+        page_files: Page files the merged file is built from
+        merge: Callable producing the merged file, returns its path or None
+        
+    Returns:
+        Path to merged file, or None if nothing was merged
+    """
+    if not page_files:
+        return None
+    
+    cache_path = os.path.join(output_dir, ".merge_cache")
+    cache = _load_sidecar(cache_path) or {}
+    signature = _files_signature(page_files)
     output_path = os.path.join(output_dir, output_filename)
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(merged_data, f, ensure_ascii=False, indent=2)
+    if cache.get(output_filename) == signature and os.path.exists(output_path):
+        return output_path
     
-    return output_path
+    merged_path = merge()
+    if merged_path:
+        cache[output_filename] = signature
+        _save_sidecar(cache_path, cache)
+    return merged_path
+
+
+def _read_member(member):
+    file_path, arcname = member
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    if os.path.splitext(file_path)[1].lower() in _STORED_EXTENSIONS:
+        zinfo.compress_type = zipfile.ZIP_STORED
+    else:
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+    with open(file_path, 'rb') as f:
+        return zinfo, f.read()
+
+
+def _write_members(zipf: zipfile.ZipFile, members: List, max_workers: int):
+    # Members are read in parallel, a bounded window at a time to cap memory
+    window = max(1, max_workers) * 4
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for start in range(0, len(members), window):
+            for zinfo, data in executor.map(_read_member, members[start:start + window]):
+                zipf.writestr(zinfo, data)
+
+
+_zip_locks: Dict[str, threading.Lock] = {}
+_zip_locks_lock = threading.Lock()
+
+
+def _zip_lock(zip_path: str) -> threading.Lock:
+    with _zip_locks_lock:
+        return _zip_locks.setdefault(os.path.abspath(zip_path), threading.Lock())
+
+
+def _rebuild_zip(zip_path: str, members: List, max_workers: int):
+    tmp_path = _temp_path(zip_path)
+    try:
+        with zipfile.ZipFile(tmp_path, 'w') as zipf:
+            _write_members(zipf, members, max_workers)
+        os.replace(tmp_path, zip_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def build_zip(zip_path: str, members: List, max_workers: int = 4) -> str:
+    """
+    Build a ZIP file incrementally
+    
+    A manifest of the members (size and mtime) is kept next to the ZIP. If it
+    matches, the existing ZIP is returned untouched; if members were only
+    added, they are appended; otherwise the ZIP is rebuilt. Already compressed
+    members (images, archives) are stored without recompression.
+    
+    An append skips members the ZIP already holds, so a crash between the
+    append and the manifest update cannot duplicate entries; a ZIP left
+    unreadable by a crash is rebuilt. Builds of the same ZIP in this process
+    are serialized, and rebuilds go through a unique temporary file.
+    
+    Args:
+        zip_path: Path of the ZIP file
+        members: List of (file_path, arcname) tuples
+        max_workers: Number of threads reading members
+        
+    Returns:
+        Path to the ZIP file
+    """
+    manifest_path = zip_path + ".manifest"
+    with _zip_lock(zip_path):
+        current = {arcname: _file_state(file_path) for file_path, arcname in members}
+        previous = _load_sidecar(manifest_path) if os.path.exists(zip_path) else None
+        
+        if previous == current:
+            return zip_path
+        
+        rebuild = True
+        if previous and all(current.get(arcname) == state for arcname, state in previous.items()):
+            # Only new members: append those the archive does not hold yet
+            try:
+                with zipfile.ZipFile(zip_path, 'a') as zipf:
+                    present = set(zipf.namelist())
+                    _write_members(zipf, [(file_path, arcname) for file_path, arcname in members if arcname not in present], max_workers)
+                rebuild = False
+            except zipfile.BadZipFile:
+                pass
+        if rebuild:
+            _rebuild_zip(zip_path, members, max_workers)
+        
+        _save_sidecar(manifest_path, current)
+    return zip_path
+
+
+def create_results_archive(
+    output_dir: str,
+    zip_path: str,
+    max_workers: int = 4,
+    files: Optional[Iterable[str]] = None
+) -> Optional[str]:
+    """
+    Create (or incrementally update) a ZIP of all result files in output_dir
+    
+    ZIP files and hidden bookkeeping files are skipped.
+    
+    Args:
+        output_dir: Directory containing processed results
+        zip_path: Path of the ZIP file
+        max_workers: Number of threads reading members
+        files: Only archive these files (e.g. those of the pages finished so far)
+            instead of everything in output_dir
+        
+    Returns:
+        Path to created ZIP file, or None on error
+    """
+    if not os.path.exists(output_dir):
+        return None
+    
+    if files is None:
+        files = []
+        for root, _, names in os.walk(output_dir):
+            files.extend(os.path.join(root, name) for name in sorted(names))
+    
+    members = []
+    for file_path in files:
+        file = os.path.basename(file_path)
+        if file.endswith('.zip') or file.startswith('.') or file.endswith(('.manifest', '.tmp')):
+            continue
+        if not os.path.isfile(file_path):
+            continue
+        members.append((file_path, os.path.relpath(file_path, output_dir)))
+    
+    try:
+        return build_zip(zip_path, members, max_workers=max_workers)
+    except Exception as e:
+        print(f"Error creating ZIP: {e}")
+        return None
 
 
 def create_download_package(
@@ -161,6 +473,10 @@ def create_download_package(
     """
     Create a ZIP package based on user's format and scope choices
     
+    Merged documents are only regenerated when the page files changed, and
+    the package is only rebuilt when its members changed, so repeated
+    downloads of the same result are near-instant.
+    
     Args:
         output_dir: Directory containing processed results
         format_choice: "markdown" | "json" | "both"
@@ -177,36 +493,55 @@ def create_download_package(
     
     # Handle Markdown format
     if format_choice in ["markdown", "both"]:
+        md_files = list_page_files(output_dir, ".md")
+        
         # Individual MD files
         if scope_choice in ["individual", "both"]:
-            for file in os.listdir(output_dir):
-                if file.endswith(".md") and "page_" in file.lower():
-                    files_to_zip.append(os.path.join(output_dir, file))
+            files_to_zip.extend(md_files)
         
         # Merged MD file
         if scope_choice in ["merged", "both"]:
-            merged_md = merge_markdown_files(
+            merged_md = _cached_merge(
                 output_dir,
-                filename_base,
-                "MERGED_DOCUMENT.md"
+                "MERGED_DOCUMENT.md",
+                md_files,
+                lambda: merge_markdown_files(
+                    output_dir,
+                    filename_base,
+                    "MERGED_DOCUMENT.md",
+                    md_files=md_files
+                )
             )
             if merged_md and os.path.exists(merged_md):
                 files_to_zip.append(merged_md)
+        
+        # Picture assets referenced by relative path (written with picture_mode="assets")
+        asset_dir = os.path.join(output_dir, "assets")
+        if os.path.isdir(asset_dir):
+            for file in sorted(os.listdir(asset_dir)):
+                if not file.endswith('.tmp'):
+                    files_to_zip.append(os.path.join(asset_dir, file))
     
     # Handle JSON format
     if format_choice in ["json", "both"]:
+        json_files = list_page_files(output_dir, ".json")
+        
         # Individual JSON files
         if scope_choice in ["individual", "both"]:
-            for file in os.listdir(output_dir):
-                if file.endswith(".json") and "page_" in file.lower():
-                    files_to_zip.append(os.path.join(output_dir, file))
+            files_to_zip.extend(json_files)
         
         # Merged JSON file
         if scope_choice in ["merged", "both"]:
-            merged_json = merge_json_files(
+            merged_json = _cached_merge(
                 output_dir,
-                filename_base,
-                "MERGED_LAYOUT.json"
+                "MERGED_LAYOUT.json",
+                json_files,
+                lambda: merge_json_files(
+                    output_dir,
+                    filename_base,
+                    "MERGED_LAYOUT.json",
+                    json_files=json_files
+                )
             )
             if merged_json and os.path.exists(merged_json):
                 files_to_zip.append(merged_json)
@@ -214,17 +549,14 @@ def create_download_package(
     if not files_to_zip:
         return None
     
-    # Create ZIP file
-    zip_filename = f"{filename_base or 'download'}_package.zip"
+    # One ZIP per choice, so switching between choices does not invalidate the others
+    zip_filename = f"{filename_base or 'download'}_{format_choice}_{scope_choice}_package.zip"
     zip_path = os.path.join(output_dir, zip_filename)
     
     try:
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for file_path in files_to_zip:
-                # Add file to ZIP with just the filename (not full path)
-                zipf.write(file_path, os.path.basename(file_path))
-        
-        return zip_path
+        # Add files to ZIP relative to output_dir (just the filename for page files)
+        members = [(file_path, os.path.relpath(file_path, output_dir)) for file_path in files_to_zip]
+        return build_zip(zip_path, members)
     except Exception as e:
         print(f"Error creating ZIP: {e}")
         return None
@@ -0,0 +1,206 @@
+"""
+Metrics for dots.ocr
+
+An optional, process-wide registry of counters and gauges fed by the inference
+functions, the parser and the demo's result cache. Nothing is recorded until
+enable_metrics() is called; afterwards the registry can be scraped in the
+Prometheus text format from a local HTTP endpoint:
+
+    registry = enable_metrics()
+    registry.serve(9464)          # http://127.0.0.1:9464/metrics
+
+Rates (pages/sec, 429 rate, cache hit rate) are derived from the counters by
+the scraper, e.g. rate(dots_ocr_pages_total[1m]).
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from dots_ocr.utils.timing import add_stage_observer, remove_stage_observer
+
+
+# name -> (type, help); metrics not listed here are exported as untyped
+METRICS = {
+    "dots_ocr_requests_in_flight": ("gauge", "API requests currently waiting for a response"),
+    "dots_ocr_requests_total": ("counter", "API request attempts by outcome (ok, rate_limited, server_error, timeout, connection_error, error, replayed)"),
+    "dots_ocr_rate_limited_total": ("counter", "API request attempts rejected with 429"),
+    "dots_ocr_endpoint_requests_total": ("counter", "API request attempts per endpoint by outcome, with --endpoints"),
+    "dots_ocr_endpoint_ejections_total": ("counter", "Times an endpoint was taken out of rotation after failures"),
+    "dots_ocr_key_requests_total": ("counter", "API request attempts per API key (masked) by outcome, with --api_keys"),
+    "dots_ocr_upload_bytes_total": ("counter", "Bytes of image and prompt payload sent to the API"),
+    "dots_ocr_tokens_total": ("counter", "Tokens reported in the API usage by kind (prompt, completion)"),
+    "dots_ocr_queue_depth": ("gauge", "Pages waiting for a worker slot or API budget"),
+    "dots_ocr_pages_total": ("counter", "Pages parsed by status (ok, filtered, error)"),
+    "dots_ocr_documents_total": ("counter", "Documents parsed"),
+    "dots_ocr_result_cache_lookups_total": ("counter", "Result cache lookups by result (hit, miss)"),
+    "dots_ocr_stage_seconds_total": ("counter", "Time spent per pipeline stage"),
+    "dots_ocr_stage_calls_total": ("counter", "Number of timed pipeline stages"),
+    "dots_ocr_start_time_seconds": ("gauge", "Unix time the registry was enabled"),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: LabelKey) -> str:
+    if not labels:
+        return ""
+    escaped = []
+    for k, v in labels:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{k}="{v}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class MetricsRegistry:
+    """Thread-safe counters and gauges with labels, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, Dict[LabelKey, float]] = {}
+        self._server = None
+        self.set_gauge("dots_ocr_start_time_seconds", time.time())
+
+    def _add(self, name: str, value: float, labels: dict):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        """Increases a counter"""
+        self._add(name, value, labels)
+
+    def add_gauge(self, name: str, delta: float, **labels):
+        """Moves a gauge up or down"""
+        self._add(name, delta, labels)
+
+    def set_gauge(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values.setdefault(name, {})[key] = value
+
+    def value(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._values.get(name, {}).get(tuple(sorted(labels.items())), 0.0)
+
+    @contextmanager
+    def in_progress(self, name: str, **labels):
+        """Raises a gauge for the duration of the block"""
+        self.add_gauge(name, 1, **labels)
+        try:
+            yield
+        finally:
+            self.add_gauge(name, -1, **labels)
+
+    def observe_stage(self, timer, stage: str, start: float, end: float):
+        """Stage observer (see dots_ocr.utils.timing) accumulating time per stage"""
+        self.inc("dots_ocr_stage_seconds_total", end - start, stage=stage)
+        self.inc("dots_ocr_stage_calls_total", stage=stage)
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            snapshot = {name: dict(series) for name, series in self._values.items()}
+        lines = []
+        for name in sorted(snapshot):
+            metric_type, help_text = METRICS.get(name, ("untyped", ""))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in sorted(snapshot[name].items()):
+                lines.append(f"{name}{_format_labels(labels)} {value:.17g}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """
+        Serves the metrics at http://host:port/metrics from a daemon thread.
+
+        Args:
+            port: Port to listen on (0 picks a free one, see server.server_port).
+            host: Interface to bind; the default only accepts local scrapers.
+
+        Returns:
+            ThreadingHTTPServer: The running server.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # scrapes every few seconds would flood the console
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="dots-ocr-metrics", daemon=True).start()
+        print(f"Serving metrics at http://{host}:{self._server.server_port}/metrics")
+        return self._server
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+_registry: Optional[MetricsRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def enable_metrics() -> MetricsRegistry:
+    """Creates the process-wide registry (once) and starts feeding it"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+            add_stage_observer(_registry.observe_stage)
+        return _registry
+
+
+def disable_metrics():
+    global _registry
+    with _registry_lock:
+        if _registry is not None:
+            remove_stage_observer(_registry.observe_stage)
+            _registry.shutdown()
+            _registry = None
+
+
+def get_metrics() -> Optional[MetricsRegistry]:
+    """Returns the registry, or None while metrics are disabled"""
+    return _registry
+
+
+# Shortcuts for instrumented code; they do nothing while metrics are disabled
+
+def inc(name: str, value: float = 1.0, **labels):
+    if _registry is not None:
+        _registry.inc(name, value, **labels)
+
+
+def add_gauge(name: str, delta: float, **labels):
+    if _registry is not None:
+        _registry.add_gauge(name, delta, **labels)
+
+
+@contextmanager
+def in_progress(name: str, **labels):
+    registry = _registry
+    if registry is None:
+        yield
+        return
+    with registry.in_progress(name, **labels):
+        yield
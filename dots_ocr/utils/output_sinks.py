@@ -0,0 +1,268 @@
+"""
+Output Sinks for dots.ocr
+
+A sink receives the page results of DotsOCRParser as they complete and
+decides what, if anything, is written to disk:
+
+- FilesSink: one .json, .jpg, .md and _nohf.md file per page (the classic layout)
+- JsonlSink: a single append-only JSONL file per document, cells and markdown inline
+- SqliteSink: pages and cells upserted into an indexed SQLite ResultStore
+- NullSink: nothing; results are only handed over in memory
+
+Pages of one document may be written from several threads at once, so every
+sink is thread-safe.
+"""
+
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+from dots_ocr.utils.result_store import ResultStore
+
+
+PAGE_IMAGE_MODES = ("full", "downscale", "none")
+
+
+def save_page_image(result: dict, save_dir: str, page_name: str, mode: str = "full", max_size: int = 1600) -> Optional[str]:
+    """
+    Writes the page image of a result as JPEG.
+
+    Args:
+        result: Page result holding the image under 'layout_image'.
+        save_dir: Directory the image is written to.
+        page_name: File name without extension.
+        mode: "full" keeps the rendered resolution, "downscale" limits the longer
+            side to max_size, "none" writes nothing.
+        max_size: Longer side in pixels for "downscale".
+
+    Returns:
+        The path of the image, or None if nothing was written.
+    """
+    image = result.get('layout_image')
+    if image is None or mode == "none":
+        return None
+    if mode == "downscale" and max(image.size) > max_size:
+        image = image.copy()
+        image.thumbnail((max_size, max_size), Image.Resampling.BILINEAR)
+    image_path = os.path.join(save_dir, f"{page_name}.jpg")
+    image.save(image_path)
+    return image_path
+
+
+def page_record(result: dict) -> dict:
+    """Returns the JSON-serializable content of a page result (everything but the image)"""
+    return {k: v for k, v in result.items() if k != 'layout_image'}
+
+
+class OutputSink:
+    """
+    Base class of the parser's output sinks.
+
+    Args:
+        page_image: "full", "downscale" or "none", how the page image is stored (if the sink stores it).
+        page_image_max_size: Longer side of downscaled page images in pixels.
+    """
+
+    # parse_file writes <output>/<name>.jsonl listing the result files of each page
+    write_index = False
+    # The sink writes into the document's save_dir, so parse_file has to create it
+    uses_save_dir = True
+
+    def __init__(self, page_image: str = "full", page_image_max_size: int = 1600):
+        if page_image not in PAGE_IMAGE_MODES:
+            raise ValueError(f"page_image should be one of {PAGE_IMAGE_MODES}, got {page_image}")
+        self.page_image = page_image
+        self.page_image_max_size = page_image_max_size
+
+    def write_page(self, result: dict, save_dir: str, doc_name: str, page_name: str) -> dict:
+        """
+        Stores one page result, adding the paths of anything written to it.
+
+        Args:
+            result: The page result with its content in memory.
+            save_dir: Output directory of the document.
+            doc_name: Name of the document (the input file name without extension).
+            page_name: Name of the page, e.g. "<doc_name>_page_3".
+
+        Returns:
+            dict: The result.
+        """
+        raise NotImplementedError
+
+    def finish_document(self, save_dir: str, doc_name: str):
+        """Called once all pages of a document have been written"""
+
+    def close(self):
+        """Releases files and connections"""
+
+    def _save_page_image(self, result, save_dir, page_name):
+        return save_page_image(result, save_dir, page_name, self.page_image, self.page_image_max_size)
+
+
+class FilesSink(OutputSink):
+    """Writes <page>.json, <page>.jpg, <page>.md and <page>_nohf.md for every page"""
+
+    write_index = True
+
+    def write_page(self, result, save_dir, doc_name, page_name):
+        if 'cells' in result:
+            json_file_path = os.path.join(save_dir, f"{page_name}.json")
+            with open(json_file_path, 'w', encoding="utf-8") as w:
+                json.dump(result['cells'], w, ensure_ascii=False)
+            result['layout_info_path'] = json_file_path
+        image_layout_path = self._save_page_image(result, save_dir, page_name)
+        if image_layout_path:
+            result['layout_image_path'] = image_layout_path
+        if 'md_content' in result:
+            md_file_path = os.path.join(save_dir, f"{page_name}.md")
+            with open(md_file_path, "w", encoding="utf-8") as md_file:
+                md_file.write(result['md_content'])
+            result['md_content_path'] = md_file_path
+        if 'md_content_nohf' in result:
+            md_nohf_file_path = os.path.join(save_dir, f"{page_name}_nohf.md")
+            with open(md_nohf_file_path, "w", encoding="utf-8") as md_file:
+                md_file.write(result['md_content_nohf'])
+            result['md_content_nohf_path'] = md_nohf_file_path
+        if 'filtered' in result:
+            result['filtered'] = result.pop('filtered')  # keep the key after the paths, as in the jsonl index
+        return result
+
+
+class JsonlSink(OutputSink):
+    """
+    Appends one JSON line per page to <save_dir>/<doc_name>_pages.jsonl.
+
+    The file is rewritten by every parse of the document, so parsing it again
+    replaces its pages like the other sinks do. Lines are written in completion order, so readers should sort by page_no.
+    Page images, if kept, are written next to it as <page>.jpg.
+    """
+
+    def __init__(self, page_image: str = "none", page_image_max_size: int = 1600):
+        super().__init__(page_image, page_image_max_size)
+        self._lock = threading.Lock()
+        self._files: Dict[Tuple[str, str], object] = {}
+
+    def _document_path(self, save_dir, doc_name):
+        return os.path.join(save_dir, f"{doc_name}_pages.jsonl")
+
+    def write_page(self, result, save_dir, doc_name, page_name):
+        image_layout_path = self._save_page_image(result, save_dir, page_name)
+        if image_layout_path:
+            result['layout_image_path'] = image_layout_path
+        line = json.dumps(page_record(result), ensure_ascii=False) + '\n'
+        with self._lock:
+            f = self._files.get((save_dir, doc_name))
+            if f is None:
+                # The first page of a parse replaces the lines of an earlier parse of the document
+                f = open(self._document_path(save_dir, doc_name), 'w', encoding='utf-8')
+                self._files[(save_dir, doc_name)] = f
+            f.write(line)
+            f.flush()  # each finished page survives a crash of the run
+        result['jsonl_path'] = self._document_path(save_dir, doc_name)
+        return result
+
+    def finish_document(self, save_dir, doc_name):
+        with self._lock:
+            f = self._files.pop((save_dir, doc_name), None)
+        if f is not None:
+            f.close()
+
+    def close(self):
+        with self._lock:
+            files, self._files = list(self._files.values()), {}
+        for f in files:
+            f.close()
+
+
+class SqliteSink(OutputSink):
+    """
+    Upserts every page with its cells into a ResultStore, an indexed SQLite
+    database shared by all documents (see dots_ocr.utils.result_store).
+
+    Without a db_path, every output directory gets its own database,
+    <output_dir>/results.sqlite3, next to the documents' save_dirs, so
+    parse_file(output_dir=...) indexes its pages where their files go. A page
+    parsed again replaces its previous rows. Page images, if kept, are
+    written to the document's save_dir and referenced by path.
+    """
+
+    DB_NAME = "results.sqlite3"
+
+    def __init__(self, db_path: Optional[str] = None, page_image: str = "none", page_image_max_size: int = 1600):
+        super().__init__(page_image, page_image_max_size)
+        self.uses_save_dir = page_image != "none"
+        self.db_path = db_path
+        self._stores: Dict[str, ResultStore] = {}
+        self._lock = threading.Lock()
+
+    def store_for(self, save_dir: str) -> ResultStore:
+        """The ResultStore of a document's save_dir, opened on first use"""
+        if self.db_path is not None:
+            db_path = os.path.abspath(self.db_path)
+        else:
+            db_path = os.path.join(os.path.dirname(os.path.abspath(save_dir)), self.DB_NAME)
+        with self._lock:
+            if db_path not in self._stores:
+                self._stores[db_path] = ResultStore(db_path)
+            return self._stores[db_path]
+
+    def write_page(self, result, save_dir, doc_name, page_name):
+        image_layout_path = self._save_page_image(result, save_dir, page_name)
+        if image_layout_path:
+            result['layout_image_path'] = image_layout_path
+        self.store_for(save_dir).upsert_page(doc_name, result, path=os.path.abspath(save_dir))
+        return result
+
+    def close(self):
+        with self._lock:
+            stores, self._stores = list(self._stores.values()), {}
+        for store in stores:
+            store.close()
+
+
+class NullSink(OutputSink):
+    """Writes nothing; for library use where the in-memory results are all that is needed"""
+
+    uses_save_dir = False
+
+    def __init__(self, page_image: str = "none", page_image_max_size: int = 1600):
+        super().__init__(page_image, page_image_max_size)
+
+    def write_page(self, result, save_dir, doc_name, page_name):
+        return result
+
+
+OUTPUT_SINKS = {
+    "files": FilesSink,
+    "jsonl": JsonlSink,
+    "sqlite": SqliteSink,
+    "null": NullSink,
+}
+
+
+def make_output_sink(name: str, page_image: Optional[str] = None, page_image_max_size: int = 1600, db_path: Optional[str] = None) -> OutputSink:
+    """
+    Creates an output sink by name.
+
+    Args:
+        name: "files", "jsonl", "sqlite" or "null".
+        page_image: "full", "downscale" or "none"; None uses the sink's default
+            ("full" for files, "none" otherwise).
+        page_image_max_size: Longer side of downscaled page images in pixels.
+        db_path: Database file of the "sqlite" sink; None for one
+            results.sqlite3 per output directory.
+
+    Returns:
+        OutputSink
+    """
+    if name not in OUTPUT_SINKS:
+        raise ValueError(f"output sink should be one of {list(OUTPUT_SINKS)}, got {name}")
+    kwargs = {"page_image_max_size": page_image_max_size}
+    if page_image is not None:
+        kwargs["page_image"] = page_image
+    if name == "sqlite":
+        return SqliteSink(db_path, **kwargs)
+    return OUTPUT_SINKS[name](**kwargs)
@@ -0,0 +1,235 @@
+"""
+Stage Profiler for dots.ocr
+
+Profiles a parser run per pipeline stage (see dots_ocr.utils.timing), which a
+plain cProfile of main() cannot do once asyncio interleaves the pages:
+
+- A sampling thread records the Python stacks of all threads every few
+  milliseconds and files each sample under the stage its thread is in. The
+  samples are written as collapsed stacks (profile.collapsed, one
+  "stage;outer;...;inner count" line per stack), which flamegraph.pl,
+  speedscope and most flame graph viewers read.
+- The CPU stages (render, resize, encode, post_process, markdown, write) are
+  profiled deterministically with cProfile, one <stage>.pstats per stage.
+- tracemalloc runs while a CPU stage is profiled, giving the peak Python
+  memory of every stage and the top allocation sites still alive at the end of its
+  first few runs (allocations.txt).
+
+Deterministic profiling and allocation tracing slow the profiled stages down;
+one stage is profiled at a time, concurrent ones are only sampled.
+
+    profiler = StageProfiler("./profile").start()
+    parser.parse_file("report.pdf")
+    profiler.stop()
+    profiler.save()
+"""
+
+import asyncio
+import cProfile
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, List
+
+from dots_ocr.utils.timing import add_stage_wrapper, remove_stage_wrapper
+
+# Stages doing Python-side work in the thread that runs them
+CPU_STAGES = ("render", "resize", "encode", "post_process", "markdown", "write")
+# Innermost frames of threads that are parked, e.g. idle pool workers; dropped unless inside a stage
+IDLE_FUNCTIONS = {"wait", "select", "poll", "get", "_worker", "serve_forever", "accept", "_wait_for_tstate_lock"}
+
+
+class StageProfiler:
+    """
+    Sampling, deterministic and allocation profiles of a run, attributed to pipeline stages.
+
+    Args:
+        output_dir: Directory the profile files are written to.
+        interval: Seconds between stack samples.
+        top_n: Number of entries in the per-stage reports.
+        deterministic: Profile the CPU stages with cProfile.
+        trace_allocations: Trace allocations of the CPU stages with tracemalloc.
+        allocation_runs: Runs of each stage whose allocation sites are reported.
+    """
+
+    def __init__(self, output_dir: str, interval: float = 0.005, top_n: int = 20, deterministic: bool = True, trace_allocations: bool = True, allocation_runs: int = 3):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.top_n = top_n
+        self.deterministic = deterministic
+        self.trace_allocations = trace_allocations
+        self.allocation_runs = allocation_runs
+
+        self._active: Dict[int, List[str]] = {}        # thread id -> stages entered in that thread
+        self._samples: Counter = Counter()              # (stage, frame, ...) -> samples
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._profiled_runs: Counter = Counter()
+        self._allocations: Dict[str, Counter] = defaultdict(Counter)   # stage -> "file:line" -> bytes
+        self._allocation_counts: Dict[str, Counter] = defaultdict(Counter)
+        self._allocation_runs: Counter = Counter()
+        self._peaks: Dict[str, int] = {}
+        self._exclusive = threading.Lock()              # one stage is profiled in depth at a time
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------- lifecycle ----------
+
+    def start(self) -> "StageProfiler":
+        add_stage_wrapper(self._wrap)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name="dots-ocr-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        remove_stage_wrapper(self._wrap)
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # ---------- collection ----------
+
+    @contextmanager
+    def _wrap(self, timer, stage):
+        tid = threading.get_ident()
+        try:
+            in_event_loop = asyncio.get_running_loop() is not None
+        except RuntimeError:
+            in_event_loop = False
+        # In the event loop only the CPU stages run without awaiting; other stages of other pages interleave there
+        track = stage in CPU_STAGES or not in_event_loop
+        deep = stage in CPU_STAGES and self._exclusive.acquire(blocking=False)
+        if track:
+            self._active.setdefault(tid, []).append(stage)
+        profile = None
+        tracing = False
+        try:
+            if deep:
+                # Allocations are traced only while the stage runs, so snapshots hold just what it allocated
+                if self.trace_allocations and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    tracing = True
+                if self.deterministic:
+                    profile = self._profiles.setdefault(stage, cProfile.Profile())
+                    try:
+                        profile.enable()
+                    except ValueError:  # another profiler is active (e.g. the whole run is under cProfile)
+                        profile = None
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._profiled_runs[stage] += 1
+            if tracing:
+                self._peaks[stage] = max(self._peaks.get(stage, 0), tracemalloc.get_traced_memory()[1])
+                if self._allocation_runs[stage] < self.allocation_runs:
+                    self._add_allocations(stage, tracemalloc.take_snapshot())
+                tracemalloc.stop()
+            if deep:
+                self._exclusive.release()
+            if track:
+                self._active[tid].pop()
+
+    def _add_allocations(self, stage, snapshot):
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, f) for f in (tracemalloc.__file__, __file__)])
+        for stat in snapshot.statistics("lineno"):
+            frame = stat.traceback[0]
+            key = f"{frame.filename}:{frame.lineno}"
+            self._allocations[stage][key] += stat.size
+            self._allocation_counts[stage][key] += stat.count
+        self._allocation_runs[stage] += 1
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                stages = self._active.get(tid)
+                try:
+                    stage = stages[-1] if stages else None
+                except IndexError:  # the stage ended while reading
+                    stage = None
+                if stage is None and frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.reverse()
+                self._samples[(stage or "unattributed",) + tuple(stack)] += 1
+
+    # ---------- reports ----------
+
+    def stage_samples(self) -> Counter:
+        totals = Counter()
+        for key, count in self._samples.items():
+            totals[key[0]] += count
+        return totals
+
+    def save(self) -> List[str]:
+        """
+        Writes the profile files and prints a short per-stage summary.
+
+        Returns:
+            list: Paths of the written files.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        written = []
+
+        collapsed_path = os.path.join(self.output_dir, "profile.collapsed")
+        with open(collapsed_path, "w", encoding="utf-8") as f:
+            for key, count in sorted(self._samples.items()):
+                f.write(";".join(part.replace(";", ",") for part in key) + f" {count}\n")
+        written.append(collapsed_path)
+
+        for stage, profile in self._profiles.items():
+            path = os.path.join(self.output_dir, f"{stage}.pstats")
+            profile.dump_stats(path)
+            written.append(path)
+
+        summary = self._summary()
+        summary_path = os.path.join(self.output_dir, "summary.txt")
+        with open(summary_path, "w", encoding="utf-8") as f:
+            f.write(summary)
+        written.append(summary_path)
+
+        if self._peaks or self._allocations:
+            allocations_path = os.path.join(self.output_dir, "allocations.txt")
+            with open(allocations_path, "w", encoding="utf-8") as f:
+                f.write(self._allocation_report())
+            written.append(allocations_path)
+
+        print(summary)
+        print(f"Profile written to {self.output_dir}: {', '.join(os.path.basename(p) for p in written)}")
+        return written
+
+    def _summary(self) -> str:
+        totals = self.stage_samples()
+        all_samples = sum(totals.values()) or 1
+        self_time: Dict[str, Counter] = defaultdict(Counter)
+        for key, count in self._samples.items():
+            self_time[key[0]][key[-1]] += count
+
+        lines = [f"Sampled profile ({sum(totals.values())} samples every {self.interval * 1000:.0f} ms, all threads):"]
+        for stage, count in totals.most_common():
+            runs = f", {self._profiled_runs[stage]} runs in {stage}.pstats" if self._profiled_runs[stage] else ""
+            lines.append(f"  {stage:<13} {count:7d} samples {100 * count / all_samples:5.1f}%{runs}")
+            for function, function_count in self_time[stage].most_common(min(5, self.top_n)):
+                lines.append(f"      {100 * function_count / count:5.1f}%  {function}")
+        return "\n".join(lines) + "\n"
+
+    def _allocation_report(self) -> str:
+        lines = []
+        for stage in [s for s in CPU_STAGES if s in self._peaks or s in self._allocations]:
+            lines.append(f"{stage}: peak {self._peaks.get(stage, 0) / 1024 / 1024:.1f} MB allocated during the stage, "
+                         f"allocations alive at its end over {self._allocation_runs[stage]} runs:")
+            for key, size in self._allocations[stage].most_common(self.top_n):
+                lines.append(f"  {size / 1024:10.1f} KB  {self._allocation_counts[stage][key]:7d} blocks  {key}")
+            lines.append("")
+        return "\n".join(lines)
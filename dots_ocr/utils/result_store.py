@@ -0,0 +1,374 @@
+"""
+SQLite Result Store for dots.ocr
+
+Keeps parsed documents, pages and layout cells in one indexed SQLite
+database, so questions like "all Tables of documents X and Y" or "pages whose
+JSON output failed" are a query instead of a walk over thousands of per-page
+files. Cell text is indexed with FTS5 (when SQLite is built with it).
+
+The store is fed page by page by the "sqlite" output sink of DotsOCRParser,
+or imported from an existing output directory with the ingest command.
+
+Usage:
+    python -m dots_ocr.utils.result_store results.sqlite3 documents
+    python -m dots_ocr.utils.result_store results.sqlite3 cells --category Table --document report_a report_b
+    python -m dots_ocr.utils.result_store results.sqlite3 pages --status filtered
+    python -m dots_ocr.utils.result_store results.sqlite3 search "revenue growth" --category Text
+    python -m dots_ocr.utils.result_store results.sqlite3 ingest ./output
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+STATUS_OK = "ok"
+STATUS_FILTERED = "filtered"   # the model output was not valid JSON, only cleaned text is kept
+STATUS_ERROR = "error"         # the API request failed, the page holds no content
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    num_pages INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    UNIQUE (path, name)
+);
+CREATE TABLE IF NOT EXISTS pages (
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    page_no INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    input_width INTEGER,
+    input_height INTEGER,
+    num_cells INTEGER NOT NULL DEFAULT 0,
+    md_content TEXT,
+    md_content_nohf TEXT,
+    raw_output TEXT,
+    layout_image_path TEXT,
+    PRIMARY KEY (document_id, page_no)
+);
+CREATE TABLE IF NOT EXISTS cells (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL,
+    page_no INTEGER NOT NULL,
+    cell_no INTEGER NOT NULL,
+    category TEXT,
+    x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER,
+    text TEXT,
+    extra TEXT,
+    FOREIGN KEY (document_id, page_no) REFERENCES pages(document_id, page_no) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_documents_name ON documents(name);
+CREATE INDEX IF NOT EXISTS idx_pages_status ON pages(status);
+CREATE INDEX IF NOT EXISTS idx_cells_page ON cells(document_id, page_no);
+CREATE INDEX IF NOT EXISTS idx_cells_category ON cells(category, document_id);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS cells_fts USING fts5(text, content='cells', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS cells_fts_insert AFTER INSERT ON cells BEGIN
+    INSERT INTO cells_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS cells_fts_delete AFTER DELETE ON cells BEGIN
+    INSERT INTO cells_fts(cells_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+_CELL_KEYS = ('bbox', 'category', 'text')
+
+
+class ResultStore:
+    """
+    Indexed SQLite store of documents, pages and cells.
+
+    Thread-safe: all pages of a document may be upserted from parser worker
+    threads. Each upsert is one transaction, so readers never see half a page.
+
+    Args:
+        db_path: Path of the database file, created if missing.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(_SCHEMA)
+        try:
+            self._conn.executescript(_FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: search() falls back to LIKE
+            self.has_fts = False
+        self._conn.commit()
+
+    # ==================== Writing ====================
+
+    def _document_id(self, name: str, path: str) -> int:
+        self._conn.execute(
+            "INSERT INTO documents (name, path, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT (path, name) DO UPDATE SET updated = excluded.updated",
+            (name, path, time.time()),
+        )
+        return self._conn.execute("SELECT id FROM documents WHERE path = ? AND name = ?", (path, name)).fetchone()[0]
+
+    @staticmethod
+    def _cell_row(document_id, page_no, cell_no, cell):
+        bbox = cell.get('bbox') or [None] * 4
+        extra = {k: v for k, v in cell.items() if k not in _CELL_KEYS}
+        return (
+            document_id, page_no, cell_no, cell.get('category'),
+            *[int(v) if v is not None else None for v in bbox[:4]],
+            cell.get('text'), json.dumps(extra, ensure_ascii=False) if extra else None,
+        )
+
+    def upsert_page(self, document: str, result: dict, path: str = ""):
+        """
+        Inserts or replaces one page and its cells.
+
+        Args:
+            document: Name of the document (the input file name without extension).
+            result: Page result of DotsOCRParser with its content in memory
+                ('cells', 'md_content', ...).
+            path: Output directory of the document; together with the name it identifies the document.
+        """
+        page_no = result.get('page_no', 0)
+        cells = result.get('cells')
+        if result.get('error'):
+            status = STATUS_ERROR
+        else:
+            status = STATUS_FILTERED if result.get('filtered') else STATUS_OK
+        cell_list = cells if isinstance(cells, list) else []
+        raw_output = cells if isinstance(cells, str) else None
+
+        with self._lock, self._conn:
+            document_id = self._document_id(document, path)
+            self._conn.execute("DELETE FROM cells WHERE document_id = ? AND page_no = ?", (document_id, page_no))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    document_id, page_no, status,
+                    result.get('input_width'), result.get('input_height'), len(cell_list),
+                    result.get('md_content'), result.get('md_content_nohf'), raw_output,
+                    result.get('layout_image_path'),
+                ),
+            )
+            self._conn.executemany(
+                "INSERT INTO cells (document_id, page_no, cell_no, category, x1, y1, x2, y2, text, extra) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._cell_row(document_id, page_no, i, cell) for i, cell in enumerate(cell_list) if isinstance(cell, dict)],
+            )
+            self._conn.execute(
+                "UPDATE documents SET num_pages = (SELECT COUNT(*) FROM pages WHERE document_id = ?) WHERE id = ?",
+                (document_id, document_id),
+            )
+
+    def delete_document(self, document: str, path: Optional[str] = None):
+        """Removes a document with all its pages and cells"""
+        where, params = ("name = ? AND path = ?", (document, path)) if path is not None else ("name = ?", (document,))
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM documents WHERE {where}", params)
+
+    def ingest_output_dir(self, output_dir: str) -> int:
+        """
+        Imports results written by the "files" output sink: every <name>.jsonl
+        index in output_dir and the per-page files it lists.
+
+        Returns:
+            int: Number of pages imported.
+        """
+        count = 0
+        for index_name in sorted(os.listdir(output_dir)):
+            if not index_name.endswith('.jsonl') or index_name.endswith('_pages.jsonl'):
+                continue
+            document = index_name[:-len('.jsonl')]
+            with open(os.path.join(output_dir, index_name), 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    for key, path_key in (('cells', 'layout_info_path'), ('md_content', 'md_content_path'), ('md_content_nohf', 'md_content_nohf_path')):
+                        path = result.get(path_key)
+                        if path and os.path.exists(path):
+                            with open(path, 'r', encoding='utf-8') as content:
+                                result[key] = json.load(content) if key == 'cells' else content.read()
+                    self.upsert_page(document, result, path=os.path.join(os.path.abspath(output_dir), document))
+                    count += 1
+        return count
+
+    # ==================== Querying ====================
+
+    def _query(self, sql: str, params: Sequence = ()) -> List[dict]:
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    @staticmethod
+    def _filters(documents=None, category=None, page_range=None, prefix="c") -> Tuple[List[str], List]:
+        clauses, params = [], []
+        if documents:
+            documents = [documents] if isinstance(documents, str) else list(documents)
+            clauses.append(f"d.name IN ({', '.join('?' * len(documents))})")
+            params.extend(documents)
+        if category:
+            categories = [category] if isinstance(category, str) else list(category)
+            clauses.append(f"{prefix}.category IN ({', '.join('?' * len(categories))})")
+            params.extend(categories)
+        if page_range is not None:
+            clauses.append(f"{prefix}.page_no BETWEEN ? AND ?")
+            params.extend(page_range)
+        return clauses, params
+
+    def documents(self) -> List[dict]:
+        """Lists all documents with their page and cell counts"""
+        return self._query(
+            "SELECT d.id, d.name, d.path, d.num_pages, "
+            "(SELECT COUNT(*) FROM cells c WHERE c.document_id = d.id) AS num_cells, "
+            "(SELECT COUNT(*) FROM pages p WHERE p.document_id = d.id AND p.status = ?) AS num_filtered "
+            "FROM documents d ORDER BY d.name, d.id",
+            (STATUS_FILTERED,),
+        )
+
+    def pages(self, documents=None, status: Optional[str] = None, page_range: Optional[Tuple[int, int]] = None,
+              with_content: bool = False, limit: Optional[int] = None) -> List[dict]:
+        """
+        Lists pages, optionally only those with a given status ("ok", "filtered" or "error").
+
+        Args:
+            documents: Document name or names.
+            status: Page status to select.
+            page_range: Inclusive (first, last) page numbers.
+            with_content: Also return the markdown and raw output.
+            limit: Maximum number of rows.
+        """
+        clauses, params = self._filters(documents, None, page_range, prefix="p")
+        if status:
+            clauses.append("p.status = ?")
+            params.append(status)
+        columns = "d.name AS document, p.page_no, p.status, p.num_cells, p.input_width, p.input_height, p.layout_image_path"
+        if with_content:
+            columns += ", p.md_content, p.md_content_nohf, p.raw_output"
+        sql = f"SELECT {columns} FROM pages p JOIN documents d ON d.id = p.document_id"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY d.name, p.page_no"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return self._query(sql, params)
+
+    def cells(self, documents=None, category=None, page_range: Optional[Tuple[int, int]] = None,
+              limit: Optional[int] = None) -> List[dict]:
+        """
+        Lists cells in reading order, e.g. all Tables of some documents.
+
+        Args:
+            documents: Document name or names.
+            category: Category or categories, e.g. "Table".
+            page_range: Inclusive (first, last) page numbers.
+            limit: Maximum number of rows.
+        """
+        clauses, params = self._filters(documents, category, page_range)
+        sql = (
+            "SELECT d.name AS document, c.page_no, c.cell_no, c.category, c.x1, c.y1, c.x2, c.y2, c.text "
+            "FROM cells c JOIN documents d ON d.id = c.document_id"
+        )
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY d.name, c.page_no, c.cell_no"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return self._query(sql, params)
+
+    def search(self, query: str, documents=None, category=None, limit: int = 20) -> List[dict]:
+        """
+        Full-text search over cell text, best matches first.
+
+        Args:
+            query: FTS5 query, e.g. 'revenue NEAR growth' or '"net income"'.
+            documents: Document name or names.
+            category: Category or categories.
+            limit: Maximum number of rows.
+        """
+        clauses, params = self._filters(documents, category)
+        columns = "d.name AS document, c.page_no, c.cell_no, c.category, c.text"
+        if self.has_fts:
+            sql = (
+                f"SELECT {columns}, bm25(cells_fts) AS score FROM cells_fts "
+                "JOIN cells c ON c.id = cells_fts.rowid JOIN documents d ON d.id = c.document_id "
+                "WHERE cells_fts MATCH ?"
+            )
+            order = "score"
+        else:
+            sql = f"SELECT {columns} FROM cells c JOIN documents d ON d.id = c.document_id WHERE c.text LIKE ?"
+            query = f"%{query}%"
+            order = "d.name, c.page_no, c.cell_no"
+        if clauses:
+            sql += " AND " + " AND ".join(clauses)
+        sql += f" ORDER BY {order} LIMIT {int(limit)}"
+        return self._query(sql, [query, *params])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _print_rows(rows: Iterable[dict]):
+    for row in rows:
+        print(json.dumps(row, ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query a dots.ocr SQLite result store")
+    parser.add_argument("db_path", type=str, help="Path of the result store")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("documents", help="List documents")
+
+    pages = commands.add_parser("pages", help="List pages")
+    pages.add_argument("--document", nargs="+", help="Document names")
+    pages.add_argument("--status", choices=[STATUS_OK, STATUS_FILTERED, STATUS_ERROR], help="Only pages with this status")
+    pages.add_argument("--pages", type=int, nargs=2, metavar=("FIRST", "LAST"), help="Inclusive page range")
+    pages.add_argument("--content", action="store_true", help="Include the markdown")
+    pages.add_argument("--limit", type=int, default=None)
+
+    cells = commands.add_parser("cells", help="List cells")
+    cells.add_argument("--document", nargs="+", help="Document names")
+    cells.add_argument("--category", nargs="+", help="Categories, e.g. Table Formula")
+    cells.add_argument("--pages", type=int, nargs=2, metavar=("FIRST", "LAST"), help="Inclusive page range")
+    cells.add_argument("--limit", type=int, default=None)
+
+    search = commands.add_parser("search", help="Full-text search over cell text")
+    search.add_argument("query", type=str)
+    search.add_argument("--document", nargs="+", help="Document names")
+    search.add_argument("--category", nargs="+", help="Categories")
+    search.add_argument("--limit", type=int, default=20)
+
+    ingest = commands.add_parser("ingest", help="Import an output directory written with --output_sink files")
+    ingest.add_argument("output_dir", type=str)
+
+    args = parser.parse_args()
+    store = ResultStore(args.db_path)
+    try:
+        if args.command == "documents":
+            _print_rows(store.documents())
+        elif args.command == "pages":
+            _print_rows(store.pages(args.document, args.status, args.pages, with_content=args.content, limit=args.limit))
+        elif args.command == "cells":
+            _print_rows(store.cells(args.document, args.category, args.pages, limit=args.limit))
+        elif args.command == "search":
+            _print_rows(store.search(args.query, args.document, args.category, limit=args.limit))
+        elif args.command == "ingest":
+            print(f"Imported {store.ingest_output_dir(args.output_dir)} pages into {args.db_path}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Per-stage Timing for dots.ocr
+
+Every page is timed with a StageTimer while it moves through the pipeline:
+
+    render       rasterizing the PDF page / loading the image
+    queue_wait   waiting for a free worker slot or API budget
+    resize       smart-resizing the image to the model input
+    encode       PNG + base64 encoding of the request payload
+    throttle     request_delay, the tokens-per-minute budget and 429 pauses of other requests
+    request      time spent in API calls (all attempts)
+    retry_sleep  backoff sleeps between attempts
+    post_process parsing and cleaning the model output
+    markdown     rendering the markdown variants
+    write        writing the page through the output sink
+
+The durations (in milliseconds) end up in the page result under 'timings',
+together with 'payload_bytes', 'retries', the token 'usage' reported by the
+provider and the 'estimated_tokens'. summarize_timings aggregates the results
+of a run into p50/p95/p99 per stage and token totals.
+
+Stage observers (add_stage_observer) see every finished stage as it happens;
+the metrics registry and the trace recorder are built on them. Stage wrappers
+(add_stage_wrapper) run around every stage, which the profiler uses.
+"""
+
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+STAGES = (
+    "render", "queue_wait", "resize", "encode", "throttle",
+    "request", "retry_sleep", "post_process", "markdown", "write",
+)
+
+# Called as observer(timer, stage, start, end) with perf_counter timestamps
+_stage_observers: List[Callable] = []
+
+
+def add_stage_observer(observer: Callable):
+    """Registers a callable that is notified of every finished stage of every StageTimer"""
+    if observer not in _stage_observers:
+        _stage_observers.append(observer)
+
+
+def remove_stage_observer(observer: Callable):
+    if observer in _stage_observers:
+        _stage_observers.remove(observer)
+
+
+# Called as wrapper(timer, stage), returning a context manager entered around the stage
+_stage_wrappers: List[Callable] = []
+
+
+def add_stage_wrapper(wrapper: Callable):
+    """Registers a context manager factory that is entered around every stage of every StageTimer"""
+    if wrapper not in _stage_wrappers:
+        _stage_wrappers.append(wrapper)
+
+
+def remove_stage_wrapper(wrapper: Callable):
+    if wrapper in _stage_wrappers:
+        _stage_wrappers.remove(wrapper)
+
+
+class StageTimer:
+    """
+    Accumulates monotonic durations per stage and a few counters for one page.
+
+    Args:
+        label: Name of the timed unit for observers, e.g. "report page 3".
+    """
+
+    __slots__ = ("label", "durations", "payload_bytes", "retries", "usage", "estimated_tokens")
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.durations: Dict[str, float] = {}
+        self.payload_bytes = 0
+        self.retries = 0
+        # Token usage reported by the provider and estimated before sending, see dots_ocr.model.tokens
+        self.usage: Optional[Dict[str, int]] = None
+        self.estimated_tokens: Optional[Dict[str, int]] = None
+
+    def add(self, stage: str, seconds: float):
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage: str):
+        with ExitStack() as wrappers:
+            for wrapper in list(_stage_wrappers):
+                wrappers.enter_context(wrapper(self, stage))
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                end = time.perf_counter()
+                self.add(stage, end - start)
+                for observer in _stage_observers:
+                    observer(self, stage, start, end)
+
+    def call(self, stage: str, fn: Callable, *args, **kwargs):
+        """Runs fn as one stage; handy with asyncio.to_thread, so the stage is timed in the worker thread"""
+        with self.stage(stage):
+            return fn(*args, **kwargs)
+
+    def timings_ms(self) -> Dict[str, float]:
+        """Durations in milliseconds, in pipeline order"""
+        ordered = [s for s in STAGES if s in self.durations] + [s for s in self.durations if s not in STAGES]
+        return {s: round(self.durations[s] * 1000, 3) for s in ordered}
+
+    def record(self, result: dict) -> dict:
+        """Stores the timings and counters in a page result"""
+        result['timings'] = self.timings_ms()
+        result['payload_bytes'] = self.payload_bytes
+        result['retries'] = self.retries
+        result['usage'] = self.usage
+        result['estimated_tokens'] = self.estimated_tokens
+        return result
+
+
+def summarize_timings(results: Iterable[dict]) -> dict:
+    """
+    Aggregates the timings of page results.
+
+    Args:
+        results: Page results carrying 'timings' (others are skipped).
+
+    Returns:
+        dict: {'pages', 'payload_bytes', 'retries', 'tokens', 'stages': {stage: {'count', 'total_ms', 'p50', 'p95', 'p99'}}}
+            'tokens' sums the reported usage ('prompt_tokens', 'completion_tokens')
+            and the estimates ('estimated_input_tokens', 'estimated_output_tokens').
+    """
+    per_stage: Dict[str, List[float]] = {}
+    pages = payload_bytes = retries = 0
+    tokens = dict.fromkeys(('prompt_tokens', 'completion_tokens', 'estimated_input_tokens', 'estimated_output_tokens'), 0)
+    for result in results:
+        timings = result.get('timings')
+        if not timings:
+            continue
+        pages += 1
+        payload_bytes += result.get('payload_bytes', 0)
+        retries += result.get('retries', 0)
+        usage = result.get('usage') or {}
+        estimated = result.get('estimated_tokens') or {}
+        tokens['prompt_tokens'] += usage.get('prompt_tokens', 0)
+        tokens['completion_tokens'] += usage.get('completion_tokens', 0)
+        tokens['estimated_input_tokens'] += estimated.get('input_tokens', 0)
+        tokens['estimated_output_tokens'] += estimated.get('output_tokens', 0)
+        for stage, ms in timings.items():
+            per_stage.setdefault(stage, []).append(ms)
+
+    stages = {}
+    for stage in [s for s in STAGES if s in per_stage] + [s for s in per_stage if s not in STAGES]:
+        values = np.asarray(per_stage[stage])
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        stages[stage] = {
+            'count': len(values),
+            'total_ms': round(float(values.sum()), 3),
+            'p50': round(float(p50), 3),
+            'p95': round(float(p95), 3),
+            'p99': round(float(p99), 3),
+        }
+    return {'pages': pages, 'payload_bytes': payload_bytes, 'retries': retries, 'tokens': tokens, 'stages': stages}
+
+
+def format_timing_summary(summary: dict) -> str:
+    """Formats a summary of summarize_timings as a table"""
+    lines = [
+        f"Timing summary: {summary['pages']} pages, {summary['payload_bytes'] / 1024 / 1024:.2f} MB uploaded, {summary['retries']} retries",
+        f"  {'stage':<13}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'total s':>10}",
+    ]
+    for stage, stats in summary['stages'].items():
+        lines.append(
+            f"  {stage:<13}{stats['p50']:>11.1f}{stats['p95']:>11.1f}{stats['p99']:>11.1f}{stats['total_ms'] / 1000:>10.2f}"
+        )
+    tokens = summary.get('tokens')
+    if tokens and any(tokens.values()):
+        lines.append(
+            f"Tokens: {tokens['prompt_tokens']:,} prompt + {tokens['completion_tokens']:,} completion reported, "
+            f"{tokens['estimated_input_tokens']:,} input estimated ({tokens['estimated_output_tokens']:,} output at most)"
+        )
+    return "\n".join(lines)
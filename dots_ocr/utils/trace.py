@@ -0,0 +1,73 @@
+"""
+Trace Export for dots.ocr
+
+TraceRecorder collects every timed stage (see dots_ocr.utils.timing) as a span
+and writes them in the Chrome trace event format, which chrome://tracing and
+https://ui.perfetto.dev open directly. Every page gets its own row, so gaps
+where no page is requesting show up as empty stretches across all rows.
+
+    recorder = TraceRecorder().start()
+    parser.parse_file("report.pdf")
+    recorder.stop()
+    recorder.save("report.trace.json")
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List
+
+from dots_ocr.utils.timing import add_stage_observer, remove_stage_observer
+
+
+class TraceRecorder:
+    """Records stage spans of all StageTimers while started"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._events: List[dict] = []
+        self._rows: Dict[object, int] = {}   # timer -> row (tid); keeping the timers alive keeps their ids unique
+        self._pid = os.getpid()
+
+    def start(self) -> "TraceRecorder":
+        add_stage_observer(self.observe)
+        return self
+
+    def stop(self):
+        remove_stage_observer(self.observe)
+
+    def observe(self, timer, stage: str, start: float, end: float):
+        """Stage observer adding one complete ("X") event per stage"""
+        with self._lock:
+            row = self._rows.get(timer)
+            if row is None:
+                row = len(self._rows) + 1
+                self._rows[timer] = row
+                # Names the row in the viewer
+                self._events.append({
+                    "name": "thread_name", "ph": "M", "pid": self._pid, "tid": row,
+                    "args": {"name": timer.label or f"unit {row}"},
+                })
+            self._events.append({
+                "name": stage,
+                "cat": "stage",
+                "ph": "X",
+                "ts": round((start - self._origin) * 1e6, 1),
+                "dur": round((end - start) * 1e6, 1),
+                "pid": self._pid,
+                "tid": row,
+                "args": {"label": timer.label},
+            })
+
+    def to_chrome_trace(self) -> dict:
+        with self._lock:
+            events = list(self._events)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, path: str):
+        """Writes the trace as JSON"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f)
+        print(f"Trace with {len(self._rows)} rows written to {path}")
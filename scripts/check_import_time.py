@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Import-time regression check for dots_ocr
+
+Imports each module in a fresh interpreter and checks that:
+- the import stays within its time budget (cumulative time reported by
+  python -X importtime, best of several runs),
+- heavy dependencies (openai, PyMuPDF, requests, pydantic, ...) are not
+  imported until they are used,
+- importing prints nothing (no warnings or other import-time side effects).
+
+Exits with status 1 when a check fails, so it can run in CI.
+
+Usage:
+    python scripts/check_import_time.py
+    python scripts/check_import_time.py --repeat 10 --budget dots_ocr.parser=500
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module -> import time budget in milliseconds
+BUDGETS = {
+    "dots_ocr": 50,
+    "dots_ocr.parser": 400,
+    "dots_ocr.model.inference": 300,
+    "dots_ocr.utils.result_store": 100,
+}
+# Must not be imported by importing any of the modules above
+DEFERRED = ["openai", "httpx", "requests", "fitz", "pymupdf", "pydantic", "dotenv", "tqdm", "gradio", "http.server"]
+
+
+def run_python(args):
+    return subprocess.run([sys.executable] + args, cwd=ROOT_DIR, capture_output=True, text=True)
+
+
+def import_time_ms(module):
+    """Cumulative import time of module in a fresh interpreter"""
+    proc = run_python(["-X", "importtime", "-c", f"import {module}"])
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr}")
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if line.startswith("import time:") and line.split("|")[-1].strip() == module and not line.split("|")[-1][1:2].isspace():
+            return int(line.split("|")[1]) / 1000
+    raise RuntimeError(f"no import time reported for {module}")
+
+
+def imported_modules(module):
+    """Modules loaded by importing module, and what the import printed"""
+    code = f"import sys, json; import {module}; print(json.dumps(sorted(sys.modules)))"
+    proc = run_python(["-c", code])
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr}")
+    *printed, modules = proc.stdout.rstrip("\n").split("\n")
+    return set(json.loads(modules)), "\n".join(printed + [proc.stderr]).strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of dots_ocr modules")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per module; the fastest one counts")
+    parser.add_argument("--budget", action="append", default=[], metavar="MODULE=MS", help="Override or add a budget")
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS)
+    for item in args.budget:
+        module, _, ms = item.partition("=")
+        budgets[module] = float(ms)
+
+    failures = []
+    for module, budget in budgets.items():
+        best = min(import_time_ms(module) for _ in range(args.repeat))
+        modules, printed = imported_modules(module)
+        loaded = [name for name in DEFERRED if name in modules]
+        status = "ok" if best <= budget and not loaded and not printed else "FAIL"
+        print(f"{status:<4}  {module:<30} {best:8.1f} ms  (budget {budget:.0f} ms)")
+        if best > budget:
+            failures.append(f"{module} took {best:.1f} ms, budget {budget:.0f} ms")
+        if loaded:
+            failures.append(f"{module} imports {', '.join(loaded)} at import time")
+        if printed:
+            failures.append(f"{module} prints at import time: {printed}")
+
+    if failures:
+        print("\nImport-time check failed:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    print("\nImport-time check passed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())